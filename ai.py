@@ -1,16 +1,207 @@
 import os
+import random
 import re
-from typing import Any, Dict
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
 
+import metrics
+import retrieval
 import services as svc
 
+# -------------------- Cliente OpenAI (compartido) --------------------
+# Timeouts estrictos y reintentos acotados: el hilo de Streamlit nunca queda
+# colgado más de ~OPENAI_DEADLINE segundos antes de caer al modo local.
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("CPF_OPENAI_CONNECT_TIMEOUT", "3"))
+OPENAI_READ_TIMEOUT = float(os.getenv("CPF_OPENAI_READ_TIMEOUT", "12"))
+OPENAI_MAX_RETRIES = int(os.getenv("CPF_OPENAI_MAX_RETRIES", "2"))
+OPENAI_DEADLINE = float(os.getenv("CPF_OPENAI_DEADLINE", "20"))
+OPENAI_BREAKER_FAILURES = int(os.getenv("CPF_OPENAI_BREAKER_FAILURES", "3"))
+OPENAI_BREAKER_COOLDOWN = float(os.getenv("CPF_OPENAI_BREAKER_COOLDOWN", "60"))
 
+_BACKOFF_BASE = 0.3
+_BACKOFF_MAX = 4.0
+# Con menos tiempo que esto hasta el deadline no vale la pena otro intento
+_MIN_ATTEMPT_S = 1.0
+
+
+class CircuitBreaker:
+    """Cortocircuito simple: tras N fallas seguidas queda abierto `cooldown` segundos.
+
+    Pasado el cooldown deja pasar una sola llamada de prueba (half-open); si
+    funciona se cierra, si falla vuelve a abrirse.
+    """
+
+    def __init__(self, failures: int, cooldown: float):
+        self.max_failures = max(1, int(failures))
+        self.cooldown = float(cooldown)
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return "half-open"
+        return "open"
+
+    def allow(self) -> bool:
+        with self._lock:
+            st = self.state
+            if st == "closed":
+                return True
+            if st == "half-open" and not self._probe:
+                self._probe = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._probe = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._probe = False
+            if self.opened_at is not None or self.failures >= self.max_failures:
+                self.opened_at = time.monotonic()
+
+
+_breaker = CircuitBreaker(OPENAI_BREAKER_FAILURES, OPENAI_BREAKER_COOLDOWN)
+_client_lock = threading.Lock()
+_client = None
+
+_metrics_lock = threading.Lock()
+_METRICS: Dict[str, Any] = {
+    "calls": 0,
+    "ok": 0,
+    "errors": 0,
+    "retries": 0,
+    "short_circuited": 0,
+    "last_error": None,
+    "latency_ms": deque(maxlen=200),
+}
+
+
+def _metric(key: str, value: Any = 1) -> None:
+    with _metrics_lock:
+        if key == "latency_ms":
+            _METRICS["latency_ms"].append(value)
+        elif key == "last_error":
+            _METRICS["last_error"] = value
+        else:
+            _METRICS[key] += value
+
+
+def openai_metrics() -> Dict[str, Any]:
+    """Contadores y latencias (ms) de las llamadas a OpenAI en este proceso."""
+    with _metrics_lock:
+        lat = sorted(_METRICS["latency_ms"])
+        out = {k: v for k, v in _METRICS.items() if k != "latency_ms"}
+    out["breaker"] = _breaker.state
+    out["p50_ms"] = lat[len(lat) // 2] if lat else None
+    out["p95_ms"] = lat[min(len(lat) - 1, int(len(lat) * 0.95))] if lat else None
+    return out
+
+
+def _get_client():
+    """Cliente OpenAI único por proceso (reusa conexiones HTTP)."""
+    global _client
+    if _client is not None:
+        return _client
+    with _client_lock:
+        if _client is None:
+            import httpx  # dependencia de openai
+            from openai import OpenAI  # type: ignore
+
+            _client = OpenAI(
+                base_url=os.getenv("CPF_OPENAI_BASE_URL") or None,
+                timeout=httpx.Timeout(OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+                max_retries=0,  # los reintentos los manejamos acá (con jitter y deadline)
+            )
+        return _client
+
+
+def reset_openai_client() -> None:
+    """Descarta el cliente compartido y el estado del cortocircuito (p.ej. tras cambiar la config)."""
+    global _client
+    with _client_lock:
+        _client = None
+    _breaker.record_success()
+
+
+def _is_retryable(exc: Exception) -> bool:
+    name = type(exc).__name__
+    if name in ("APITimeoutError", "APIConnectionError", "RateLimitError", "InternalServerError"):
+        return True
+    status = getattr(exc, "status_code", None)
+    return isinstance(status, int) and (status == 429 or status >= 500)
+
+
+def _chat_completion(messages: List[Dict[str, str]], model: str) -> Optional[str]:
+    """Llama a OpenAI con reintentos acotados; None si hay que caer al modo local."""
+    if not _breaker.allow():
+        _metric("short_circuited")
+        return None
+    _metric("calls")
+    deadline = time.monotonic() + OPENAI_DEADLINE
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        left = deadline - time.monotonic()
+        if left < _MIN_ATTEMPT_S:
+            break
+        t0 = time.perf_counter()
+        try:
+            client = _get_client()
+            import httpx  # dependencia de openai (ya importada por _get_client)
+
+            # El timeout de cada intento se recorta a lo que queda del deadline
+            resp = client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=0.5,
+                max_tokens=500,
+                timeout=httpx.Timeout(min(OPENAI_READ_TIMEOUT, left), connect=min(OPENAI_CONNECT_TIMEOUT, left)),
+            )
+            _metric("latency_ms", round((time.perf_counter() - t0) * 1000, 1))
+            _metric("ok")
+            _breaker.record_success()
+            return (resp.choices[0].message.content or "").strip()
+        except Exception as e:
+            _metric("latency_ms", round((time.perf_counter() - t0) * 1000, 1))
+            _metric("last_error", f"{type(e).__name__}: {e}"[:200])
+            if attempt >= OPENAI_MAX_RETRIES or not _is_retryable(e):
+                break
+            sleep = min(_BACKOFF_MAX, _BACKOFF_BASE * (2 ** attempt)) * random.uniform(0.5, 1.5)
+            if time.monotonic() + sleep + OPENAI_CONNECT_TIMEOUT >= deadline:
+                break
+            _metric("retries")
+            time.sleep(sleep)
+    _metric("errors")
+    _breaker.record_failure()
+    return None
+
+
+def _retrieve(q: str):
+    """Pasajes locales (requerimientos abiertos + ayuda); nunca rompe el asistente."""
+    try:
+        return retrieval.retrieve(q, k=6)
+    except Exception:
+        return []
+
+
+@metrics.timed("assistant_answer")
 def assistant_answer(q: str, role: str = "user") -> Dict[str, Any]:
     """Asistente dentro del sistema CPF.
 
     Objetivo: ser flexible, conversacional y práctico.
-    - Si existe OPENAI_API_KEY: usa OpenAI.
-    - Si no existe: fallback local (sin LLM) pero amigable.
+    - Si existe OPENAI_API_KEY: usa OpenAI, con un contexto compacto de la recuperación local.
+    - Si no existe: recuperación local (requerimientos + ayuda) y fallback por palabras clave.
     """
 
     q = (q or "").strip()
@@ -40,12 +231,12 @@ def assistant_answer(q: str, role: str = "user") -> Dict[str, Any]:
             "table": None,
         }
 
+    hits = _retrieve(q)
+    table = retrieval.hits_table(hits) or None
+
     # OpenAI (si hay API key)
     if os.getenv("OPENAI_API_KEY"):
         try:
-            from openai import OpenAI  # type: ignore
-
-            client = OpenAI()
             try:
                 stats = svc.get_stats()
             except Exception:
@@ -63,26 +254,32 @@ def assistant_answer(q: str, role: str = "user") -> Dict[str, Any]:
                 "- Respuestas prácticas, con pasos.\n"
             )
             extra = f"Estado actual (aprox): {stats}\n" if stats else ""
+            if hits:
+                extra += (
+                    "Pasajes relevantes del sistema (usalos como fuente; citá los #ID de requerimientos):\n"
+                    + retrieval.compact_context(hits)
+                    + "\n"
+                )
 
             messages = [
                 {"role": "system", "content": system + extra},
                 {"role": "user", "content": f"Rol del usuario: {role}\nConsulta: {q}"},
             ]
             model = os.getenv("CPF_OPENAI_MODEL", "gpt-4o-mini")
-            resp = client.chat.completions.create(
-                model=model,
-                messages=messages,
-                temperature=0.5,
-                max_tokens=500,
-            )
-            ans = (resp.choices[0].message.content or "").strip()
+            ans = _chat_completion(messages, model)
             if ans:
-                return {"answer": ans, "table": None}
+                return {"answer": ans, "table": table}
         except Exception:
             # Si falla, seguimos con modo local
             pass
 
     # --------- MODO LOCAL (sin LLM) ----------
+    if hits and hits[0]["kind"] == "req" and table:
+        return {
+            "answer": f"Encontré {len(table)} requerimiento(s) abiertos relacionados. Si te interesa alguno, buscalo por ID en **Navegar** y solicitá contacto.",
+            "table": table,
+        }
+
     ql = q.lower()
 
     if any(w in ql for w in ["public", "oferta", "necesidad", "cargar", "crear requer"]):
@@ -133,6 +330,11 @@ def assistant_answer(q: str, role: str = "user") -> Dict[str, Any]:
             "table": None,
         }
 
+    help_hits = [h for h in hits if h["kind"] == "help"]
+    if help_hits:
+        h = help_hits[0]["doc"]
+        return {"answer": f"**{h['title']}**\n\n{h['text']}", "table": table}
+
     return {
         "answer": (
             "Dale. Para ayudarte bien, decime qué querés lograr.\n\n"
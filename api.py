@@ -0,0 +1,459 @@
+"""API HTTP/JSON liviana sobre la capa de servicios (para integraciones).
+
+Corre aparte de Streamlit:  python api.py   (o CPF_API_PORT=8502 python api.py)
+
+Endpoints (todas las respuestas son JSON):
+- GET  /api/requirements?q=&type=&status=&chamber_id=&category=&urgency=&tag=&region=&limit=&cursor=&facets=1
+- GET  /api/requirements/<id>
+- GET  /api/tags?prefix=&limit=                      (autocompletado de tags)
+- GET  /api/inbox?status=&limit=&cursor=              (Basic auth)
+- POST /api/contact-requests  {"requirement_id": N}   (Basic auth)
+- GET  /api/suggestions?limit=                       (Basic auth, contrapartes sugeridas)
+- GET  /api/admin/metrics                             (Basic auth, rol admin)
+
+Si `q` no tiene coincidencias exactas se devuelve una página aproximada
+(tolerante a errores de tipeo) con `"fuzzy": true`.
+
+Paginación por keyset: la respuesta trae `next_cursor`; se pasa tal cual como
+`cursor` para la página siguiente. Los GET devuelven un ETag derivado de la
+versión de los datos: con If-None-Match se responde 304 sin correr la consulta.
+El servidor es asyncio (conexiones) + un pool de hilos (consultas a la base).
+"""
+import asyncio
+import base64
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import metrics
+import services as svc
+from db import log
+
+API_HOST = os.environ.get("CPF_API_HOST", "0.0.0.0")
+API_PORT = int(os.environ.get("CPF_API_PORT", "8502"))
+API_WORKERS = int(os.environ.get("CPF_API_WORKERS", "8"))
+# /metrics (Prometheus) de este proceso; aparte del de Streamlit, que usa CPF_METRICS_PORT
+API_METRICS_PORT = int(os.environ.get("CPF_API_METRICS_PORT", "9465"))
+MAX_PAGE = 100
+DEFAULT_PAGE = 20
+GZIP_MIN_BYTES = 1024
+MAX_BODY_BYTES = 64 * 1024
+AUTH_CACHE_TTL = float(os.environ.get("CPF_API_AUTH_CACHE_S", "60"))
+KEEPALIVE_SECONDS = 15
+# Campos de un requerimiento que expone la API (los mismos que devuelve svc.search_requirements)
+PUBLIC_REQUIREMENT_FIELDS = (
+    "id", "type", "title", "description", "category", "urgency", "tags", "status", "company",
+    "location", "province_code", "city_code", "chamber_id", "user_id", "created_at", "chamber_name",
+)
+
+_REASONS = {
+    200: "OK",
+    201: "Created",
+    304: "Not Modified",
+    400: "Bad Request",
+    401: "Unauthorized",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class Request:
+    def __init__(self, method: str, target: str, headers: Dict[str, str], body: bytes):
+        parts = urlsplit(target)
+        self.method = method
+        self.path = parts.path.rstrip("/") or "/"
+        self.query = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        self.raw_query = parts.query
+        self.headers = headers
+        self.body = body
+        self.user: Optional[Dict[str, Any]] = None
+
+    def json(self) -> Dict[str, Any]:
+        try:
+            data = json.loads(self.body.decode("utf-8") or "{}")
+        except ValueError:
+            raise ApiError(400, "JSON inválido")
+        if not isinstance(data, dict):
+            raise ApiError(400, "se esperaba un objeto JSON")
+        return data
+
+
+# -------------------- Auth (Basic, con cache) --------------------
+# bcrypt con 12 rounds cuesta ~0.25 s: cacheamos credenciales ya verificadas
+# (por hash, nunca la clave en claro) durante AUTH_CACHE_TTL segundos.
+_auth_cache: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+_auth_lock = threading.Lock()
+_AUTH_HIT = metrics.CACHE_REQUESTS.labels("api_auth", "hit")
+_AUTH_MISS = metrics.CACHE_REQUESTS.labels("api_auth", "miss")
+
+
+def _authenticate(req: Request) -> Dict[str, Any]:
+    header = req.headers.get("authorization", "")
+    if not header.lower().startswith("basic "):
+        raise ApiError(401, "se requiere autenticación")
+    try:
+        email, password = base64.b64decode(header[6:].strip()).decode("utf-8").split(":", 1)
+    except Exception:
+        raise ApiError(401, "credenciales inválidas")
+    key = hashlib.sha256(f"{email.strip().lower()}\0{password}".encode("utf-8")).hexdigest()
+    now = time.monotonic()
+    with _auth_lock:
+        hit = _auth_cache.get(key)
+        if hit and hit[0] > now:
+            _AUTH_HIT.inc()
+            return hit[1]
+    _AUTH_MISS.inc()
+    from auth import authenticate
+
+    u = authenticate(email, password)
+    if not u:
+        raise ApiError(401, "credenciales inválidas")
+    user = {k: u[k] for k in ("id", "email", "name", "role", "company")}
+    with _auth_lock:
+        if len(_auth_cache) > 1000:
+            _auth_cache.clear()
+        _auth_cache[key] = (now + AUTH_CACHE_TTL, user)
+    return user
+
+
+# -------------------- Helpers --------------------
+def _limit(req: Request) -> int:
+    try:
+        n = int(req.query.get("limit", DEFAULT_PAGE))
+    except ValueError:
+        raise ApiError(400, "limit inválido")
+    return max(1, min(MAX_PAGE, n))
+
+
+def _encode_cursor(row: Dict[str, Any]) -> str:
+    raw = f"{row['created_at']}|{row['id']}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(req: Request) -> Optional[Tuple[str, int]]:
+    cur = req.query.get("cursor")
+    if not cur:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cur + "=" * (-len(cur) % 4)).decode("utf-8")
+        created_at, rid = raw.rsplit("|", 1)
+        return created_at, int(rid)
+    except Exception:
+        raise ApiError(400, "cursor inválido")
+
+
+def _page(rows: List[Dict[str, Any]], limit: int) -> Dict[str, Any]:
+    # Se pide limit+1 para saber si hay otra página sin un COUNT(*)
+    more = len(rows) > limit
+    rows = rows[:limit]
+    return {"items": rows, "next_cursor": _encode_cursor(rows[-1]) if more and rows else None}
+
+
+# -------------------- Handlers --------------------
+# Cada ruta declara opcionalmente `version(req)`: un string barato que cambia
+# cuando cambian los datos que devuelve. Con él se arma el ETag antes de
+# ejecutar la consulta principal; se lee por el mismo camino que el cuerpo
+# (snapshot de lectura si está activo) y antes que él, así el ETag nunca es
+# más nuevo que los datos que acompaña.
+def _requirements_version(req: Request) -> str:
+    return svc.requirements_version()
+
+
+def list_requirements(req: Request) -> Dict[str, Any]:
+    limit = _limit(req)
+    try:
+        chamber_id = int(req.query["chamber_id"]) if req.query.get("chamber_id") else None
+    except ValueError:
+        raise ApiError(400, "chamber_id inválido")
+    filters = dict(
+        q=req.query.get("q", ""),
+        type_=req.query.get("type") or "(Todos)",
+        status=req.query.get("status", "open"),
+        chamber_id=chamber_id,
+        category=req.query.get("category") or None,
+        urgency=req.query.get("urgency") or None,
+        tag=req.query.get("tag") or None,
+        region=req.query.get("region") or None,
+    )
+    before = _decode_cursor(req)
+    out = _page(svc.search_requirements(limit=limit + 1, before=before, **filters), limit)
+    out["fuzzy"] = False
+    if not out["items"] and before is None and filters["q"].strip():
+        # Sin coincidencias exactas: una página rankeada por similitud de trigramas
+        out = {"items": svc.fuzzy_search_requirements(limit=limit, **filters), "next_cursor": None, "fuzzy": True}
+    if req.query.get("facets") == "1":
+        out["facets"] = svc.requirement_facets(**filters)
+    return out
+
+
+def get_requirement(req: Request, req_id: str) -> Dict[str, Any]:
+    r = svc.get_requirement(int(req_id))
+    if not r:
+        raise ApiError(404, "requerimiento inexistente")
+    # Lista explícita: los datos de contacto del dueño se habilitan sólo vía
+    # solicitud aceptada, y las columnas internas/legadas no salen
+    return {k: r.get(k) for k in PUBLIC_REQUIREMENT_FIELDS}
+
+
+def suggest_tags(req: Request) -> Dict[str, Any]:
+    return {"items": svc.suggest_tags(req.query.get("prefix", ""), limit=_limit(req))}
+
+
+def _inbox_version(req: Request) -> str:
+    return svc.contacts_version(req.user["id"])
+
+
+def list_inbox(req: Request) -> Dict[str, Any]:
+    limit = _limit(req)
+    status = req.query.get("status", "pending")
+    if status not in ("pending", "accepted", "declined"):
+        raise ApiError(400, "status inválido")
+    rows = svc.list_inbox(req.user["id"], status=status, limit=limit + 1, before=_decode_cursor(req))
+    return _page(rows, limit)
+
+
+def create_contact_request(req: Request) -> Tuple[int, Dict[str, Any]]:
+    data = req.json()
+    try:
+        requirement_id = int(data.get("requirement_id"))
+    except (TypeError, ValueError):
+        raise ApiError(400, "requirement_id requerido")
+    r = svc.get_requirement(requirement_id)
+    if not r or r.get("status") != "open":
+        raise ApiError(404, "requerimiento inexistente o cerrado")
+    if int(r["user_id"]) == int(req.user["id"]):
+        raise ApiError(400, "no podés solicitar contacto a tu propia publicación")
+    rid = svc.create_contact_request(req.user["id"], int(r["user_id"]), requirement_id)
+    log(req.user["id"], "api_contact_request", f"req={requirement_id}")
+    return 201, {"id": rid, "requirement_id": requirement_id, "status": "pending"}
+
+
+def list_suggestions(req: Request) -> Dict[str, Any]:
+    return {"items": svc.list_match_suggestions(req.user["id"], limit=_limit(req))}
+
+
+def admin_metrics(req: Request) -> Dict[str, Any]:
+    if req.user.get("role") != "admin":
+        raise ApiError(403, "sólo administradores")
+    return svc.admin_metrics()
+
+
+# (método, segmentos del path, handler, requiere auth, version)
+# Un segmento "*" captura un parámetro que se pasa al handler.
+ROUTES: List[Tuple[str, Tuple[str, ...], Callable, bool, Optional[Callable[[Request], str]]]] = [
+    ("GET", ("api", "requirements"), list_requirements, False, _requirements_version),
+    ("GET", ("api", "requirements", "*"), get_requirement, False, _requirements_version),
+    ("GET", ("api", "tags"), suggest_tags, False, _requirements_version),
+    ("GET", ("api", "inbox"), list_inbox, True, _inbox_version),
+    ("POST", ("api", "contact-requests"), create_contact_request, True, None),
+    ("GET", ("api", "suggestions"), list_suggestions, True, None),
+    ("GET", ("api", "admin", "metrics"), admin_metrics, True, None),
+]
+
+
+def _route(req: Request):
+    segs = tuple(s for s in req.path.split("/") if s)
+    path_found = False
+    for method, pattern, handler, needs_auth, version in ROUTES:
+        if len(pattern) != len(segs):
+            continue
+        args = []
+        ok = True
+        for p, s in zip(pattern, segs):
+            if p == "*":
+                if not s.isdigit():
+                    ok = False
+                    break
+                args.append(s)
+            elif p != s:
+                ok = False
+                break
+        if not ok:
+            continue
+        path_found = True
+        if method == req.method or (method == "GET" and req.method == "HEAD"):
+            return handler, args, needs_auth, version
+    raise ApiError(405 if path_found else 404, "método no permitido" if path_found else "ruta inexistente")
+
+
+def _etag(req: Request, seed: str) -> str:
+    uid = req.user["id"] if req.user else "-"
+    h = hashlib.sha1(f"{seed}\0{req.path}\0{req.raw_query}\0{uid}".encode("utf-8")).hexdigest()[:20]
+    return f'W/"{h}"'
+
+
+def _etag_matches(req: Request, etag: str) -> bool:
+    inm = req.headers.get("if-none-match", "")
+    return any(t.strip() in (etag, "*") for t in inm.split(",")) if inm else False
+
+
+def handle(req: Request) -> Tuple[int, Dict[str, str], bytes]:
+    """Procesa un request (corre en el pool de hilos). Devuelve (status, headers, body)."""
+    headers = {"Content-Type": "application/json; charset=utf-8"}
+    try:
+        handler, args, needs_auth, version = _route(req)
+        if needs_auth:
+            req.user = _authenticate(req)
+        etag = None
+        if version is not None:
+            etag = _etag(req, version(req))
+            if _etag_matches(req, etag):
+                return 304, {"ETag": etag}, b""
+        result = handler(req, *args)
+        status = 200
+        if isinstance(result, tuple):
+            status, result = result
+        body = json.dumps(result, ensure_ascii=False, default=str).encode("utf-8")
+        if req.method in ("GET", "HEAD"):
+            if etag is None:
+                # Sin versión barata: ETag por contenido (ahorra transferencia, no la consulta)
+                etag = _etag(req, hashlib.sha1(body).hexdigest())
+                if _etag_matches(req, etag):
+                    return 304, {"ETag": etag}, b""
+            headers["ETag"] = etag
+            headers["Cache-Control"] = "private, no-cache" if req.user else "no-cache"
+        return status, headers, body
+    except ApiError as e:
+        if e.status == 401:
+            headers["WWW-Authenticate"] = 'Basic realm="cpf", charset="UTF-8"'
+        return e.status, headers, json.dumps({"error": e.message}, ensure_ascii=False).encode("utf-8")
+    except Exception as e:
+        log("api", "error", req.method, req.path, str(e), level="ERROR")
+        return 500, headers, b'{"error": "error interno"}'
+
+
+# -------------------- Servidor asyncio --------------------
+async def _read_request(reader: asyncio.StreamReader) -> Optional[Request]:
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=KEEPALIVE_SECONDS)
+    except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+        return None
+    except asyncio.LimitOverrunError:
+        raise ApiError(413, "headers demasiado grandes")
+    lines = head.decode("latin-1").split("\r\n")
+    try:
+        method, target, _version = lines[0].split(" ", 2)
+    except ValueError:
+        raise ApiError(400, "request inválido")
+    headers: Dict[str, str] = {}
+    for line in lines[1:]:
+        if ":" in line:
+            k, v = line.split(":", 1)
+            headers[k.strip().lower()] = v.strip()
+    try:
+        length = int(headers.get("content-length") or 0)
+    except ValueError:
+        raise ApiError(400, "content-length inválido")
+    if length > MAX_BODY_BYTES:
+        raise ApiError(413, "body demasiado grande")
+    body = await reader.readexactly(length) if length else b""
+    return Request(method.upper(), target, headers, body)
+
+
+def _serialize(
+    status: int, headers: Dict[str, str], body: bytes, accept_encoding: str, keep_alive: bool, head_only: bool
+) -> bytes:
+    if status != 304 and len(body) >= GZIP_MIN_BYTES and "gzip" in accept_encoding.lower():
+        body = gzip.compress(body, compresslevel=5)
+        headers["Content-Encoding"] = "gzip"
+        headers["Vary"] = "Accept-Encoding"
+    headers["Content-Length"] = str(len(body))
+    headers["Connection"] = "keep-alive" if keep_alive else "close"
+    out = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}"]
+    out.extend(f"{k}: {v}" for k, v in headers.items())
+    payload = "\r\n".join(out).encode("latin-1") + b"\r\n\r\n"
+    return payload if head_only or status == 304 else payload + body
+
+
+class ApiServer:
+    def __init__(self, host: str = API_HOST, port: int = API_PORT, workers: int = API_WORKERS):
+        self.host = host
+        self.port = port
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cpf-api")
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def _client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    req = await _read_request(reader)
+                except ApiError as e:
+                    body = json.dumps({"error": e.message}, ensure_ascii=False).encode("utf-8")
+                    writer.write(_serialize(e.status, {"Content-Type": "application/json"}, body, "", False, False))
+                    await writer.drain()
+                    break
+                if req is None:
+                    break
+                t0 = time.perf_counter()
+                status, headers, body = await loop.run_in_executor(self.pool, handle, req)
+                keep_alive = req.headers.get("connection", "").lower() != "close"
+                headers["X-Response-Time-Ms"] = f"{(time.perf_counter() - t0) * 1000:.1f}"
+                writer.write(
+                    _serialize(
+                        status, headers, body, req.headers.get("accept-encoding", ""), keep_alive, req.method == "HEAD"
+                    )
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            try:
+                writer.close()
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._client, self.host, self.port)
+        if self.port == 0:
+            self.port = self._server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self) -> None:
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+        self.pool.shutdown(wait=False)
+
+
+def main() -> None:
+    from db import init_db
+
+    init_db()
+    server = ApiServer()
+    print(f"CPF API escuchando en http://{server.host}:{server.port} ({API_WORKERS} workers)")
+    if metrics.ensure_exporter(port=API_METRICS_PORT):
+        print(f"Métricas en http://{metrics.HOST}:{API_METRICS_PORT}/metrics")
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
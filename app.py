@@ -18,10 +18,8 @@ def _uget(u, key, default=None):
         except Exception:
             return default
 def _norm_text(s: str) -> str:
-    import unicodedata
-    s = s or ""
-    s = ''.join(c for c in unicodedata.normalize('NFKD', s) if not unicodedata.combining(c))
-    return s.casefold()
+    from textnorm import norm_text
+    return norm_text(s)
 
 # Lista MUY acotada de insultos graves (evitamos falsos positivos).
 # Si necesitás ampliarla, lo hacemos con criterio y pruebas.
@@ -73,18 +71,29 @@ def highlight_offensive(text: str, matches):
     return "".join(out)
 import pandas as pd
 import datetime
+import os
 from pathlib import Path
 
+import gazetteer
+import maintenance
+import memo
+import metrics
+import notify
 import services as svc
-from db import backup_db, list_backups, get_backup_dir, set_backup_dir, get_last_backup_path, restore_db_from_path, get_super_admin_email
+import suggestions
+from db import backup_db, backup_bytes, list_backup_entries, reconcile_backups, get_backup_dir, set_backup_dir, get_last_backup_path, restore_db_from_path, get_super_admin_email
+from db import query_logs, log_stats, log
 from auth import any_admin_exists, create_user, authenticate, is_super_admin, is_super_admin
 
 try:
-    from ai import assistant_answer, review_requirement
+    from ai import assistant_answer
 except Exception:
     def assistant_answer(q: str, role: str = "user"):
         return {"answer": "Asistente IA no disponible (ai.py con error).", "table": None}
 
+try:
+    from ai import review_requirement
+except Exception:
     def review_requirement(title: str, description: str):
         """Fallback: revisión simple local sin IA (evita falsos positivos)."""
         text = f"{title}\n{description}".lower()
@@ -103,6 +112,61 @@ except Exception:
         return {"allowed": True, "reason": "OK", "matches": []}
 
 
+SENT_PAGE_SIZE = 20
+BACKUP_PAGE_SIZE = 50
+PAGE_SIZE = int(os.environ.get("CPF_PAGE_SIZE", "20"))
+PAGE_SIZE_OPTIONS = sorted({10, 20, 50, 100, PAGE_SIZE})
+
+CATEGORIES = [
+    "Materias primas", "Insumos industriales", "Maquinaria y equipos", "Repuestos",
+    "Servicios industriales", "Logística y transporte", "Construcción", "Tecnología",
+    "Alimentos y bebidas", "Otros",
+]
+URGENCY = ["Baja", "Media", "Alta"]
+_TYPE_LABEL = {"need": "NECESIDAD", "offer": "OFERTA"}
+
+
+def _cursor_page(key: str, signature, fetch, page_size: int):
+    """Página actual de una lista con paginación por cursor (created_at, id).
+
+    `fetch(limit, before)` trae filas más nuevas primero. Los cursores de las
+    páginas visitadas se guardan en session_state y se reinician si cambia
+    `signature` (filtros / tamaño de página).
+    """
+    if st.session_state.get(f"{key}_sig") != signature:
+        st.session_state[f"{key}_sig"] = signature
+        st.session_state[key] = [None]
+    cursors = st.session_state.setdefault(key, [None])
+    rows = fetch(limit=page_size + 1, before=cursors[-1])
+    return rows[:page_size], cursors, len(rows) > page_size
+
+
+def _cursor_nav(key: str, rows, cursors, has_more: bool):
+    p1, p2, p3 = st.columns([1, 1, 2])
+    with p1:
+        if len(cursors) > 1 and st.button("← Anteriores", key=f"{key}_prev"):
+            cursors.pop()
+            st.rerun()
+    with p2:
+        if has_more and st.button("Siguientes →", key=f"{key}_next"):
+            cursors.append((rows[-1]["created_at"], rows[-1]["id"]))
+            st.rerun()
+    with p3:
+        st.caption(f"Página {len(cursors)}")
+
+
+def _select_row(key: str, df: "pd.DataFrame"):
+    """Tabla compacta con selección de una fila; devuelve el índice elegido o None."""
+    ev = st.dataframe(
+        df, use_container_width=True, hide_index=True,
+        on_select="rerun", selection_mode="single-row", key=key,
+    )
+    picked = list(getattr(getattr(ev, "selection", None), "rows", []) or [])
+    if picked and picked[0] < len(df):
+        return picked[0]
+    return None
+
+
 def _get_user():
     return st.session_state.get("user")
 
@@ -128,7 +192,7 @@ def _maybe_auto_backup(reason: str = "logout"):
         return
 
     try:
-        b = backup_db(reason=reason)
+        b = _backup_result(backup_db(reason=reason))
         if b.get("ok"):
             st.session_state["_last_backup"] = b
             st.session_state[done_key] = True
@@ -136,6 +200,14 @@ def _maybe_auto_backup(reason: str = "logout"):
         st.session_state["_last_backup_err"] = str(e)
 
 
+def _backup_result(path: str) -> dict:
+    """Resultado de backup_db listo para el botón de descarga (siempre como .db)."""
+    name = Path(path).name
+    if name.endswith(".json"):
+        name = name[: -len(".json")] + ".db"
+    return {"ok": True, "path": path, "filename": name, "bytes": backup_bytes(path)}
+
+
 def _backup_download_ui():
     """UI de resguardo (solo Super Admin)."""
     u = st.session_state.get("user")
@@ -155,7 +227,7 @@ def _backup_download_ui():
         st.success("Directorio actualizado.")
 
     if st.button("Crear backup ahora"):
-        b = backup_db(reason="manual")
+        b = _backup_result(backup_db(reason="manual"))
         st.session_state["_last_backup"] = b
         st.success("Backup generado.")
 
@@ -173,8 +245,22 @@ def _backup_download_ui():
 
     st.divider()
     st.subheader("Restaurar (solo Super Admin)")
-    backups = list_backups()
-    pick = st.selectbox("Backups locales", options=["(ninguno)"] + backups, format_func=lambda p: p if p=="(ninguno)" else Path(p).name)
+    page = st.number_input("Página de backups", min_value=1, value=1, step=1, key="backup_page")
+    entries = list_backup_entries(limit=BACKUP_PAGE_SIZE, offset=(int(page) - 1) * BACKUP_PAGE_SIZE)
+    by_path = {e["path"]: e for e in entries}
+
+    def _fmt_backup(p):
+        if p == "(ninguno)":
+            return p
+        e = by_path[p]
+        size_mb = (e.get("size") or 0) / 1e6
+        flag = {"ok": "✔", "failed": "✖"}.get(e.get("integrity"), "?")
+        return f"{Path(p).name} · {size_mb:.1f} MB · {flag}"
+
+    pick = st.selectbox("Backups locales", options=["(ninguno)"] + list(by_path), format_func=_fmt_backup)
+    if st.button("Reconciliar catálogo con la carpeta"):
+        r = reconcile_backups()
+        st.info(f"Agregados: {r['added']} · Faltantes: {r['missing']}")
     up = st.file_uploader("O subir un backup .db", type=["db"])
     if st.button("♻️ Restaurar ahora", use_container_width=True):
         try:
@@ -182,11 +268,13 @@ def _backup_download_ui():
                 tmp_path = Path("Resguardo") / f"uploaded_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.db"
                 tmp_path.parent.mkdir(parents=True, exist_ok=True)
                 tmp_path.write_bytes(up.getvalue())
-                restore_db_from_path(str(tmp_path))
+                with st.spinner("Verificando y restaurando…"):
+                    restore_db_from_path(str(tmp_path))
                 st.success("Restaurado. Recargando…")
                 st.rerun()
             elif pick and pick != "(ninguno)":
-                restore_db_from_path(pick)
+                with st.spinner("Verificando y restaurando…"):
+                    restore_db_from_path(pick)
                 st.success("Restaurado. Recargando…")
                 st.rerun()
             else:
@@ -314,8 +402,52 @@ def _admin_bootstrap_ui():
                 st.error(str(e))
 
 
+RERUN_BUDGET_MS = float(os.environ.get("CPF_RERUN_BUDGET_MS", "1500"))
+
+
+def _rerun_stats_ui(stats):
+    """Costo de esta ejecución del script (visible para admins o con CPF_RERUN_STATS=1)."""
+    sm = stats.summary()
+    if sm["elapsed_ms"] > RERUN_BUDGET_MS:
+        log("app", "rerun_slow", f"ms={sm['elapsed_ms']}", f"db={sm['db_connections']}", level="WARNING")
+    u = _get_user()
+    if _uget(u, "role") != "admin" and os.environ.get("CPF_RERUN_STATS") != "1":
+        return
+    with st.sidebar:
+        with st.expander("Costo de esta ejecución", expanded=False):
+            st.caption(
+                f"{sm['elapsed_ms']:.0f} ms · {sm['db_connections']} conexiones a la base · "
+                f"{sm['misses']} consultas ({sm['db_ms']:.0f} ms) · {sm['hits']} repetidas evitadas"
+            )
+            if sm["by_function"]:
+                st.dataframe(
+                    pd.DataFrame(
+                        [{"función": k, "llamadas": v["calls"], "cache": v["hits"], "ms": v["ms"]}
+                         for k, v in sm["by_function"].items()]
+                    ),
+                    use_container_width=True,
+                    hide_index=True,
+                )
+
+
 def main():
     st.set_page_config(page_title="CPF – Sistema de Requerimientos", layout="wide")
+    # Un scope de memoización por rerun: las consultas repetidas se sirven del cache
+    with memo.scope() as stats:
+        _main()
+    _rerun_stats_ui(stats)
+
+
+def _main():
+    # Tareas de fondo (una vez por proceso): notificaciones (outbox), sugerencias y
+    # mantenimiento de la base (retención de logs, ANALYZE, vacuum, backups; corre sólo el líder)
+    try:
+        notify.ensure_dispatcher()
+        suggestions.ensure_worker()
+        maintenance.ensure_scheduler()
+        metrics.ensure_exporter()
+    except Exception:
+        pass
 
     with st.sidebar:
         st.title("Sesión")
@@ -363,58 +495,185 @@ def main():
     st.caption("Prototipo: publicar OFERTAS/NECESIDADES, navegar, buscar y solicitar contacto. Negociación y precio: fuera del sistema.")
 
     role = u["role"] if u else "anon"
-    t = st.tabs(["Navegar", "Publicar", "Bandeja", "Panel", "Asistente IA"])
+    pending = svc.pending_counts(u["id"])["inbox_pending"]
+    bandeja_label = f"Bandeja ({pending})" if pending else "Bandeja"
+    # Navegación con radio (no st.tabs): st.tabs ejecuta el código de todas las
+    # pestañas en cada rerun; así sólo se calcula la sección visible.
+    sections = {
+        "navegar": "Navegar",
+        "publicar": "Publicar",
+        "bandeja": bandeja_label,
+        "panel": "Panel",
+        "asistente": "Asistente IA",
+    }
+    section = st.radio(
+        "Sección", list(sections), format_func=sections.get, horizontal=True,
+        key="nav_section", label_visibility="collapsed",
+    )
 
-    with t[0]:
+    if section == "navegar":
         st.header("Requisitos del navegador")
 
+        q = st.text_input("Buscar (producto/palabra clave/empresa/persona/tags)", key="nav_q")
+
+        # Conteos por faceta para la búsqueda actual (una sola pasada en services).
+        # Los filtros se leen de session_state para poder mostrar los conteos en sus etiquetas.
+        ss = st.session_state
+        facets = svc.requirement_facets(
+            q=q,
+            type_=ss.get("nav_type") or "(Todos)",
+            status=ss.get("nav_status", "open"),
+            chamber_id=ss.get("nav_chamber"),
+            category=ss.get("nav_category"),
+            urgency=ss.get("nav_urgency"),
+            tag=ss.get("nav_tag"),
+            region=ss.get("nav_region"),
+        )
+        fc = {f: {it["value"]: it["count"] for it in items} for f, items in facets.items()}
+
+        def _with_count(facet, labels):
+            def fmt(v):
+                if v is None:
+                    return labels.get(None, "(Todas)")
+                return f"{labels.get(v, v)} ({fc[facet].get(v, 0)})"
+            return fmt
+
         chambers = svc.list_chambers()
-        chamber_options = ["(Todas)"] + [c["name"] for c in chambers]
-        chamber_sel = st.selectbox("Cámara", chamber_options)
-        chamber_id = None
-        if chamber_sel != "(Todas)":
-            for c in chambers:
-                if c["name"] == chamber_sel:
-                    chamber_id = c["id"]
-                    break
-
-        q = st.text_input("Buscar (producto/palabra clave/empresa/persona/tags)")
-        tipo = st.selectbox("Tipo", ["(Todos)", "need", "offer"],
-                            format_func=lambda x: {"(Todos)": "(Todos)", "need": "Necesidad", "offer": "Oferta"}.get(x, x))
-        status = st.selectbox("Estado", ["open", "closed"],
-                              format_func=lambda x: {"open": "abierto", "closed": "cerrado"}.get(x, x))
-
-        reqs = svc.search_requirements(q=q, type_=tipo, status=status, chamber_id=chamber_id)
-
-        st.subheader(f"Resultados ({len(reqs)})")
-        for r in reqs:
-            with st.expander(f"#{r['id']} · {('NECESIDAD' if r['type']=='need' else 'OFERTA')} · {r['title']}"):
-                st.write(f"**Empresa:** {r['company']}")
-                st.write(f"**Cámara:** {r.get('chamber_name') or '(Sin cámara)'}")
-                if r.get("category"):
-                    st.write(f"**Categoría:** {r['category']}")
-                st.write(f"**Urgencia:** {r.get('urgency','Media')}")
-                if r.get("tags"):
-                    st.write(f"**Tags:** {r['tags']}")
-                st.write(r["description"])
-
-                atts = svc.list_attachments(r["id"])
-                if atts:
-                    st.write("**Adjuntos:**")
-                    for a in atts:
-                        st.write(f"- {a['filename']} ({a.get('size','?')} bytes)")
-
-                if u and int(u["id"]) != int(r["user_id"]):
-                    if st.button("Solicitar contacto", key=f"contact_{r['id']}"):
-                        svc.create_contact_request(from_user_id=u["id"], to_user_id=r["user_id"], requirement_id=r["id"])
-                        st.success("Solicitud enviada.")
-
-    with t[1]:
+        ch_names = {c["id"]: c["name"] for c in chambers}
+        ch_names[None] = "(Todas)"
+        chamber_id = st.selectbox(
+            "Cámara", [None] + [c["id"] for c in chambers], format_func=_with_count("chamber", ch_names), key="nav_chamber"
+        )
+
+        f1, f2, f3, f4 = st.columns(4)
+        with f1:
+            tipo = st.selectbox(
+                "Tipo", ["(Todos)", "need", "offer"],
+                format_func=lambda x: "(Todos)" if x == "(Todos)" else _with_count("type", {"need": "Necesidad", "offer": "Oferta"})(x),
+                key="nav_type",
+            )
+        with f2:
+            status = st.selectbox(
+                "Estado", ["open", "closed"],
+                format_func=_with_count("status", {"open": "abierto", "closed": "cerrado"}), key="nav_status",
+            )
+        with f3:
+            cat_opts = [None] + CATEGORIES + sorted(
+                v for v in fc["category"] if v and v not in CATEGORIES
+            )
+            if ss.get("nav_category") and ss["nav_category"] not in cat_opts:
+                cat_opts.append(ss["nav_category"])
+            category = st.selectbox("Categoría", cat_opts, format_func=_with_count("category", {None: "(Todas)"}), key="nav_category")
+        with f4:
+            urgency = st.selectbox("Urgencia", [None] + URGENCY, format_func=_with_count("urgency", {None: "(Todas)"}), key="nav_urgency")
+
+        f5, f6, f7 = st.columns([2, 2, 1])
+        with f5:
+            # Tags más usados (índice normalizado requirement_tags)
+            top_tags = svc.popular_tags(limit=30, status=status)
+            tag_labels = {t["name"]: f"{t['label']} ({t['n']})" for t in top_tags}
+            tag_labels[None] = "(Todos)"
+            tag_opts = [None] + [t["name"] for t in top_tags]
+            if ss.get("nav_tag") and ss["nav_tag"] not in tag_opts:
+                tag_opts.append(ss["nav_tag"])
+            tag = st.selectbox("Tag", tag_opts, format_func=lambda t: tag_labels.get(t, t), key="nav_tag")
+        with f6:
+            # Provincias normalizadas (gazetteer.py) con conteo de la búsqueda actual
+            region_opts = [None] + sorted(
+                (v for v in fc["province"] if v), key=lambda v: gazetteer.region_label(v)
+            )
+            if ss.get("nav_region") and ss["nav_region"] not in region_opts:
+                region_opts.append(ss["nav_region"])
+            region = st.selectbox(
+                "Región", region_opts,
+                format_func=lambda v: "(Todas)" if v is None else f"{gazetteer.region_label(v)} ({fc['province'].get(v, 0)})",
+                key="nav_region",
+            )
+        with f7:
+            page_size = st.selectbox("Por página", PAGE_SIZE_OPTIONS, index=PAGE_SIZE_OPTIONS.index(PAGE_SIZE), key="nav_page_size")
+
+        reqs, cursors, has_more = _cursor_page(
+            "_nav_cursors",
+            (q, tipo, status, chamber_id, category, urgency, tag, region, page_size),
+            lambda limit, before: svc.search_requirements(
+                q=q, type_=tipo, status=status, chamber_id=chamber_id, limit=limit, before=before, shape="rows",
+                category=category, urgency=urgency, tag=tag, region=region,
+            ),
+            page_size,
+        )
+
+        # Sin coincidencias exactas: búsqueda aproximada (errores de tipeo / tildes)
+        approx = False
+        if not reqs and q.strip() and len(cursors) == 1:
+            reqs = svc.fuzzy_search_requirements(
+                q, type_=tipo, status=status, chamber_id=chamber_id, category=category, urgency=urgency,
+                limit=page_size, shape="rows", tag=tag, region=region,
+            )
+            approx, has_more = bool(reqs), False
+
+        if approx:
+            st.subheader(f"Resultados aproximados ({len(reqs)})")
+            st.caption(f"No hubo coincidencias exactas para «{q.strip()}»; se muestran las más parecidas.")
+        else:
+            # El conteo de la faceta "estado" ya tiene aplicados todos los demás filtros
+            st.subheader(f"Resultados ({fc['status'].get(status, 0)})")
+        if not reqs:
+            st.write("No hay resultados.")
+        else:
+            # Una fila compacta por resultado; el detalle se carga sólo para la fila elegida
+            st.caption("Elegí una fila para ver el detalle.")
+            idx = _select_row(
+                f"nav_table_{len(cursors)}",
+                pd.DataFrame(
+                    [
+                        {"#": r["id"], "Tipo": _TYPE_LABEL.get(r["type"], r["type"]), "Título": r["title"],
+                         "Empresa": r["company"], "Cámara": r.get("chamber_name") or "",
+                         "Urgencia": r.get("urgency") or "", "Fecha": (r.get("created_at") or "")[:10]}
+                        for r in reqs
+                    ]
+                ),
+            )
+            _cursor_nav("nav", reqs, cursors, has_more)
+
+            if idx is not None:
+                r = svc.get_requirement(reqs[idx]["id"])
+                if r:
+                    st.divider()
+                    st.markdown(f"### #{r['id']} · {_TYPE_LABEL.get(r['type'], r['type'])} · {r['title']}")
+                    st.write(f"**Empresa:** {r['company']}")
+                    st.write(f"**Cámara:** {r.get('chamber_name') or '(Sin cámara)'}")
+                    if r.get("category"):
+                        st.write(f"**Categoría:** {r['category']}")
+                    st.write(f"**Urgencia:** {r.get('urgency','Media')}")
+                    if r.get("location") or r.get("province_code"):
+                        loc_code = r.get("city_code") or r.get("province_code")
+                        st.write(f"**Ubicación:** {r.get('location') or gazetteer.region_label(loc_code)}"
+                                 + (f" · {gazetteer.region_label(loc_code)}" if r.get("location") and loc_code else ""))
+                    if r.get("tags"):
+                        st.write(f"**Tags:** {r['tags']}")
+                    st.write(r["description"])
+
+                    atts = svc.list_attachments(r["id"])
+                    if atts:
+                        st.write("**Adjuntos:**")
+                        for a in atts:
+                            st.write(f"- {a['filename']} ({a.get('size','?')} bytes)")
+
+                    if u and int(u["id"]) != int(r["user_id"]):
+                        if st.button("Solicitar contacto", key=f"contact_{r['id']}"):
+                            svc.create_contact_request(from_user_id=u["id"], to_user_id=r["user_id"], requirement_id=r["id"])
+                            st.success("Solicitud enviada.")
+
+    elif section == "publicar":
         st.header("Publicar un requerimiento")
 
         chambers = svc.list_chambers()
         chamber_options = ["(Sin cámara)"] + [c["name"] for c in chambers]
 
+        frequent = svc.suggest_tags("", limit=12)
+        if frequent:
+            st.caption("Tags frecuentes: " + ", ".join(t["label"] for t in frequent))
+
         with st.form("publish_form"):
             type_ = st.selectbox("Tipo", ["need", "offer"],
                                  format_func=lambda x: {"need": "Necesidad", "offer": "Oferta"}[x])
@@ -441,6 +700,7 @@ def main():
                 accept_multiple_files=True,
             )
 
+            force = st.checkbox("Publicar aunque haya publicaciones parecidas")
             ok = st.form_submit_button("Publicar")
 
         if ok:
@@ -457,95 +717,234 @@ def main():
                     final_desc = rev.get("suggested_description", desc).strip()
                     final_category = None if category == "(Sin categoría)" else category
 
-                    req_id = svc.create_requirement(
-                        type_=type_,
-                        title=final_title,
-                        description=final_desc,
-                        user_id=u["id"],
-                        company=u["company"],
-                        chamber_id=chamber_id,
+                    dups = [] if force else svc.find_near_duplicates(
+                        type_, final_title, final_desc, tags=tags, category=final_category,
                         location=location.strip() or None,
-                        category=final_category,
-                        urgency=urgency,
-                        tags=tags,
                     )
-
-                    if files:
-                        for f in files:
-                            try:
-                                svc.save_attachment(
-                                    requirement_id=req_id,
-                                    uploaded_by_user_id=u["id"],
-                                    filename=f.name,
-                                    content=f.getvalue(),
-                                    mime=getattr(f, "type", None),
-                                )
-                            except Exception as e:
-                                st.warning(f"No se pudo guardar {f.name}: {e}")
-
-                    st.success(f"Requerimiento publicado con ID #{req_id}.")
-
-    with t[2]:
+                    if dups:
+                        st.warning(
+                            "Ya hay publicaciones muy parecidas. Revisalas o marcá "
+                            "\"Publicar aunque haya publicaciones parecidas\"."
+                        )
+                        for d in dups:
+                            mine = " (tuya)" if d["user_id"] == u["id"] else ""
+                            st.write(f"- #{d['id']} · {d['title']} — {d['company'] or ''}{mine}")
+                    else:
+                        req_id = svc.create_requirement(
+                            type_=type_,
+                            title=final_title,
+                            description=final_desc,
+                            user_id=u["id"],
+                            company=u["company"],
+                            chamber_id=chamber_id,
+                            location=location.strip() or None,
+                            category=final_category,
+                            urgency=urgency,
+                            tags=tags,
+                        )
+
+                        if files:
+                            for f in files:
+                                try:
+                                    svc.save_attachment(
+                                        requirement_id=req_id,
+                                        uploaded_by_user_id=u["id"],
+                                        filename=f.name,
+                                        content=f.getvalue(),
+                                        mime=getattr(f, "type", None),
+                                    )
+                                except Exception as e:
+                                    st.warning(f"No se pudo guardar {f.name}: {e}")
+
+                        st.success(f"Requerimiento publicado con ID #{req_id}.")
+
+    elif section == "bandeja":
         st.header("Bandeja")
 
         st.subheader("Solicitudes de contacto recibidas")
-        inbox = svc.list_inbox(u["id"], status="pending")
+        inbox, in_cursors, in_more = _cursor_page(
+            "_inbox_cursors",
+            (PAGE_SIZE,),
+            lambda limit, before: svc.list_inbox(u["id"], status="pending", limit=limit, before=before, shape="rows"),
+            PAGE_SIZE,
+        )
         if not inbox:
             st.write("No tenés solicitudes pendientes.")
         else:
-            for it in inbox:
-                with st.expander(f"Solicitud #{it['id']} — {it['from_name']} por #{it['requirement_id']} · {it['title']}"):
-                    st.write(f"**Contacto:** {it['from_name']} · {it['from_email']} · {it.get('from_phone') or ''}")
-                    c1, c2 = st.columns(2)
-                    with c1:
-                        if st.button("Aceptar", key=f"acc_{it['id']}"):
-                            svc.respond_contact_request(it["id"], "accepted")
-                            st.success("Aceptada.")
-                            st.rerun()
-                    with c2:
-                        if st.button("Rechazar", key=f"dec_{it['id']}"):
-                            svc.respond_contact_request(it["id"], "declined")
-                            st.info("Rechazada.")
-                            st.rerun()
+            idx = _select_row(
+                f"inbox_table_{len(in_cursors)}",
+                pd.DataFrame(
+                    [
+                        {"#": it["id"], "De": it["from_name"], "Requerimiento": f"#{it['requirement_id']} · {it['title']}",
+                         "Recibida": it["created_at"]}
+                        for it in inbox
+                    ]
+                ),
+            )
+            _cursor_nav("inbox", inbox, in_cursors, in_more)
+            if idx is not None:
+                it = inbox[idx]
+                st.write(f"**Solicitud #{it['id']}** — {it['from_name']} por #{it['requirement_id']} · {it['title']}")
+                st.write(f"**Contacto:** {it['from_name']} · {it['from_email']} · {it.get('from_phone') or ''}")
+                c1, c2 = st.columns(2)
+                with c1:
+                    if st.button("Aceptar", key=f"acc_{it['id']}"):
+                        svc.respond_contact_request(it["id"], "accepted")
+                        st.success("Aceptada.")
+                        st.rerun()
+                with c2:
+                    if st.button("Rechazar", key=f"dec_{it['id']}"):
+                        svc.respond_contact_request(it["id"], "declined")
+                        st.info("Rechazada.")
+                        st.rerun()
+
+        st.divider()
+        st.subheader("Contrapartes sugeridas para tus publicaciones")
+        # Calculadas en segundo plano al publicar/editar (suggestions.py)
+        sugg = svc.list_match_suggestions(u["id"], limit=20)
+        if not sugg:
+            st.write("Todavía no hay sugerencias.")
+        else:
+            st.dataframe(
+                pd.DataFrame(
+                    [
+                        {"Mi publicación": f"#{it['requirement_id']} · {it['my_title']}",
+                         "Contraparte": f"#{it['counterpart_id']} · {it['title']}", "Empresa": it["company"],
+                         "Región": gazetteer.region_label(it.get("city_code") or it.get("province_code")),
+                         "Similitud": it["score"], "Fecha": (it.get("created_at") or "")[:10]}
+                        for it in sugg
+                    ]
+                ),
+                use_container_width=True,
+                hide_index=True,
+            )
+
+        st.divider()
+        st.subheader("Solicitudes de contacto enviadas")
+        sent_status = st.selectbox(
+            "Estado",
+            ["pending", "accepted", "declined"],
+            format_func=lambda x: {"pending": "pendientes", "accepted": "aceptadas", "declined": "rechazadas"}[x],
+            key="sent_status",
+        )
+        sent, cursors, has_more = _cursor_page(
+            f"_sent_cursors_{sent_status}",
+            (SENT_PAGE_SIZE,),
+            lambda limit, before: svc.list_sent(u["id"], status=sent_status, limit=limit, before=before, shape="rows"),
+            SENT_PAGE_SIZE,
+        )
+        if not sent:
+            st.write("No hay solicitudes enviadas en este estado.")
+        else:
+            st.dataframe(
+                pd.DataFrame(
+                    [
+                        {"#": it["id"], "Requerimiento": f"#{it['requirement_id']} · {it['title']}",
+                         "Para": it["to_name"], "Enviada": it["created_at"], "Respondida": it.get("responded_at") or ""}
+                        for it in sent
+                    ]
+                ),
+                use_container_width=True,
+                hide_index=True,
+            )
+        _cursor_nav("sent", sent, cursors, has_more)
 
         st.divider()
         st.subheader("Mis publicaciones (editar/cerrar)")
-        mine = svc.list_user_requirements(u["id"])
+        mine, my_cursors, my_more = _cursor_page(
+            "_mine_cursors",
+            (PAGE_SIZE,),
+            lambda limit, before: svc.list_user_requirements(u["id"], limit=limit, before=before, shape="rows"),
+            PAGE_SIZE,
+        )
         if not mine:
             st.write("Todavía no publicaste requerimientos.")
         else:
-            for r in mine:
-                with st.expander(f"#{r['id']} · {('NECESIDAD' if r['type']=='need' else 'OFERTA')} · {r['title']} ({r['status']})"):
-                    with st.form(f"edit_{r['id']}"):
-                        title2 = st.text_input("Título", value=r["title"])
-                        desc2 = st.text_area("Descripción", value=r["description"], height=120)
-                        cat2 = st.selectbox("Categoría", ["(Sin categoría)"] + CATEGORIES,
-                                            index=(["(Sin categoría)"] + CATEGORIES).index(r.get("category") or "(Sin categoría)"))
-                        urg2 = st.selectbox("Urgencia", URGENCY,
-                                            index=URGENCY.index(r.get("urgency", "Media")) if r.get("urgency", "Media") in URGENCY else 1)
-                        tags2 = st.text_input("Tags", value=r.get("tags") or "")
-                        status2 = st.selectbox("Estado", ["open", "closed"],
-                                               index=0 if r["status"] == "open" else 1,
-                                               format_func=lambda x: {"open": "abierto", "closed": "cerrado"}[x])
-                        save = st.form_submit_button("Guardar cambios")
-                        if save:
-                            rev = review_requirement(title2, desc2)
-                            if not rev.get("ok", True):
-                                st.error(rev.get("reason", "El texto no pasó la moderación."))
-                            else:
-                                svc.update_requirement(
-                                    r["id"],
-                                    title=rev.get("suggested_title", title2),
-                                    description=rev.get("suggested_description", desc2),
-                                    category=None if cat2 == "(Sin categoría)" else cat2,
-                                    urgency=urg2,
-                                    tags=tags2,
-                                    status=status2,
-                                )
-                                st.success("Actualizado.")
-                                st.rerun()
-
-    with t[3]:
+            # El formulario de edición se arma sólo para la publicación elegida
+            idx = _select_row(
+                f"mine_table_{len(my_cursors)}",
+                pd.DataFrame(
+                    [
+                        {"#": r["id"], "Tipo": _TYPE_LABEL.get(r["type"], r["type"]), "Título": r["title"],
+                         "Estado": {"open": "abierto", "closed": "cerrado"}.get(r["status"], r["status"]),
+                         "Fecha": (r.get("created_at") or "")[:10]}
+                        for r in mine
+                    ]
+                ),
+            )
+            _cursor_nav("mine", mine, my_cursors, my_more)
+            if idx is not None:
+                r = mine[idx]
+                st.markdown(f"**#{r['id']} · {_TYPE_LABEL.get(r['type'], r['type'])} · {r['title']} ({r['status']})**")
+                with st.form(f"edit_{r['id']}"):
+                    title2 = st.text_input("Título", value=r["title"])
+                    desc2 = st.text_area("Descripción", value=r["description"], height=120)
+                    cat_opts = ["(Sin categoría)"] + CATEGORIES
+                    if r.get("category") and r["category"] not in cat_opts:
+                        cat_opts.append(r["category"])
+                    cat2 = st.selectbox("Categoría", cat_opts, index=cat_opts.index(r.get("category") or "(Sin categoría)"))
+                    urg2 = st.selectbox("Urgencia", URGENCY,
+                                        index=URGENCY.index(r.get("urgency", "Media")) if r.get("urgency", "Media") in URGENCY else 1)
+                    tags2 = st.text_input("Tags", value=r.get("tags") or "")
+                    status2 = st.selectbox("Estado", ["open", "closed"],
+                                           index=0 if r["status"] == "open" else 1,
+                                           format_func=lambda x: {"open": "abierto", "closed": "cerrado"}[x])
+                    save = st.form_submit_button("Guardar cambios")
+                    if save:
+                        rev = review_requirement(title2, desc2)
+                        if not rev.get("ok", True):
+                            st.error(rev.get("reason", "El texto no pasó la moderación."))
+                        else:
+                            svc.update_requirement(
+                                r["id"],
+                                title=rev.get("suggested_title", title2),
+                                description=rev.get("suggested_description", desc2),
+                                category=None if cat2 == "(Sin categoría)" else cat2,
+                                urgency=urg2,
+                                tags=tags2,
+                                status=status2,
+                            )
+                            st.success("Actualizado.")
+                            st.rerun()
+
+                if r["status"] == "open":
+                    # Contrapartes sugeridas (candidatos filtrados en SQL + vectores precalculados)
+                    st.markdown("**Posibles contrapartes**")
+                    o1, o2 = st.columns(2)
+                    same_cat = o1.checkbox("Misma categoría", key=f"cp_cat_{r['id']}", disabled=not r.get("category"))
+                    local = o2.checkbox("Sólo mi provincia", key=f"cp_local_{r['id']}", disabled=not r.get("province_code"))
+                    cp_region = r.get("province_code") if local else None
+                    counterparts = svc.suggest_counterparts(r["id"], limit=5, same_category=same_cat, region=cp_region)
+                    if counterparts:
+                        st.dataframe(
+                            pd.DataFrame(
+                                [
+                                    {"#": it["id"], "Tipo": _TYPE_LABEL.get(it["type"], it["type"]), "Título": it["title"],
+                                     "Empresa": it["company"],
+                                     "Región": gazetteer.region_label(it.get("city_code") or it.get("province_code")),
+                                     "Similitud": it["score"]}
+                                    for it in counterparts
+                                ]
+                            ),
+                            use_container_width=True,
+                            hide_index=True,
+                        )
+                    else:
+                        st.caption("Sin contrapartes parecidas por ahora.")
+
+                if r["status"] == "open" and st.button("Solicitar contacto a las mejores coincidencias", key=f"contact_all_{r['id']}"):
+                    try:
+                        sent_ids = svc.contact_all_matches(
+                            r["id"], from_user_id=u["id"], region=cp_region, same_category=same_cat
+                        )
+                        if sent_ids:
+                            st.success(f"Solicitudes enviadas/pendientes: {len(sent_ids)}.")
+                        else:
+                            st.info("No se encontraron coincidencias para contactar.")
+                    except Exception as e:
+                        st.error(f"No se pudo calcular coincidencias: {e}")
+
+    elif section == "panel":
         st.header("Panel")
         m = svc.admin_metrics()
 
@@ -563,8 +962,7 @@ def main():
         if role == "admin":
             st.divider()
             st.subheader("Administración de Cámaras")
-            chambers = svc.list_chambers()
-            st.dataframe(pd.DataFrame(chambers), use_container_width=True)
+            st.dataframe(svc.list_chambers(shape="frame"), use_container_width=True)
             with st.form("add_chamber"):
                 nm = st.text_input("Nombre cámara")
                 loc = st.text_input("Ciudad/Provincia (opcional)")
@@ -576,7 +974,150 @@ def main():
                     else:
                         st.error("No se pudo crear (¿ya existe?).")
 
-    with t[4]:
+            st.divider()
+            st.subheader("Publicaciones casi duplicadas")
+            if st.button("Buscar casi duplicados", key="dup_scan"):
+                st.session_state["_dup_groups"] = svc.duplicate_clusters()
+            dup_groups = st.session_state.get("_dup_groups")
+            if dup_groups is None:
+                st.caption("Agrupa publicaciones abiertas con texto casi idéntico (SimHash).")
+            elif dup_groups:
+                st.caption(f"{len(dup_groups)} grupos entre las publicaciones abiertas.")
+                for i, g in enumerate(dup_groups[:20], 1):
+                    with st.expander(f"Grupo {i}: {g['size']} publicaciones · {g['companies']} empresa(s)"):
+                        st.dataframe(pd.DataFrame(g["items"]), use_container_width=True, hide_index=True)
+            else:
+                st.caption("Sin casi duplicados entre las publicaciones abiertas.")
+
+            st.divider()
+            st.subheader("Exportar")
+            if st.button("Preparar CSV de requerimientos", key="export_reqs"):
+                st.session_state["_export_reqs_csv"] = svc.export_requirements_csv()
+            if st.session_state.get("_export_reqs_csv"):
+                st.download_button(
+                    "Descargar requerimientos (.csv)",
+                    data=st.session_state["_export_reqs_csv"],
+                    file_name=f"cpf_requerimientos_{datetime.date.today().isoformat()}.csv",
+                    mime="text/csv",
+                )
+
+            st.divider()
+            st.subheader("Notificaciones (outbox)")
+            ob = notify.outbox_stats()
+            o1, o2, o3 = st.columns(3)
+            o1.metric("Pendientes", ob.get("pending", 0))
+            o2.metric("Entregadas", ob.get("delivered", 0))
+            o3.metric("Fallidas", ob.get("dead", 0))
+            if not notify.configured_sinks():
+                st.caption("Sin destinos configurados (CPF_NOTIFY_FILE / CPF_NOTIFY_WEBHOOK_URL / CPF_SMTP_HOST).")
+            mq = suggestions.queue_stats()
+            st.caption(f"Cola de sugerencias: {mq['pending']} pendientes · {mq['dead']} fallidas")
+
+            st.divider()
+            st.subheader("Mantenimiento de la base")
+            lead = maintenance.leader()
+            if not maintenance.ENABLED:
+                st.caption("Scheduler desactivado (CPF_MAINT=0).")
+            elif lead:
+                st.caption(
+                    f"Líder: {lead['owner']}{' (este proceso)' if lead['is_me'] else ''} · "
+                    f"lease hasta {lead['expires_at']}{' (vencido)' if lead['expired'] else ''}"
+                )
+            else:
+                st.caption("Sin líder todavía (se elige en la próxima vuelta del scheduler).")
+            jobs = maintenance.status()
+            st.dataframe(
+                pd.DataFrame(jobs)[["label", "enabled", "every_s", "budget_s", "last_started_at", "last_status",
+                                    "last_duration_ms", "next_run_at", "last_detail"]],
+                use_container_width=True,
+                hide_index=True,
+            )
+            j1, j2 = st.columns([2, 1])
+            with j1:
+                job_pick = st.selectbox("Tarea", [j["job"] for j in jobs if j["available"]],
+                                        format_func=lambda n: maintenance.JOBS[n].label, key="maint_job")
+            confirmed = False
+            if job_pick == "vacuum_full":
+                st.warning(
+                    "El VACUUM completo reescribe la base y la bloquea mientras dura (minutos en bases "
+                    "grandes). Ejecutarlo en un horario sin uso; después alcanza con el vacuum incremental."
+                )
+            if job_pick and maintenance.JOBS[job_pick].confirm:
+                confirmed = st.checkbox("Entiendo que la base queda bloqueada mientras dura", key="maint_confirm")
+            with j2:
+                st.write("")
+                if st.button("Ejecutar ahora", key="maint_run", disabled=not job_pick):
+                    try:
+                        with st.spinner("Ejecutando…"):
+                            run = maintenance.request_run(
+                                job_pick, requested_by=f"manual:{u['email']}", confirmed=confirmed
+                            )
+                    except ValueError as e:
+                        st.error(str(e))
+                    else:
+                        if run["queued"]:
+                            st.info(f"Corrida #{run['id']} encolada: la ejecuta el proceso líder (ver historial).")
+                        else:
+                            (st.success if run["status"] == "ok" else st.warning)(
+                                f"{run['status']} en {run['duration_ms']:.0f} ms"
+                            )
+            with st.expander("Historial de corridas"):
+                runs = maintenance.history(limit=100)
+                if runs:
+                    st.dataframe(pd.DataFrame(runs), use_container_width=True, hide_index=True)
+                else:
+                    st.caption("Sin corridas registradas.")
+
+            st.divider()
+            st.subheader("Métricas del proceso")
+            ms = metrics.snapshot()
+            dbm = ms["db"]
+            k1, k2, k3, k4, k5 = st.columns(5)
+            k1.metric("Base (MB)", f"{dbm['file_bytes'] / 1e6:.1f}" if dbm["file_bytes"] is not None else "-")
+            k2.metric("WAL (MB)", f"{dbm['wal_bytes'] / 1e6:.1f}" if dbm["wal_bytes"] is not None else "-")
+            k3.metric("Conexiones abiertas", dbm["pool"].get("in_use", dbm["connections_open"]))
+            k4.metric("Errores de lock", sum(dbm["lock_errors"].values()))
+            k5.metric("Commit p95 (ms)", dbm["commit_p95_ms"] if dbm["commit_p95_ms"] is not None else "-")
+            if ms["latency"]:
+                st.dataframe(pd.DataFrame(ms["latency"]), use_container_width=True, hide_index=True)
+            if ms["caches"]:
+                st.dataframe(pd.DataFrame(ms["caches"]), use_container_width=True, hide_index=True)
+            if metrics.PORT:
+                st.caption(f"Prometheus: http://{metrics.HOST}:{metrics.PORT}/metrics (sólo este proceso)")
+
+            st.divider()
+            st.subheader("Logs recientes")
+            l1, l2 = st.columns([1, 3])
+            with l1:
+                lvl = st.selectbox("Nivel", ["(Todos)", "ERROR", "WARNING", "INFO", "DEBUG"], key="logs_level")
+            with l2:
+                txt = st.text_input("Contiene", key="logs_contains")
+            logs = query_logs(level=None if lvl == "(Todos)" else lvl, contains=txt.strip() or None, limit=100)
+            if logs:
+                st.dataframe(pd.DataFrame(logs), use_container_width=True, hide_index=True)
+            else:
+                st.caption("Sin entradas.")
+            ls = log_stats()
+            if ls["archives"]:
+                st.caption(f"Archivos de logs archivados: {', '.join(ls['archives'])}")
+
+            st.divider()
+            st.subheader("Asistente IA (OpenAI)")
+            try:
+                from ai import openai_metrics
+                om = openai_metrics()
+                a1, a2, a3, a4, a5 = st.columns(5)
+                a1.metric("Llamadas", om["calls"])
+                a2.metric("Errores", om["errors"])
+                a3.metric("Reintentos", om["retries"])
+                a4.metric("p95 (ms)", om["p95_ms"] if om["p95_ms"] is not None else "-")
+                a5.metric("Cortocircuito", om["breaker"])
+                if om.get("last_error"):
+                    st.caption(f"Último error: {om['last_error']}")
+            except Exception:
+                st.caption("Métricas del asistente no disponibles.")
+
+    elif section == "asistente":
         st.header("Asistente IA")
         st.caption("Chat de ayuda sobre el funcionamiento y consultas (modo local/IA).")
 
@@ -1,7 +1,9 @@
 import bcrypt
 
+import memo
+import metrics
+import storage
 from db import (
-    conn,
     now_iso,
     log,
     get_super_admin_email,
@@ -23,7 +25,7 @@ def verify_password(password: str, password_hash: str) -> bool:
 
 
 def get_user_by_email(email: str):
-    c = conn()
+    c = storage.connect()
     row = c.execute(
         "SELECT * FROM users WHERE email = ?", (email.strip().lower(),)
     ).fetchone()
@@ -31,9 +33,10 @@ def get_user_by_email(email: str):
     return row
 
 
+@memo.invalidates
 def create_user(email, password, name, company, phone, chamber_id, role="user"):
     email_n = email.strip().lower()
-    c = conn()
+    c = storage.connect()
     c.execute(
         """INSERT INTO users(email, password_hash, name, company, phone, chamber_id, role, created_at)
              VALUES(?,?,?,?,?,?,?,?)""",
@@ -62,6 +65,7 @@ def create_user(email, password, name, company, phone, chamber_id, role="user"):
     return user_id
 
 
+@metrics.timed("authenticate")
 def authenticate(email, password):
     u = get_user_by_email(email)
     if not u or not u["is_active"]:
@@ -71,8 +75,9 @@ def authenticate(email, password):
     return None
 
 
+@memo.cached
 def any_admin_exists():
-    c = conn()
+    c = storage.connect()
     row = c.execute("SELECT 1 FROM users WHERE role='admin' LIMIT 1").fetchone()
     c.close()
     return row is not None
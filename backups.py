@@ -0,0 +1,284 @@
+"""Backups deduplicados por chunks, comprimidos, con retención abuelo-padre-hijo.
+
+Layout dentro de BACKUP_DIR:
+- chunks/ab/<sha256>.<codec>  -> cada chunk distinto se guarda una sola vez
+- manifests/cpf_<ts>_<reason>.json -> lista ordenada de chunks de un backup
+
+El DB se copia primero con la API de backup de SQLite (copia consistente) y
+luego se corta en chunks de tamaño fijo, múltiplo del tamaño de página: como
+SQLite modifica páginas en su lugar, entre dos backups cambian pocos chunks.
+"""
+import hashlib
+import json
+import lzma
+import os
+import sqlite3
+import time
+import zlib
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+
+import db
+
+CHUNK_SIZE = int(os.environ.get("CPF_BACKUP_CHUNK_KB", "256")) * 1024
+CODEC = os.environ.get("CPF_BACKUP_CODEC", "zlib")  # zlib (rápido) | xz (más chico)
+
+# Retención GFS: últimos N + el más nuevo de cada día/semana/mes dentro de la ventana
+KEEP_LAST = int(os.environ.get("CPF_BACKUP_KEEP_LAST", "5"))
+KEEP_DAILY = int(os.environ.get("CPF_BACKUP_KEEP_DAILY", "7"))
+KEEP_WEEKLY = int(os.environ.get("CPF_BACKUP_KEEP_WEEKLY", "4"))
+KEEP_MONTHLY = int(os.environ.get("CPF_BACKUP_KEEP_MONTHLY", "12"))
+
+# Chunks más nuevos que esto nunca se borran en GC (un backup en curso puede
+# haberlos escrito sin haber guardado todavía su manifest).
+_GC_GRACE_SECONDS = 3600
+
+
+def _chunks_dir() -> Path:
+    return Path(db.BACKUP_DIR) / "chunks"
+
+
+def manifests_dir() -> Path:
+    return Path(db.BACKUP_DIR) / "manifests"
+
+
+def _compress(data: bytes, codec: str) -> bytes:
+    if codec == "xz":
+        return lzma.compress(data, preset=6)
+    return zlib.compress(data, 6)
+
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    if codec == "xz":
+        return lzma.decompress(data)
+    return zlib.decompress(data)
+
+
+def _chunk_path(digest: str, codec: str) -> Path:
+    return _chunks_dir() / digest[:2] / f"{digest}.{codec}"
+
+
+def _atomic_write(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _snapshot(dst: Path) -> None:
+    """Copia consistente del DB vivo usando la API de backup de SQLite."""
+    src = sqlite3.connect(str(db.DB_PATH))
+    out = sqlite3.connect(str(dst))
+    try:
+        src.backup(out)
+    finally:
+        out.close()
+        src.close()
+
+
+def create_backup(reason: str = "manual") -> Dict[str, Any]:
+    """Crea un backup deduplicado. Devuelve el manifest (con 'path', 'new_chunks', 'stored_bytes')."""
+    db.init_db()
+    t0 = time.perf_counter()
+    ts = datetime.utcnow()
+    # Microsegundos: dos backups en el mismo segundo no se pisan el manifest
+    name = f"cpf_{ts.strftime('%Y%m%d_%H%M%S_%f')}_{reason}"
+    mdir = manifests_dir()
+    mdir.mkdir(parents=True, exist_ok=True)
+    tmp_db = mdir / f".{name}.snapshot"
+    _snapshot(tmp_db)
+    integrity = quick_check(str(tmp_db))
+    try:
+        whole = hashlib.sha256()
+        chunks: List[str] = []
+        new_chunks = 0
+        stored_bytes = 0
+        size = 0
+        with open(tmp_db, "rb") as f:
+            while True:
+                block = f.read(CHUNK_SIZE)
+                if not block:
+                    break
+                size += len(block)
+                whole.update(block)
+                digest = hashlib.sha256(block).hexdigest()
+                cp = _chunk_path(digest, CODEC)
+                if cp.exists():
+                    os.utime(cp)  # lo marca como reciente para el GC
+                else:
+                    data = _compress(block, CODEC)
+                    _atomic_write(cp, data)
+                    new_chunks += 1
+                    stored_bytes += len(data)
+                chunks.append(digest)
+    finally:
+        tmp_db.unlink(missing_ok=True)
+
+    manifest = {
+        "version": 1,
+        "name": name,
+        "reason": reason,
+        "created_at": ts.replace(microsecond=0).isoformat() + "Z",
+        "size": size,
+        "sha256": whole.hexdigest(),
+        "chunk_size": CHUNK_SIZE,
+        "codec": CODEC,
+        "integrity": integrity,
+        "chunks": chunks,
+    }
+    path = mdir / f"{name}.json"
+    _atomic_write(path, json.dumps(manifest).encode("utf-8"))
+    manifest.update(
+        path=str(path),
+        new_chunks=new_chunks,
+        stored_bytes=stored_bytes,
+        duration_ms=round((time.perf_counter() - t0) * 1000, 1),
+    )
+    return manifest
+
+
+def quick_check(path: str) -> str:
+    """'ok' si PRAGMA quick_check pasa sobre el archivo; si no, 'failed'."""
+    try:
+        c = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+        try:
+            row = c.execute("PRAGMA quick_check").fetchone()
+        finally:
+            c.close()
+        return "ok" if row and row[0] == "ok" else "failed"
+    except sqlite3.DatabaseError:
+        return "failed"
+
+
+def is_manifest(path: str) -> bool:
+    return str(path).endswith(".json")
+
+
+def read_manifest(path: str) -> Dict[str, Any]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def restore_to(manifest_path: str, dst: str) -> str:
+    """Rearma el .db de un manifest en `dst` y verifica su sha256."""
+    m = read_manifest(manifest_path)
+    whole = hashlib.sha256()
+    dst_p = Path(dst)
+    dst_p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst_p.with_name(dst_p.name + ".tmp")
+    try:
+        with open(tmp, "wb") as out:
+            for digest in m["chunks"]:
+                block = _decompress(_chunk_path(digest, m.get("codec", "zlib")).read_bytes(), m.get("codec", "zlib"))
+                if hashlib.sha256(block).hexdigest() != digest:
+                    raise ValueError(f"chunk corrupto: {digest}")
+                whole.update(block)
+                out.write(block)
+        if whole.hexdigest() != m["sha256"]:
+            raise ValueError("el backup rearmado no coincide con el checksum del manifest")
+        os.replace(tmp, dst_p)
+    except BaseException:
+        # Chunk faltante/corrupto o checksum distinto: no dejar el .tmp a medio escribir
+        tmp.unlink(missing_ok=True)
+        raise
+    return str(dst_p)
+
+
+def materialize(manifest_path: str) -> bytes:
+    """Bytes del .db completo de un manifest (para descargar)."""
+    m = read_manifest(manifest_path)
+    codec = m.get("codec", "zlib")
+    return b"".join(_decompress(_chunk_path(d, codec).read_bytes(), codec) for d in m["chunks"])
+
+
+def list_manifests() -> List[Path]:
+    mdir = manifests_dir()
+    if not mdir.exists():
+        return []
+    return sorted(mdir.glob("cpf_*.json"), key=lambda p: p.name, reverse=True)
+
+
+def _manifest_time(p: Path) -> datetime:
+    # cpf_YYYYmmdd_HHMMSS[_ffffff]_reason.json
+    try:
+        return datetime.strptime("_".join(p.stem.split("_")[1:3]), "%Y%m%d_%H%M%S")
+    except ValueError:
+        return datetime.utcfromtimestamp(p.stat().st_mtime)
+
+
+def select_retained(times: List[datetime], now: Optional[datetime] = None) -> Set[int]:
+    """Índices de `times` que sobreviven la política GFS."""
+    now = now or datetime.utcnow()
+    order = sorted(range(len(times)), key=lambda i: times[i], reverse=True)
+    keep: Set[int] = set(order[:KEEP_LAST])
+    buckets = (
+        (KEEP_DAILY, timedelta(days=KEEP_DAILY), lambda t: t.strftime("%Y-%m-%d")),
+        (KEEP_WEEKLY, timedelta(weeks=KEEP_WEEKLY), lambda t: "%d-W%02d" % t.isocalendar()[:2]),
+        (KEEP_MONTHLY, timedelta(days=31 * KEEP_MONTHLY), lambda t: t.strftime("%Y-%m")),
+    )
+    for n, window, key in buckets:
+        if n <= 0:
+            continue
+        seen: Set[str] = set()
+        for i in order:  # más nuevo primero: el primero de cada bucket es el que se queda
+            if now - times[i] > window:
+                break
+            k = key(times[i])
+            if k not in seen:
+                seen.add(k)
+                keep.add(i)
+    return keep
+
+
+def apply_retention(now: Optional[datetime] = None) -> Dict[str, int]:
+    """Borra manifests fuera de la política GFS y luego los chunks sin referencia."""
+    items = list_manifests()
+    keep = select_retained([_manifest_time(p) for p in items], now=now)
+    removed: List[str] = []
+    for i, p in enumerate(items):
+        if i not in keep:
+            p.unlink(missing_ok=True)
+            removed.append(str(p))
+    out: Dict[str, Any] = gc_chunks()
+    out["manifests_removed"] = len(removed)
+    out["removed_paths"] = removed
+    return out
+
+
+def gc_chunks() -> Dict[str, int]:
+    """Elimina chunks que ningún manifest referencia (respetando un período de gracia)."""
+    referenced: Set[str] = set()
+    for p in list_manifests():
+        try:
+            referenced.update(read_manifest(str(p))["chunks"])
+        except Exception:
+            # Manifest ilegible: por seguridad no borramos nada
+            return {"chunks_removed": 0, "bytes_freed": 0}
+    removed = 0
+    freed = 0
+    cutoff = time.time() - _GC_GRACE_SECONDS
+    cdir = _chunks_dir()
+    if cdir.exists():
+        for cp in cdir.glob("*/*.*"):
+            digest = cp.name.split(".", 1)[0]
+            if digest in referenced:
+                continue
+            st = cp.stat()
+            if st.st_mtime > cutoff:
+                continue
+            cp.unlink(missing_ok=True)
+            removed += 1
+            freed += st.st_size
+    return {"chunks_removed": removed, "bytes_freed": freed}
+
+
+def store_stats() -> Dict[str, Any]:
+    cdir = _chunks_dir()
+    files = list(cdir.glob("*/*.*")) if cdir.exists() else []
+    return {
+        "manifests": len(list_manifests()),
+        "chunks": len(files),
+        "stored_bytes": sum(p.stat().st_size for p in files),
+    }
@@ -1,16 +1,22 @@
 import os
 import sqlite3
 import shutil
-from datetime import datetime
+import threading
+import time
+from datetime import datetime, timedelta
 from pathlib import Path
 from typing import Dict, List, Optional, Sequence, Tuple, Any
 
+import memo
+import metrics
+
 # -------------------- Paths (Render Persistent Disk) --------------------
 DEFAULT_DISK_MOUNT = os.environ.get("CPF_DISK_MOUNT", "/var/data")
 
 DB_PATH = Path(os.environ.get("CPF_DB_PATH", str(Path(DEFAULT_DISK_MOUNT) / "cpf.db")))
 BACKUP_DIR = Path(os.environ.get("CPF_BACKUP_DIR", str(Path(DEFAULT_DISK_MOUNT) / "backups")))
 UPLOAD_DIR = Path(os.environ.get("CPF_UPLOAD_DIR", str(Path(DEFAULT_DISK_MOUNT) / "uploads")))
+LOG_ARCHIVE_DIR = Path(os.environ.get("CPF_LOG_ARCHIVE_DIR", str(Path(DEFAULT_DISK_MOUNT) / "log_archive")))
 
 # Ensure dirs exist
 BACKUP_DIR.mkdir(parents=True, exist_ok=True)
@@ -24,8 +30,87 @@ def now_iso() -> str:
     return datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
 
 
+_LOCK_ERRORS_EXECUTE = metrics.DB_LOCK_ERRORS.labels("execute")
+_LOCK_ERRORS_COMMIT = metrics.DB_LOCK_ERRORS.labels("commit")
+_COMMIT_SECONDS = metrics.DB_COMMIT.labels()
+
+
+def _is_lock_error(e: sqlite3.OperationalError) -> bool:
+    msg = str(e)
+    return "locked" in msg or "busy" in msg
+
+
+class _TrackedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        try:
+            return super().execute(sql, parameters)
+        except sqlite3.OperationalError as e:
+            if _is_lock_error(e):
+                _LOCK_ERRORS_EXECUTE.inc()
+            raise
+
+    def executemany(self, sql, seq_of_parameters):
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        except sqlite3.OperationalError as e:
+            if _is_lock_error(e):
+                _LOCK_ERRORS_EXECUTE.inc()
+            raise
+
+
+class _TrackedConnection(sqlite3.Connection):
+    """Connection that feeds metrics.py: open connections, commit time, 'database is locked' errors."""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._tracked_open = True
+        metrics.connection_opened()
+
+    def cursor(self, factory=_TrackedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        try:
+            return super().execute(sql, parameters)
+        except sqlite3.OperationalError as e:
+            if _is_lock_error(e):
+                _LOCK_ERRORS_EXECUTE.inc()
+            raise
+
+    def executemany(self, sql, seq_of_parameters):
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        except sqlite3.OperationalError as e:
+            if _is_lock_error(e):
+                _LOCK_ERRORS_EXECUTE.inc()
+            raise
+
+    def commit(self) -> None:
+        t0 = time.perf_counter()
+        try:
+            super().commit()
+        except sqlite3.OperationalError as e:
+            if _is_lock_error(e):
+                _LOCK_ERRORS_COMMIT.inc()
+            raise
+        finally:
+            _COMMIT_SECONDS.observe(time.perf_counter() - t0)
+
+    def close(self) -> None:
+        if self._tracked_open:
+            self._tracked_open = False
+            metrics.connection_closed()
+        super().close()
+
+    def __del__(self) -> None:
+        # Connections nobody closed stop counting once they are garbage-collected
+        if getattr(self, "_tracked_open", False):
+            self._tracked_open = False
+            metrics.connection_closed()
+
+
 def _raw_conn() -> sqlite3.Connection:
-    c = sqlite3.connect(str(DB_PATH), check_same_thread=False)
+    c = sqlite3.connect(str(DB_PATH), check_same_thread=False, factory=_TrackedConnection)
     c.row_factory = sqlite3.Row
     try:
         c.execute("PRAGMA foreign_keys = ON")
@@ -63,7 +148,14 @@ def init_db() -> None:
         return
 
     c = _raw_conn()
+    _apply_schema(c)
+    c.commit()
+    c.close()
+    _SCHEMA_READY = True
 
+
+def _apply_schema(c: sqlite3.Connection) -> None:
+    """Base schema + migrations on any connection (live DB or a staged restore)."""
     # --- Settings / Logs (for small config and debugging) ---
     c.execute(
         """CREATE TABLE IF NOT EXISTS settings(
@@ -87,6 +179,8 @@ def init_db() -> None:
             name TEXT NOT NULL UNIQUE,
             province TEXT,
             city TEXT,
+            province_code TEXT,              -- gazetteer.resolve(city, province)
+            city_code TEXT,
             created_at TEXT NOT NULL
         )"""
     )
@@ -121,6 +215,13 @@ def init_db() -> None:
             status TEXT NOT NULL DEFAULT 'open',  -- open/closed
             company TEXT,
             location TEXT,
+            province_code TEXT,              -- gazetteer.resolve(location), ISO 3166-2:AR
+            city_code TEXT,                  -- "AR-S:rosario"
+            simhash INTEGER,                 -- near-duplicate fingerprint (simhash.py), signed 64-bit
+            sh_b0 INTEGER,                   -- simhash split in 4 indexed 16-bit bands
+            sh_b1 INTEGER,
+            sh_b2 INTEGER,
+            sh_b3 INTEGER,
             chamber_id INTEGER,
             user_id INTEGER NOT NULL,
             created_at TEXT NOT NULL,
@@ -138,6 +239,15 @@ def init_db() -> None:
         )"""
     )
 
+    # --- Change counters (bumped in the write transaction; cheap ETag / snapshot versions) ---
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS data_versions(
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )"""
+    )
+    c.execute("INSERT INTO data_versions(name, version) VALUES('requirements', 0) ON CONFLICT(name) DO NOTHING")
+
     # --- Attachments ---
     c.execute(
         """CREATE TABLE IF NOT EXISTS attachments(
@@ -181,11 +291,176 @@ def init_db() -> None:
         )"""
     )
 
+    # --- Per-user counters (maintained on write by services) ---
+    counters_existed = _table_exists(c, "user_counters")
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS user_counters(
+            user_id INTEGER PRIMARY KEY,
+            inbox_pending INTEGER NOT NULL DEFAULT 0,
+            sent_pending INTEGER NOT NULL DEFAULT 0
+        )"""
+    )
+
+    # --- Outbox (notifications written with the contact change, sent by notify.py) ---
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS outbox(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            event TEXT NOT NULL,
+            payload TEXT NOT NULL,            -- JSON
+            status TEXT NOT NULL DEFAULT 'pending',  -- pending/delivered/dead
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            delivered_at TEXT,
+            delivered_sinks TEXT,             -- comma-separated Sink.name that accepted it
+            last_error TEXT
+        )"""
+    )
+
+    # --- Backup catalog (indexed listing instead of globbing BACKUP_DIR) ---
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS backup_catalog(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            path TEXT NOT NULL UNIQUE,
+            kind TEXT NOT NULL,               -- chunked/full/external
+            reason TEXT,
+            size INTEGER,                     -- bytes of the (reassembled) .db
+            stored_size INTEGER,              -- new bytes written to disk by this backup
+            checksum TEXT,                    -- sha256 of the .db
+            duration_ms REAL,
+            integrity TEXT NOT NULL DEFAULT 'unchecked',  -- ok/failed/unchecked
+            created_at TEXT NOT NULL,
+            missing INTEGER NOT NULL DEFAULT 0
+        )"""
+    )
+
+    # --- Fuzzy search (trigram index over the vocabulary, maintained by services; see fuzzy.py) ---
+    fuzzy_existed = _table_exists(c, "search_terms")
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS search_terms(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            term TEXT NOT NULL UNIQUE,        -- word normalized with textnorm.norm_text
+            ntrgm INTEGER NOT NULL            -- number of trigrams of the word
+        )"""
+    )
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS term_trigrams(
+            trigram TEXT NOT NULL,
+            term_id INTEGER NOT NULL,
+            PRIMARY KEY(trigram, term_id)
+        ) WITHOUT ROWID"""
+    )
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS requirement_terms(
+            term_id INTEGER NOT NULL,
+            requirement_id INTEGER NOT NULL,
+            PRIMARY KEY(term_id, requirement_id)
+        ) WITHOUT ROWID"""
+    )
+
+    # --- Tags (normalized from requirements.tags, maintained by services; see tagging.py) ---
+    tags_existed = _table_exists(c, "tags")
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS tags(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,        -- normalized (no accents, lowercase)
+            label TEXT NOT NULL               -- first spelling seen, for display
+        )"""
+    )
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS requirement_tags(
+            tag_id INTEGER NOT NULL,
+            requirement_id INTEGER NOT NULL,
+            PRIMARY KEY(tag_id, requirement_id)
+        ) WITHOUT ROWID"""
+    )
+
+    # --- Precomputed sparse vectors for counterpart suggestions (maintained by services; see vectors.py) ---
+    vectors_existed = _table_exists(c, "requirement_vectors") and _table_exists(c, "vector_df")
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS requirement_vectors(
+            requirement_id INTEGER PRIMARY KEY,
+            idx BLOB NOT NULL,                -- array('I') of hashed feature indexes
+            val BLOB NOT NULL                 -- array('f') of L2-normalized tf-idf weights
+        )"""
+    )
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS vector_df(
+            feature INTEGER PRIMARY KEY,      -- hashed feature index
+            df INTEGER NOT NULL               -- requirements whose vector has it
+        )"""
+    )
+
+    # --- Incremental counterpart suggestions (queue + results; see suggestions.py) ---
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS match_queue(
+            requirement_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 1,   -- bumped on re-enqueue while pending/claimed
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at TEXT NOT NULL,
+            enqueued_at TEXT NOT NULL,
+            last_error TEXT
+        )"""
+    )
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS match_suggestions(
+            requirement_id INTEGER NOT NULL,
+            counterpart_id INTEGER NOT NULL,
+            score REAL NOT NULL,
+            created_at TEXT NOT NULL,
+            PRIMARY KEY(requirement_id, counterpart_id)
+        ) WITHOUT ROWID"""
+    )
+
+    # --- Scheduled maintenance (leader lease + run history; see maintenance.py) ---
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS scheduler_lease(
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,                  -- host:pid:nonce of the leader process
+            acquired_at TEXT NOT NULL,
+            expires_at TEXT NOT NULL
+        )"""
+    )
+    c.execute(
+        """CREATE TABLE IF NOT EXISTS job_runs(
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job TEXT NOT NULL,
+            owner TEXT NOT NULL,
+            started_at TEXT NOT NULL,
+            finished_at TEXT,
+            duration_ms REAL,
+            status TEXT NOT NULL,                 -- running | ok | overrun | timeout | error
+            detail TEXT                           -- JSON
+        )"""
+    )
+
+    geo_existed = "province_code" in _table_columns(c, "requirements")
+    simhash_existed = "simhash" in _table_columns(c, "requirements")
+
     _migrate_schema(c)
+    _ensure_indexes(c)
+    if not counters_existed:
+        rebuild_user_counters(c)
+    if not fuzzy_existed:
+        import fuzzy
 
-    c.commit()
-    c.close()
-    _SCHEMA_READY = True
+        fuzzy.rebuild_index(c)
+    if not tags_existed:
+        import tagging
+
+        tagging.rebuild(c)
+    if not vectors_existed:
+        import vectors
+
+        vectors.rebuild(c)
+    if not geo_existed:
+        import gazetteer
+
+        gazetteer.backfill(c)
+    if not simhash_existed:
+        import simhash
+
+        simhash.backfill(c)
 
 
 def _migrate_schema(c: sqlite3.Connection) -> None:
@@ -214,6 +489,8 @@ def _migrate_schema(c: sqlite3.Connection) -> None:
     if _table_exists(c, "chambers"):
         _add_column_if_missing(c, "chambers", "province", "province TEXT")
         _add_column_if_missing(c, "chambers", "city", "city TEXT")
+        _add_column_if_missing(c, "chambers", "province_code", "province_code TEXT")
+        _add_column_if_missing(c, "chambers", "city_code", "city_code TEXT")
         _add_column_if_missing(c, "chambers", "created_at", "created_at TEXT")
 
     # Requirements: align columns
@@ -229,6 +506,11 @@ def _migrate_schema(c: sqlite3.Connection) -> None:
         _add_column_if_missing(c, "requirements", "status", "status TEXT NOT NULL DEFAULT 'open'")
         _add_column_if_missing(c, "requirements", "company", "company TEXT")
         _add_column_if_missing(c, "requirements", "location", "location TEXT")
+        _add_column_if_missing(c, "requirements", "province_code", "province_code TEXT")
+        _add_column_if_missing(c, "requirements", "city_code", "city_code TEXT")
+        _add_column_if_missing(c, "requirements", "simhash", "simhash INTEGER")
+        for band in ("sh_b0", "sh_b1", "sh_b2", "sh_b3"):
+            _add_column_if_missing(c, "requirements", band, f"{band} INTEGER")
         _add_column_if_missing(c, "requirements", "chamber_id", "chamber_id INTEGER")
         _add_column_if_missing(c, "requirements", "user_id", "user_id INTEGER")
         _add_column_if_missing(c, "requirements", "created_at", "created_at TEXT")
@@ -379,6 +661,9 @@ def _migrate_schema(c: sqlite3.Connection) -> None:
         except Exception:
             pass
 
+    if _table_exists(c, "outbox"):
+        _add_column_if_missing(c, "outbox", "delivered_sinks", "delivered_sinks TEXT")
+
     # Contact requests: align columns
     if _table_exists(c, "contact_requests"):
         _add_column_if_missing(c, "contact_requests", "from_user_id", "from_user_id INTEGER")
@@ -389,21 +674,271 @@ def _migrate_schema(c: sqlite3.Connection) -> None:
         _add_column_if_missing(c, "contact_requests", "responded_at", "responded_at TEXT")
 
 
+def _ensure_indexes(c: sqlite3.Connection) -> None:
+    """Indexes for the hot query paths (idempotent)."""
+    # At most one pending request per (from, to, requirement). Old DBs may hold
+    # duplicates from double clicks: keep the oldest, mark the rest.
+    if not c.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='index' AND name='ux_contact_pending'"
+    ).fetchone():
+        cur = c.execute(
+            """UPDATE contact_requests SET status='duplicate', responded_at=?
+               WHERE status='pending' AND id NOT IN (
+                   SELECT MIN(id) FROM contact_requests WHERE status='pending'
+                   GROUP BY from_user_id, to_user_id, requirement_id
+               )""",
+            (now_iso(),),
+        )
+        c.execute(
+            """CREATE UNIQUE INDEX IF NOT EXISTS ux_contact_pending
+               ON contact_requests(from_user_id, to_user_id, requirement_id) WHERE status='pending'"""
+        )
+        if cur.rowcount and _table_exists(c, "user_counters"):
+            rebuild_user_counters(c)
+    c.execute("CREATE INDEX IF NOT EXISTS ix_outbox_status_next ON outbox(status, next_attempt_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_req_status_created ON requirements(status, created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_req_user_created ON requirements(user_id, created_at)")
+    # Covering index for services.requirement_facets (GROUP BY over the facet columns)
+    c.execute("DROP INDEX IF EXISTS ix_req_facets")
+    c.execute(
+        """CREATE INDEX IF NOT EXISTS ix_req_facets_region
+           ON requirements(chamber_id, type, category, urgency, status, province_code)"""
+    )
+    # Region filter (search / matching candidates): prune by province or city first
+    c.execute("CREATE INDEX IF NOT EXISTS ix_req_province ON requirements(province_code, status, type)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_req_city ON requirements(city_code, status, type)")
+    # Counterpart candidates: open requirements of the opposite type, newest first
+    c.execute("CREATE INDEX IF NOT EXISTS ix_req_status_type_created ON requirements(status, type, created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_match_queue_next ON match_queue(next_attempt_at)")
+    # Near-duplicate lookup: one index per simhash band (simhash.candidates_sql probes all four)
+    for band in ("sh_b0", "sh_b1", "sh_b2", "sh_b3"):
+        c.execute(f"CREATE INDEX IF NOT EXISTS ix_req_{band} ON requirements({band})")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_match_suggestions_counterpart ON match_suggestions(counterpart_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_job_runs_job ON job_runs(job, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_backup_catalog_created ON backup_catalog(missing, created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_requirement_terms_req ON requirement_terms(requirement_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_requirement_tags_req ON requirement_tags(requirement_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_logs_ts ON logs(ts)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_logs_level_ts ON logs(level, ts)")
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS ix_contact_to_status_created ON contact_requests(to_user_id, status, created_at)"
+    )
+    c.execute(
+        "CREATE INDEX IF NOT EXISTS ix_contact_from_status_created ON contact_requests(from_user_id, status, created_at)"
+    )
+
+
+def bump_data_version(c: Any, name: str = "requirements") -> None:
+    """Advance a data_versions counter inside the caller's write transaction."""
+    c.execute("UPDATE data_versions SET version = version + 1 WHERE name=?", (name,))
+
+
+def rebuild_user_counters(c: sqlite3.Connection) -> None:
+    """Recompute user_counters from contact_requests (backfill / repair)."""
+    c.execute("DELETE FROM user_counters")
+    c.execute(
+        """INSERT INTO user_counters(user_id, inbox_pending, sent_pending)
+           SELECT user_id, SUM(inbox), SUM(sent) FROM (
+               SELECT to_user_id AS user_id, 1 AS inbox, 0 AS sent FROM contact_requests WHERE status='pending'
+               UNION ALL
+               SELECT from_user_id AS user_id, 0 AS inbox, 1 AS sent FROM contact_requests WHERE status='pending'
+           ) AS p GROUP BY user_id"""
+    )
+
+
+# -------------------- DB generation (restore signalling) --------------------
+# A restore swaps DB_PATH atomically and bumps the counter stored in GEN_PATH.
+# Every worker process checks it (one stat) when opening a connection and, if
+# it moved, re-runs init_db and notifies listeners (caches/snapshots) to reopen.
+GEN_PATH = DB_PATH.with_name(DB_PATH.name + ".gen")
+_GEN_STATE: Dict[str, Any] = {"mtime": None, "gen": 0}
+_GEN_LISTENERS: List[Any] = []
+
+
+def db_generation() -> int:
+    try:
+        st = GEN_PATH.stat()
+    except FileNotFoundError:
+        return 0
+    if st.st_mtime_ns != _GEN_STATE["mtime"]:
+        try:
+            _GEN_STATE["gen"] = int(GEN_PATH.read_text().strip() or 0)
+            _GEN_STATE["mtime"] = st.st_mtime_ns
+        except (OSError, ValueError):
+            pass
+    return int(_GEN_STATE["gen"])
+
+
+def on_generation_change(fn) -> None:
+    """Register a callback(new_generation) run when the DB file was swapped by a restore."""
+    _GEN_LISTENERS.append(fn)
+
+
+_SEEN_GENERATION: Optional[int] = None
+
+
+def _check_generation() -> None:
+    global _SEEN_GENERATION, _SCHEMA_READY
+    gen = db_generation()
+    if _SEEN_GENERATION is None:
+        _SEEN_GENERATION = gen
+        return
+    if gen != _SEEN_GENERATION:
+        _SEEN_GENERATION = gen
+        _SCHEMA_READY = False
+        for fn in list(_GEN_LISTENERS):
+            try:
+                fn(gen)
+            except Exception:
+                pass
+
+
+def _bump_generation() -> int:
+    gen = db_generation() + 1
+    tmp = GEN_PATH.with_name(GEN_PATH.name + ".tmp")
+    tmp.write_text(str(gen))
+    os.replace(tmp, GEN_PATH)
+    return gen
+
+
 def conn() -> sqlite3.Connection:
+    _check_generation()
     init_db()
     return _raw_conn()
 
 
+# -------------------- Read snapshot (optional) --------------------
+# CPF_READ_SNAPSHOT=1: each worker serves browse reads from an in-memory copy of
+# the read-mostly tables only (SNAPSHOT_TABLES, with their indexes). Logs,
+# outbox, queues and the search/vector indexes stay on disk, so their writes
+# never trigger a copy. At most every CPF_READ_SNAPSHOT_REFRESH_S seconds the
+# worker compares a count/max-id fingerprint of those tables plus the
+# requirements change counter (data_versions) and re-copies them only if it
+# moved, right after this worker writes, or after CPF_READ_SNAPSHOT_MAX_AGE_S
+# (catches chamber/user edits that move no fingerprint column).
+# Queries against read_conn() must only touch SNAPSHOT_TABLES.
+READ_SNAPSHOT = os.environ.get("CPF_READ_SNAPSHOT", "0") == "1"
+READ_SNAPSHOT_REFRESH_S = float(os.environ.get("CPF_READ_SNAPSHOT_REFRESH_S", "2"))
+READ_SNAPSHOT_MAX_AGE_S = float(os.environ.get("CPF_READ_SNAPSHOT_MAX_AGE_S", "60"))
+SNAPSHOT_TABLES = ("requirements", "chambers", "attachments", "users", "tags", "requirement_tags", "data_versions")
+
+
+class _SnapshotConnection(sqlite3.Connection):
+    """Shared in-memory connection: callers may close() it as usual, it stays open."""
+
+    def close(self) -> None:  # noqa: D401
+        pass
+
+
+_SNAP_LOCK = threading.Lock()
+_SNAPSHOT_HIT = metrics.CACHE_REQUESTS.labels("read_snapshot", "hit")
+_SNAPSHOT_REFRESH = metrics.CACHE_REQUESTS.labels("read_snapshot", "miss")
+_SNAP: Dict[str, Any] = {"conn": None, "watch": None, "version": None, "at": 0.0, "built": 0.0, "dirty": True}
+
+
+def invalidate_read_snapshot(*_: Any) -> None:
+    """Force a refresh on the next read (after a local write or a restore)."""
+    _SNAP["dirty"] = True
+
+
+def _reset_snapshot_watch(*_: Any) -> None:
+    with _SNAP_LOCK:
+        if _SNAP["watch"] is not None:
+            try:
+                _SNAP["watch"].close()
+            except Exception:
+                pass
+        _SNAP["watch"] = None
+        _SNAP["dirty"] = True
+
+
+on_generation_change(_reset_snapshot_watch)
+
+
+def _snapshot_fingerprint(c: sqlite3.Connection, schema: str = "main") -> str:
+    """Changes on insert/delete in any SNAPSHOT_TABLES and on every requirement write."""
+    keyed = [t for t in SNAPSHOT_TABLES if t not in ("requirement_tags", "data_versions")]
+    parts = [f"SELECT COUNT(*), MAX(id), NULL FROM {schema}.{t}" for t in keyed]
+    parts.append(f"SELECT COUNT(*), MAX(requirement_id), MAX(tag_id) FROM {schema}.requirement_tags")
+    parts.append(f"SELECT NULL, NULL, MAX(version) FROM {schema}.data_versions")
+    return "|".join(":".join(str(v) for v in r) for r in c.execute(" UNION ALL ".join(parts)).fetchall())
+
+
+def _copy_snapshot() -> Tuple[sqlite3.Connection, str]:
+    """In-memory DB with SNAPSHOT_TABLES (schema, rows, indexes) copied in one read transaction."""
+    mem = sqlite3.connect(":memory:", factory=_SnapshotConnection, check_same_thread=False)
+    mem.execute("ATTACH DATABASE ? AS disk", (str(DB_PATH),))
+    try:
+        mem.execute("BEGIN")
+        marks = ",".join("?" * len(SNAPSHOT_TABLES))
+        ddl = mem.execute(
+            f"""SELECT type, name, sql FROM disk.sqlite_master
+                WHERE tbl_name IN ({marks}) AND type IN ('table', 'index') AND sql IS NOT NULL
+                ORDER BY type DESC""",
+            SNAPSHOT_TABLES,
+        ).fetchall()
+        for kind, name, sql in ddl:
+            if kind == "table":
+                mem.execute(sql)
+                mem.execute(f"INSERT INTO main.{name} SELECT * FROM disk.{name}")
+        for kind, name, sql in ddl:
+            if kind == "index":
+                mem.execute(sql)
+        version = _snapshot_fingerprint(mem, "disk")
+        mem.execute("COMMIT")
+    finally:
+        mem.execute("DETACH DATABASE disk")
+    mem.row_factory = sqlite3.Row
+    return mem, version
+
+
+def _refresh_snapshot() -> sqlite3.Connection:
+    with _SNAP_LOCK:
+        now = time.monotonic()
+        have = _SNAP["conn"] is not None and not _SNAP["dirty"]
+        if have and now - _SNAP["at"] < READ_SNAPSHOT_REFRESH_S:
+            _SNAPSHOT_HIT.inc()
+            return _SNAP["conn"]
+        if _SNAP["watch"] is None:
+            _SNAP["watch"] = sqlite3.connect(str(DB_PATH), check_same_thread=False)
+        if have and now - _SNAP["built"] < READ_SNAPSHOT_MAX_AGE_S:
+            if _snapshot_fingerprint(_SNAP["watch"]) == _SNAP["version"]:
+                _SNAP["at"] = now
+                _SNAPSHOT_HIT.inc()
+                return _SNAP["conn"]
+        _SNAPSHOT_REFRESH.inc()
+        mem, version = _copy_snapshot()
+        _SNAP.update(conn=mem, version=version, at=now, built=now, dirty=False)
+        return mem
+
+
+def read_conn() -> sqlite3.Connection:
+    """Connection for read-only browse queries (snapshot if enabled, else the disk DB)."""
+    if not READ_SNAPSHOT:
+        return conn()
+    _check_generation()
+    init_db()
+    try:
+        return _refresh_snapshot()
+    except Exception:
+        return _raw_conn()
+
+
 # -------------------- Settings helpers --------------------
 def get_setting(key: str, default: Optional[str] = None) -> Optional[str]:
-    c = conn()
+    import storage
+
+    c = storage.connect()
     row = c.execute("SELECT value FROM settings WHERE key=?", (key,)).fetchone()
     c.close()
     return row["value"] if row else default
 
 
+@memo.invalidates
 def set_setting(key: str, value: Optional[str]) -> None:
-    c = conn()
+    import storage
+
+    c = storage.connect()
     if value is None:
         c.execute("DELETE FROM settings WHERE key=?", (key,))
     else:
@@ -416,8 +951,10 @@ def set_setting(key: str, value: Optional[str]) -> None:
 def log(*parts: Any, level: str = "INFO") -> None:
     """Flexible logger: accepts many args and joins them into one message."""
     try:
+        import storage
+
         msg = " ".join("" if p is None else str(p) for p in parts).strip() or "-"
-        c = conn()
+        c = storage.connect()
         c.execute("INSERT INTO logs(ts, level, msg) VALUES(?,?,?)", (now_iso(), level, msg))
         c.commit()
         c.close()
@@ -426,6 +963,167 @@ def log(*parts: Any, level: str = "INFO") -> None:
         pass
 
 
+def _parse_retention(spec: str) -> Dict[str, int]:
+    out: Dict[str, int] = {}
+    for part in (spec or "").split(","):
+        if "=" in part:
+            k, v = part.split("=", 1)
+            try:
+                out[k.strip().upper()] = int(v)
+            except ValueError:
+                pass
+    return out
+
+
+# Days kept in the hot DB per level ("*" = any other level). Older rows move to
+# monthly archive files (LOG_ARCHIVE_DIR/logs_YYYYMM.db), kept LOG_ARCHIVE_MONTHS.
+LOG_RETENTION_DAYS: Dict[str, int] = {"DEBUG": 3, "INFO": 30, "WARNING": 90, "ERROR": 365, "*": 30}
+LOG_RETENTION_DAYS.update(_parse_retention(os.environ.get("CPF_LOG_RETENTION", "")))
+LOG_ARCHIVE_MONTHS = int(os.environ.get("CPF_LOG_ARCHIVE_MONTHS", "12"))
+
+
+def _archive_conn(month: str) -> sqlite3.Connection:
+    LOG_ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    a = sqlite3.connect(str(LOG_ARCHIVE_DIR / f"logs_{month}.db"))
+    a.execute(
+        """CREATE TABLE IF NOT EXISTS logs(
+            id INTEGER PRIMARY KEY,
+            ts TEXT NOT NULL,
+            level TEXT NOT NULL,
+            msg TEXT NOT NULL
+        )"""
+    )
+    a.execute("CREATE INDEX IF NOT EXISTS ix_logs_level_ts ON logs(level, ts)")
+    return a
+
+
+def compact_logs(batch: int = 5000, now: Optional[datetime] = None, deadline: Optional[float] = None) -> Dict[str, int]:
+    """Move log rows past their level's retention into monthly archive DBs.
+
+    Works in batches (short write transactions) and drops archive files older
+    than LOG_ARCHIVE_MONTHS. `deadline` (time.monotonic()) stops between batches;
+    the rest is moved on the next call. Returns {"archived": n, "archive_files_removed": m}.
+    """
+    now = now or datetime.utcnow()
+    explicit = [lv for lv in LOG_RETENTION_DAYS if lv != "*"]
+    selectors: List[Tuple[str, List[Any]]] = []
+    for lv in explicit:
+        cutoff = (now - timedelta(days=LOG_RETENTION_DAYS[lv])).replace(microsecond=0).isoformat() + "Z"
+        selectors.append(("level=? AND ts<?", [lv, cutoff]))
+    if "*" in LOG_RETENTION_DAYS:
+        cutoff = (now - timedelta(days=LOG_RETENTION_DAYS["*"])).replace(microsecond=0).isoformat() + "Z"
+        marks = ",".join("?" * len(explicit)) or "''"
+        selectors.append((f"level NOT IN ({marks}) AND ts<?", [*explicit, cutoff]))
+
+    import storage
+
+    archived = 0
+    c = storage.connect()
+    try:
+        for where, params in selectors:
+            while True:
+                rows = c.execute(
+                    f"SELECT id, ts, level, msg FROM logs WHERE {where} ORDER BY ts LIMIT ?",
+                    (*params, int(batch)),
+                ).fetchall()
+                if not rows:
+                    break
+                by_month: Dict[str, List[tuple]] = {}
+                for r in rows:
+                    month = (r["ts"] or "")[:7].replace("-", "") or "unknown"
+                    by_month.setdefault(month, []).append((r["id"], r["ts"], r["level"], r["msg"]))
+                for month, items in by_month.items():
+                    a = _archive_conn(month)
+                    a.executemany("INSERT OR IGNORE INTO logs(id, ts, level, msg) VALUES(?,?,?,?)", items)
+                    a.commit()
+                    a.close()
+                c.executemany("DELETE FROM logs WHERE id=?", [(r["id"],) for r in rows])
+                c.commit()
+                archived += len(rows)
+                if len(rows) < batch or (deadline is not None and time.monotonic() > deadline):
+                    break
+    finally:
+        c.close()
+
+    removed = 0
+    if LOG_ARCHIVE_DIR.exists():
+        oldest = (now.year * 12 + now.month - 1) - LOG_ARCHIVE_MONTHS
+        for p in LOG_ARCHIVE_DIR.glob("logs_*.db"):
+            tag = p.stem[len("logs_"):]
+            if len(tag) == 6 and tag.isdigit() and int(tag[:4]) * 12 + int(tag[4:]) - 1 < oldest:
+                p.unlink(missing_ok=True)
+                removed += 1
+    return {"archived": archived, "archive_files_removed": removed}
+
+
+def query_logs(
+    level: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    contains: Optional[str] = None,
+    limit: int = 100,
+    before_id: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Recent log entries from the hot DB, newest first (ix_logs_ts / ix_logs_level_ts).
+
+    `since`/`until` are ISO timestamps like now_iso(); `before_id` pages backwards.
+    Read through storage, where log() writes (SQLite or PostgreSQL).
+    """
+    import storage
+
+    sql = "SELECT id, ts, level, msg FROM logs WHERE 1=1"
+    params: List[Any] = []
+    if level:
+        sql += " AND level=?"
+        params.append(level.upper())
+    if since:
+        sql += " AND ts>=?"
+        params.append(since)
+    if until:
+        sql += " AND ts<?"
+        params.append(until)
+    if before_id:
+        sql += " AND id<?"
+        params.append(int(before_id))
+    if contains:
+        sql += " AND msg LIKE ?"
+        params.append(f"%{contains}%")
+    sql += " ORDER BY ts DESC, id DESC LIMIT ?"
+    params.append(int(limit))
+    return storage.fetch(sql, params)
+
+
+def log_stats() -> Dict[str, Any]:
+    import storage
+
+    levels = storage.fetch("SELECT level, COUNT(*) AS n, MIN(ts) AS oldest FROM logs GROUP BY level")
+    archives = sorted(p.name for p in LOG_ARCHIVE_DIR.glob("logs_*.db")) if LOG_ARCHIVE_DIR.exists() else []
+    return {"levels": levels, "archives": archives}
+
+
+_compactor: Optional[threading.Thread] = None
+_compactor_lock = threading.Lock()
+
+
+def ensure_log_compactor(interval_s: float = 3600.0) -> None:
+    """Start (once per process) a daemon thread that runs compact_logs periodically."""
+    global _compactor
+    with _compactor_lock:
+        if _compactor is not None and _compactor.is_alive():
+            return
+
+        def _loop() -> None:
+            while True:
+                try:
+                    compact_logs()
+                except Exception:
+                    pass
+                time.sleep(interval_s)
+
+        _compactor = threading.Thread(target=_loop, name="cpf-log-compactor", daemon=True)
+        _compactor.start()
+
+
 # -------------------- Backup / Restore --------------------
 def get_backup_dir() -> str:
     return str(BACKUP_DIR)
@@ -438,43 +1136,337 @@ def set_backup_dir(path: str) -> None:
     BACKUP_DIR = Path(path)
     BACKUP_DIR.mkdir(parents=True, exist_ok=True)
     set_setting("backup_dir", str(BACKUP_DIR))
+    reconcile_backups()
+
+
+BACKUP_MODE = os.environ.get("CPF_BACKUP_MODE", "chunked")  # chunked | full
 
 
 def backup_db(reason: str = "manual") -> str:
-    """Create a .db copy inside BACKUP_DIR and store last path in settings."""
+    """Create a backup, record it in backup_catalog and store its path in settings.
+
+    Default (chunked): deduplicated, compressed chunks + a JSON manifest (see
+    backups.py), followed by GFS retention. CPF_BACKUP_MODE=full keeps the old
+    behaviour of a plain .db copy inside BACKUP_DIR.
+    """
+    import backups
+    import storage
+
+    if not storage.is_sqlite():
+        raise RuntimeError("Con PostgreSQL los backups se hacen del lado del servidor (pg_dump / snapshots).")
     init_db()
     BACKUP_DIR.mkdir(parents=True, exist_ok=True)
-    ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-    dst = BACKUP_DIR / f"cpf_{ts}_{reason}.db"
-    shutil.copy2(DB_PATH, dst)
-    set_setting("last_backup_path", str(dst))
-    return str(dst)
+
+    if BACKUP_MODE == "full":
+        t0 = time.perf_counter()
+        ts = datetime.utcnow().strftime("%Y%m%d_%H%M%S_%f")
+        dst = BACKUP_DIR / f"cpf_{ts}_{reason}.db"
+        shutil.copy2(DB_PATH, dst)
+        _catalog_add(
+            str(dst),
+            kind="full",
+            reason=reason,
+            size=dst.stat().st_size,
+            stored_size=dst.stat().st_size,
+            checksum=_sha256_file(dst),
+            duration_ms=round((time.perf_counter() - t0) * 1000, 1),
+            integrity=backups.quick_check(str(dst)),
+        )
+        set_setting("last_backup_path", str(dst))
+        return str(dst)
+
+    m = backups.create_backup(reason)
+    _catalog_add(
+        m["path"],
+        kind="chunked",
+        reason=reason,
+        size=m["size"],
+        stored_size=m["stored_bytes"],
+        checksum=m["sha256"],
+        duration_ms=m["duration_ms"],
+        integrity=m["integrity"],
+        created_at=m["created_at"],
+    )
+    set_setting("last_backup_path", m["path"])
+    try:
+        r = backups.apply_retention()
+        _catalog_mark_missing(r["removed_paths"])
+    except Exception as e:
+        log("backup", "retention_failed", str(e), level="WARNING")
+    return m["path"]
 
 
-def list_backups(limit: int = 50) -> List[str]:
+def _sha256_file(path: Path) -> str:
+    import hashlib
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _catalog_add(path: str, *, kind: str, reason: Optional[str], created_at: Optional[str] = None, **fields: Any) -> None:
+    c = conn()
+    c.execute(
+        """INSERT INTO backup_catalog(path, kind, reason, size, stored_size, checksum, duration_ms, integrity, created_at, missing)
+           VALUES(?,?,?,?,?,?,?,?,?,0)
+           ON CONFLICT(path) DO UPDATE SET
+               kind=excluded.kind, reason=excluded.reason, size=excluded.size, stored_size=excluded.stored_size,
+               checksum=excluded.checksum, duration_ms=excluded.duration_ms, integrity=excluded.integrity,
+               created_at=excluded.created_at, missing=0""",
+        (
+            path,
+            kind,
+            reason,
+            fields.get("size"),
+            fields.get("stored_size"),
+            fields.get("checksum"),
+            fields.get("duration_ms"),
+            fields.get("integrity") or "unchecked",
+            created_at or now_iso(),
+        ),
+    )
+    c.commit()
+    c.close()
+
+
+def _catalog_mark_missing(paths: Sequence[str]) -> None:
+    if not paths:
+        return
+    c = conn()
+    c.executemany("UPDATE backup_catalog SET missing=1 WHERE path=?", [(p,) for p in paths])
+    c.commit()
+    c.close()
+
+
+def _backup_files() -> List[Path]:
+    return list(BACKUP_DIR.glob("*.db")) + list((BACKUP_DIR / "manifests").glob("cpf_*.json"))
+
+
+def reconcile_backups() -> Dict[str, int]:
+    """Sync backup_catalog with BACKUP_DIR: add files created out of band, flag deleted ones."""
     BACKUP_DIR.mkdir(parents=True, exist_ok=True)
-    items = sorted(BACKUP_DIR.glob("*.db"), key=lambda p: p.stat().st_mtime, reverse=True)
-    return [str(p) for p in items[: max(1, int(limit))]]
+    on_disk = {str(p): p for p in _backup_files()}
+    c = conn()
+    known = {r["path"]: int(r["missing"]) for r in c.execute("SELECT path, missing FROM backup_catalog").fetchall()}
+    c.close()
+
+    added = 0
+    for path, p in on_disk.items():
+        if path in known and not known[path]:
+            continue
+        st = p.stat()
+        parts = p.stem.split("_", 3)  # cpf_YYYYmmdd_HHMMSS[_ffffff]_reason
+        reason = parts[3] if len(parts) == 4 and parts[0] == "cpf" else None
+        if reason and reason[:6].isdigit() and reason[6:7] == "_":
+            reason = reason[7:]
+        kind = "chunked" if p.suffix == ".json" else ("full" if reason else "external")
+        size = st.st_size
+        checksum = None
+        if kind == "chunked":
+            try:
+                import backups
+
+                m = backups.read_manifest(path)
+                size, checksum = m.get("size"), m.get("sha256")
+            except Exception:
+                pass
+        _catalog_add(
+            path,
+            kind=kind,
+            reason=reason,
+            size=size,
+            checksum=checksum,
+            created_at=datetime.utcfromtimestamp(st.st_mtime).replace(microsecond=0).isoformat() + "Z",
+        )
+        added += 1
+
+    gone = [path for path, missing in known.items() if not missing and path not in on_disk]
+    _catalog_mark_missing(gone)
+    return {"added": added, "missing": len(gone)}
+
+
+_BACKUPS_RECONCILED = False
+
+
+def list_backup_entries(limit: int = 50, offset: int = 0) -> List[Dict[str, Any]]:
+    """Catalog rows for existing backups, newest first (indexed, paginated)."""
+    global _BACKUPS_RECONCILED
+    if not _BACKUPS_RECONCILED:
+        # Once per process: pick up files copied/removed while we were down
+        _BACKUPS_RECONCILED = True
+        try:
+            reconcile_backups()
+        except Exception as e:
+            log("backup", "reconcile_failed", str(e), level="WARNING")
+    c = conn()
+    rows = c.execute(
+        """SELECT id, path, kind, reason, size, stored_size, checksum, duration_ms, integrity, created_at
+           FROM backup_catalog
+           WHERE missing=0
+           ORDER BY created_at DESC
+           LIMIT ? OFFSET ?""",
+        (max(1, int(limit)), max(0, int(offset))),
+    ).fetchall()
+    c.close()
+    return [dict(r) for r in rows]
+
+
+def list_backups(limit: int = 50, offset: int = 0) -> List[str]:
+    """Backup paths (full .db copies and chunked-backup manifests), newest first."""
+    return [e["path"] for e in list_backup_entries(limit, offset)]
+
+
+def backup_bytes(path: str) -> bytes:
+    """Contents of a backup as a plain .db file (reassembled for manifests)."""
+    if str(path).endswith(".json"):
+        import backups
+
+        return backups.materialize(path)
+    return Path(path).read_bytes()
 
 
 def get_last_backup_path() -> Optional[str]:
     return get_setting("last_backup_path")
 
 
-def restore_db_from_path(path: str) -> None:
-    """Replace current DB with a provided backup path (best-effort)."""
-    global _SCHEMA_READY
+class RestoreJob:
+    """Background restore: stage + verify + migrate off to the side, then swap."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done = threading.Event()
+        self.error: Optional[BaseException] = None
+        self.stage_ms: Optional[float] = None
+        self.swap_ms: Optional[float] = None
+        self.thread = threading.Thread(target=self._run, name="cpf-restore", daemon=True)
+
+    def _run(self) -> None:
+        try:
+            t0 = time.perf_counter()
+            staged = _stage_restore(self.path)
+            self.stage_ms = round((time.perf_counter() - t0) * 1000, 1)
+            t1 = time.perf_counter()
+            _swap_in(staged)
+            self.swap_ms = round((time.perf_counter() - t1) * 1000, 3)
+        except BaseException as e:  # surfaced to the caller via wait()
+            self.error = e
+        finally:
+            self.done.set()
+
+    def wait(self, timeout: Optional[float] = None) -> "RestoreJob":
+        if not self.done.wait(timeout):
+            raise TimeoutError("la restauración sigue en curso")
+        if self.error is not None:
+            raise self.error
+        return self
+
+
+_RESTORE_LOCK = threading.Lock()
+
+
+def _stage_restore(path: str) -> Path:
+    """Copy the backup next to DB_PATH, verify it and run migrations on the copy."""
     if not path:
         raise ValueError("path vacío")
     src = Path(path)
     if not src.exists():
         raise FileNotFoundError(str(src))
-    shutil.copy2(src, DB_PATH)
+    staged = DB_PATH.with_name(DB_PATH.name + ".staged")
+    staged.unlink(missing_ok=True)
+    if src.suffix == ".json":
+        import backups
+
+        backups.restore_to(str(src), str(staged))
+    else:
+        shutil.copy2(src, staged)
+    try:
+        s = sqlite3.connect(str(staged))
+        s.row_factory = sqlite3.Row
+        try:
+            res = [r[0] for r in s.execute("PRAGMA integrity_check").fetchall()]
+            if res != ["ok"]:
+                raise ValueError(f"el backup no pasó integrity_check: {'; '.join(res[:3])}")
+            # Same schema/migrations as the live DB, applied before it goes live
+            _apply_schema(s)
+            s.commit()
+            # No -wal/-shm sidecars travel with the swapped file
+            s.execute("PRAGMA journal_mode=DELETE")
+        finally:
+            s.close()
+    except sqlite3.DatabaseError as e:
+        staged.unlink(missing_ok=True)
+        raise ValueError(f"el archivo no es una base SQLite válida: {e}") from e
+    except Exception:
+        staged.unlink(missing_ok=True)
+        raise
+    return staged
+
+
+def _swap_in(staged: Path) -> None:
+    global _SCHEMA_READY
+    # Flush a live WAL (if any) so no stale frames get applied to the new file
+    wal = DB_PATH.with_name(DB_PATH.name + "-wal")
+    if wal.exists():
+        live = sqlite3.connect(str(DB_PATH))
+        try:
+            live.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        finally:
+            live.close()
+    os.replace(staged, DB_PATH)
+    _bump_generation()
     _SCHEMA_READY = False
+
+
+def start_restore(path: str, safety_backup: bool = True) -> RestoreJob:
+    """Start an atomic restore in the background and return its job.
+
+    The live DB keeps serving while the backup is staged beside it, checked with
+    PRAGMA integrity_check and migrated; the swap itself is a single os.replace.
+    Other workers notice the new generation and reopen on their next conn().
+    """
+    if not _RESTORE_LOCK.acquire(blocking=False):
+        raise RuntimeError("ya hay una restauración en curso")
+    if safety_backup:
+        try:
+            backup_db("pre_restore")
+        except Exception as e:
+            log("restore", "safety_backup_failed", str(e), level="WARNING")
+    job = RestoreJob(path)
+
+    def _after() -> None:
+        job.done.wait()
+        _RESTORE_LOCK.release()
+        if job.error is None:
+            log("restore", "ok", path, f"stage_ms={job.stage_ms}", f"swap_ms={job.swap_ms}")
+            try:
+                # The restored DB carries the catalog as of its own backup time
+                reconcile_backups()
+            except Exception:
+                pass
+        else:
+            log("restore", "failed", path, str(job.error), level="ERROR")
+
+    job.thread.start()
+    threading.Thread(target=_after, name="cpf-restore-finish", daemon=True).start()
+    return job
+
+
+def restore_db_from_path(path: str, timeout: Optional[float] = None) -> None:
+    """Replace current DB with a provided backup (.db copy or chunked manifest).
+
+    Blocks until the staged copy is verified and swapped in; raises if the
+    backup is invalid (the live DB is left untouched in that case).
+    """
+    start_restore(path).wait(timeout)
+    # Make the swap visible to this process right away
+    _check_generation()
     init_db()
 
 
 # -------------------- Super Admin (simple) --------------------
+@memo.cached
 def get_super_admin_email() -> Optional[str]:
     return get_setting("super_admin_email")
 
@@ -0,0 +1,170 @@
+"""Búsqueda tolerante a errores de tipeo con trigramas ("valvula", "válbula", "galvanisado").
+
+El índice es de vocabulario, no de documentos:
+- search_terms:       cada palabra distinta (normalizada con textnorm.norm_text) y su cantidad de trigramas
+- term_trigrams:      trigrama -> palabra
+- requirement_terms:  palabra -> requerimiento
+
+Para cada palabra de la consulta se buscan las palabras del vocabulario que
+comparten trigramas, se calcula la similitud (trigramas en común / unión, como
+pg_trgm) y se suman, por requerimiento, las mejores similitudes de cada palabra.
+El vocabulario crece mucho más lento que la cantidad de requerimientos, por eso
+la consulta se mantiene en decenas de ms con 100k+ publicaciones.
+
+services.create_requirement / update_requirement mantienen el índice en la
+misma transacción; `rebuild_index` lo rearma completo (se usa al crearlo).
+"""
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import storage
+from textnorm import STOPWORDS, words
+
+MIN_SIMILARITY = 0.3
+MAX_TERMS_PER_TOKEN = 30
+# Campos de un requerimiento que se indexan
+INDEXED_FIELDS = ("title", "description", "tags", "category", "company", "location")
+
+
+def trigrams(word: str) -> Set[str]:
+    """Trigramas de una palabra ya normalizada, con relleno de bordes como pg_trgm."""
+    w = f"  {word} "
+    return {w[i : i + 3] for i in range(len(w) - 2)}
+
+
+def similarity(a: str, b: str) -> float:
+    ta, tb = trigrams(a), trigrams(b)
+    return len(ta & tb) / len(ta | tb) if ta and tb else 0.0
+
+
+def terms_of(texts: Iterable[Optional[str]]) -> Set[str]:
+    """Palabras indexables (normalizadas, sin stopwords, 3+ letras) de varios textos."""
+    out: Set[str] = set()
+    for t in texts:
+        for w in words(t or ""):
+            if len(w) >= 3 and w not in STOPWORDS:
+                out.add(w)
+    return out
+
+
+# -------------------- Mantenimiento del índice --------------------
+def _term_ids(cur, terms: Sequence[str]) -> Dict[str, int]:
+    """ids de `terms`, creando las palabras (y sus trigramas) que todavía no existen."""
+    if not terms:
+        return {}
+    new_ids: List[Tuple[int, str]] = []
+    for t in terms:
+        row = cur.execute(
+            "INSERT INTO search_terms(term, ntrgm) VALUES(?,?) ON CONFLICT(term) DO NOTHING RETURNING id",
+            (t, len(trigrams(t))),
+        ).fetchone()
+        if row:
+            new_ids.append((int(row["id"]), t))
+    if new_ids:
+        cur.executemany(
+            "INSERT INTO term_trigrams(trigram, term_id) VALUES(?,?) ON CONFLICT DO NOTHING",
+            [(g, tid) for tid, t in new_ids for g in trigrams(t)],
+        )
+    ids: Dict[str, int] = {}
+    terms = list(terms)
+    for i in range(0, len(terms), 500):
+        chunk = terms[i : i + 500]
+        marks = ",".join("?" * len(chunk))
+        for r in cur.execute(f"SELECT id, term FROM search_terms WHERE term IN ({marks})", chunk).fetchall():
+            ids[r["term"]] = int(r["id"])
+    return ids
+
+
+def index_requirement(cur, requirement_id: int, row: Dict[str, Any]) -> None:
+    """(Re)indexa un requerimiento dentro de la transacción del llamador."""
+    cur.execute("DELETE FROM requirement_terms WHERE requirement_id=?", (int(requirement_id),))
+    ids = _term_ids(cur, sorted(terms_of(row.get(f) for f in INDEXED_FIELDS)))
+    if ids:
+        cur.executemany(
+            "INSERT INTO requirement_terms(term_id, requirement_id) VALUES(?,?) ON CONFLICT DO NOTHING",
+            [(tid, int(requirement_id)) for tid in ids.values()],
+        )
+
+
+def rebuild_index(c) -> int:
+    """Rearma el índice completo desde `requirements`. Devuelve cuántos requerimientos indexó."""
+    cur = c.cursor()
+    cur.execute("DELETE FROM requirement_terms")
+    cur.execute("DELETE FROM term_trigrams")
+    cur.execute("DELETE FROM search_terms")
+    # Sólo los términos de cada requerimiento quedan en memoria, no las filas
+    per_req = [
+        (int(r["id"]), terms_of(r[f] for f in INDEXED_FIELDS))
+        for r in storage.stream(f"SELECT id, {', '.join(INDEXED_FIELDS)} FROM requirements", c=c)
+    ]
+    vocab = sorted(set().union(*(t for _, t in per_req))) if per_req else []
+    storage.bulk_insert("search_terms", ("term", "ntrgm"), ((t, len(trigrams(t))) for t in vocab), c=c)
+    ids = {r["term"]: int(r["id"]) for r in storage.stream("SELECT id, term FROM search_terms", c=c)}
+    storage.bulk_insert(
+        "term_trigrams", ("trigram", "term_id"), ((g, ids[t]) for t in vocab for g in trigrams(t)), c=c
+    )
+    storage.bulk_insert(
+        "requirement_terms", ("term_id", "requirement_id"), ((ids[t], rid) for rid, ts in per_req for t in ts), c=c
+    )
+    return len(per_req)
+
+
+# -------------------- Consulta --------------------
+def _similar_terms(c, token: str) -> List[Tuple[int, float]]:
+    """(term_id, similitud) del vocabulario para una palabra de la consulta."""
+    grams = sorted(trigrams(token))
+    marks = ",".join("?" * len(grams))
+    nq = len(grams)
+    # sim = comunes / (nq + nt - comunes) >= MIN  =>  comunes >= MIN * (nq + nt) / (1 + MIN)
+    rows = c.execute(
+        f"""SELECT tt.term_id, COUNT(*) AS shared, st.ntrgm
+            FROM term_trigrams tt
+            JOIN search_terms st ON st.id = tt.term_id
+            WHERE tt.trigram IN ({marks})
+            GROUP BY tt.term_id, st.ntrgm
+            HAVING COUNT(*) * (1 + ?) >= ? * (? + st.ntrgm)""",
+        grams + [MIN_SIMILARITY, MIN_SIMILARITY, nq],
+    ).fetchall()
+    scored = [(int(r["term_id"]), r["shared"] / (nq + r["ntrgm"] - r["shared"])) for r in rows]
+    scored.sort(key=lambda x: -x[1])
+    return scored[:MAX_TERMS_PER_TOKEN]
+
+
+def search(
+    c,
+    q: str,
+    filters_sql: str = "",
+    filters_params: Sequence[Any] = (),
+    limit: int = 20,
+) -> List[Tuple[int, float]]:
+    """[(requirement_id, score)] ordenados por relevancia.
+
+    `filters_sql` es un fragmento " AND ..." sobre el alias `r` de requirements.
+    """
+    tokens = sorted(terms_of([q]))
+    if not tokens:
+        return []
+    best: Dict[int, Dict[str, float]] = {}
+    for tok in tokens:
+        terms = _similar_terms(c, tok)
+        if not terms:
+            continue
+        sims = dict(terms)
+        marks = ",".join("?" * len(sims))
+        # CROSS JOIN fija el orden en SQLite: primero las postings de las palabras,
+        # después el requerimiento por PK (si no, puede recorrer todos los abiertos).
+        rows = c.execute(
+            f"""SELECT rt.requirement_id, rt.term_id
+                FROM requirement_terms rt
+                CROSS JOIN requirements r
+                WHERE r.id = rt.requirement_id AND rt.term_id IN ({marks}){filters_sql}""",
+            list(sims) + list(filters_params),
+        ).fetchall()
+        for r in rows:
+            per = best.setdefault(int(r["requirement_id"]), {})
+            s = sims[int(r["term_id"])]
+            if s > per.get(tok, 0.0):
+                per[tok] = s
+    # Score: suma de la mejor similitud por palabra de la consulta (premia cubrir todas)
+    scored = [(rid, round(sum(per.values()), 4)) for rid, per in best.items()]
+    scored.sort(key=lambda x: (-x[1], -x[0]))
+    return scored[:limit]
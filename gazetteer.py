@@ -0,0 +1,198 @@
+"""Nomenclador geográfico offline (Argentina) para normalizar ubicaciones de texto libre.
+
+`requirements.location` y `chambers.city/province` son texto libre ("Rosario, Sta Fe",
+"Bs. As.", "Córdoba capital"). Al escribir se resuelven contra esta tabla a dos
+códigos que se guardan en columnas indexadas:
+- province_code: ISO 3166-2:AR ("AR-S")
+- city_code:     provincia + ciudad ("AR-S:rosario")
+
+Con eso la búsqueda y el matching filtran por región en SQL (`r.province_code=?`
+o `r.city_code=?`) antes de puntuar nada.
+
+La resolución es por frases sobre el texto normalizado (textnorm.words): se toma
+la última provincia mencionada ("Ciudad, Provincia") y la ciudad de esa provincia;
+sin provincia, la ciudad sólo se acepta si su nombre no es ambiguo.
+"""
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import storage
+from textnorm import words
+
+# (código, nombre, alias de la provincia, ciudades). Alias y ciudades separados por "|";
+# una ciudad puede traer alias propios con "=" ("San Carlos de Bariloche=Bariloche").
+_DATA: Sequence[Tuple[str, str, str, str]] = (
+    ("AR-C", "Ciudad Autónoma de Buenos Aires",
+     "CABA|Capital Federal|Ciudad de Buenos Aires|Ciudad Autonoma de Buenos Aires|C.A.B.A.", ""),
+    ("AR-B", "Buenos Aires",
+     "Provincia de Buenos Aires|Pcia de Buenos Aires|PBA|Bs As|BsAs|Pcia Bs As",
+     "La Plata|Mar del Plata|Bahía Blanca|Tandil|Quilmes|Lanús|Avellaneda|Lomas de Zamora|La Matanza|"
+     "San Justo|Morón|Tigre|San Isidro|Vicente López|Pilar|Merlo|Moreno|San Nicolás de los Arroyos=San Nicolás|"
+     "Zárate|Campana|Junín|Pergamino|Olavarría|Azul|Necochea|Luján|Berazategui|Florencio Varela|"
+     "Almirante Brown|Escobar|Tres Arroyos|Chivilcoy|General San Martín=San Martín|Mercedes|Ensenada|"
+     "Berisso|Bragado|Maipú|San Pedro|Rivadavia"),
+    ("AR-K", "Catamarca", "",
+     "San Fernando del Valle de Catamarca|Belén|Andalgalá|Tinogasta"),
+    ("AR-H", "Chaco", "",
+     "Resistencia|Presidencia Roque Sáenz Peña=Sáenz Peña|Villa Ángela|Barranqueras|Charata"),
+    ("AR-U", "Chubut", "",
+     "Rawson|Comodoro Rivadavia|Trelew|Puerto Madryn|Esquel"),
+    ("AR-X", "Córdoba", "Cba",
+     "Córdoba|Río Cuarto|Villa María|San Francisco|Villa Carlos Paz=Carlos Paz|Alta Gracia|Bell Ville|"
+     "Río Tercero|Jesús María|Marcos Juárez"),
+    ("AR-W", "Corrientes", "",
+     "Corrientes|Goya|Paso de los Libres|Curuzú Cuatiá|Mercedes|Santo Tomé"),
+    ("AR-E", "Entre Ríos", "",
+     "Paraná|Concordia|Gualeguaychú|Concepción del Uruguay|Villaguay|Victoria|Gualeguay|Colón|Chajarí"),
+    ("AR-P", "Formosa", "", "Formosa|Clorinda"),
+    ("AR-Y", "Jujuy", "",
+     "San Salvador de Jujuy|Palpalá|San Pedro|Libertador General San Martín|Humahuaca"),
+    ("AR-L", "La Pampa", "", "Santa Rosa|General Pico|Toay"),
+    ("AR-F", "La Rioja", "", "La Rioja|Chilecito"),
+    ("AR-M", "Mendoza", "Mza",
+     "Mendoza|San Rafael|Godoy Cruz|Guaymallén|Las Heras|Luján de Cuyo|Maipú|Tunuyán|San Martín|Rivadavia"),
+    ("AR-N", "Misiones", "", "Posadas|Oberá|Eldorado|Puerto Iguazú=Iguazú|Apóstoles"),
+    ("AR-Q", "Neuquén", "Nqn",
+     "Neuquén|Cutral Có|Plottier|Zapala|San Martín de los Andes|Centenario"),
+    ("AR-R", "Río Negro", "",
+     "Viedma|San Carlos de Bariloche=Bariloche|General Roca|Cipolletti|Villa Regina|Allen"),
+    ("AR-A", "Salta", "",
+     "Salta|San Ramón de la Nueva Orán=Orán|Tartagal|General Güemes|Metán"),
+    ("AR-J", "San Juan", "",
+     "San Juan|Rawson|Chimbas|Rivadavia|Caucete"),
+    ("AR-D", "San Luis", "", "San Luis|Villa Mercedes|Merlo"),
+    ("AR-Z", "Santa Cruz", "",
+     "Río Gallegos|Caleta Olivia|El Calafate|Pico Truncado|Puerto Deseado"),
+    ("AR-S", "Santa Fe", "Sta Fe|Sta. Fe",
+     "Santa Fe|Rosario|Rafaela|Venado Tuerto|Reconquista|Villa Gobernador Gálvez|San Lorenzo|Esperanza|"
+     "Casilda|Firmat|Cañada de Gómez|Villa Constitución"),
+    ("AR-G", "Santiago del Estero", "Sgo del Estero|Santiago",
+     "Santiago del Estero|La Banda|Termas de Río Hondo|Frías|Añatuya"),
+    ("AR-V", "Tierra del Fuego", "TDF|Tierra del Fuego Antártida e Islas del Atlántico Sur",
+     "Ushuaia|Río Grande|Tolhuin"),
+    ("AR-T", "Tucumán", "Tucuman",
+     "San Miguel de Tucumán|Yerba Buena|Tafí Viejo|Concepción|Banda del Río Salí|Aguilares|Monteros"),
+)
+
+# CABA es a la vez provincia y ciudad
+CABA_CITY = "AR-C:caba"
+
+PROVINCES: Dict[str, str] = {code: name for code, name, _, _ in _DATA}
+CITIES: Dict[str, str] = {CABA_CITY: "CABA"}
+
+# frase normalizada (tupla de palabras) -> [("province"|"city", código)]
+_PHRASES: Dict[Tuple[str, ...], List[Tuple[str, str]]] = {}
+
+
+def _add(phrase: str, kind: str, code: str) -> None:
+    key = tuple(words(phrase))
+    if key and (kind, code) not in _PHRASES.setdefault(key, []):
+        _PHRASES[key].append((kind, code))
+
+
+def city_code(province_code: str, city: str) -> str:
+    return f"{province_code}:{'-'.join(words(city))}"
+
+
+for _code, _name, _aliases, _cities in _DATA:
+    for _p in [_name] + [a for a in _aliases.split("|") if a]:
+        _add(_p, "province", _code)
+    for _entry in (e for e in _cities.split("|") if e):
+        _city, *_city_aliases = _entry.split("=")
+        _cc = city_code(_code, _city)
+        CITIES[_cc] = _city
+        for _p in [_city] + _city_aliases:
+            _add(_p, "city", _cc)
+
+_MAX_PHRASE = max(len(k) for k in _PHRASES)
+
+
+def _matches(text: str) -> List[List[Tuple[str, str]]]:
+    """Frases del nomenclador en `text`, de izquierda a derecha (la más larga en cada posición)."""
+    toks = words(text)
+    out: List[List[Tuple[str, str]]] = []
+    i = 0
+    while i < len(toks):
+        for n in range(min(_MAX_PHRASE, len(toks) - i), 0, -1):
+            hit = _PHRASES.get(tuple(toks[i : i + n]))
+            if hit:
+                out.append(hit)
+                i += n
+                break
+        else:
+            i += 1
+    return out
+
+
+def resolve(*texts: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """(province_code, city_code) de uno o más textos libres; (None, None) si no se reconoce."""
+    found = _matches(" , ".join(t for t in texts if t))
+    if not found:
+        return None, None
+    province = None
+    prov_at = -1
+    for i, hit in enumerate(found):
+        for kind, code in hit:
+            if kind == "province":
+                province, prov_at = code, i
+    if province == "AR-C":
+        return province, CABA_CITY
+    # Ciudades: fuera del tramo que nombró la provincia ("Córdoba" solo = provincia)
+    cities = {code for i, hit in enumerate(found) if i != prov_at for kind, code in hit if kind == "city"}
+    if province:
+        local = sorted(cc for cc in cities if cc.startswith(province + ":"))
+        return province, (local[0] if local else None)
+    if len({cc.split(":")[0] for cc in cities}) == 1:
+        city = sorted(cities)[0]
+        return city.split(":")[0], city
+    return None, None
+
+
+def region_label(code: Optional[str]) -> str:
+    """Nombre legible de un código de provincia o ciudad."""
+    if not code:
+        return "(Sin ubicación)"
+    if ":" in code:
+        prov = code.split(":")[0]
+        city = CITIES.get(code, code.split(":", 1)[1])
+        return city if prov == "AR-C" else f"{city} ({PROVINCES.get(prov, prov)})"
+    return PROVINCES.get(code, code)
+
+
+def is_city(region: str) -> bool:
+    return ":" in region
+
+
+# -------------------- Backfill --------------------
+# Filas por executemany mientras se recorre requirements con storage.stream
+_BACKFILL_BATCH = 1000
+
+
+def backfill(c) -> int:
+    """Completa province_code/city_code de cámaras y requerimientos existentes.
+
+    Un requerimiento sin ubicación reconocible toma la de su cámara.
+    Devuelve cuántos requerimientos quedaron con región.
+    """
+    cur = c.cursor()
+    chambers = {}
+    for r in cur.execute("SELECT id, city, province FROM chambers").fetchall():
+        codes = resolve(r["city"], r["province"])
+        chambers[int(r["id"])] = codes
+        cur.execute("UPDATE chambers SET province_code=?, city_code=? WHERE id=?", (*codes, int(r["id"])))
+    done = 0
+    updates: List[Tuple] = []
+    for r in storage.stream("SELECT id, location, chamber_id FROM requirements", c=c):
+        codes = resolve(r["location"])
+        if codes == (None, None) and r["chamber_id"] is not None:
+            codes = chambers.get(int(r["chamber_id"]), (None, None))
+        if codes != (None, None):
+            updates.append((*codes, int(r["id"])))
+        if len(updates) >= _BACKFILL_BATCH:
+            cur.executemany("UPDATE requirements SET province_code=?, city_code=? WHERE id=?", updates)
+            done += len(updates)
+            updates = []
+    cur.executemany("UPDATE requirements SET province_code=?, city_code=? WHERE id=?", updates)
+    from db import bump_data_version
+
+    bump_data_version(cur)  # las regiones salen en el listado: invalida los ETag
+    return done + len(updates)
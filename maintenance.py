@@ -0,0 +1,563 @@
+"""Mantenimiento programado de la base, dentro del proceso de la app.
+
+Cada worker de Streamlit arranca un Scheduler (hilo de fondo), pero sólo uno
+trabaja: el que tiene el lease en `scheduler_lease` (una fila que se toma o
+renueva con un upsert condicional; si el líder muere, el lease vence y otro lo
+toma). El líder corre las tareas vencidas de JOBS:
+
+- optimize:   PRAGMA optimize (estadísticas sólo donde hacen falta)
+- analyze:    ANALYZE tabla por tabla (en PostgreSQL, ANALYZE)
+- vacuum:     incremental_vacuum si hay páginas libres (sólo con auto_vacuum=INCREMENTAL)
+- vacuum_full: VACUUM completo que deja la base en auto_vacuum=INCREMENTAL;
+              bloquea la base mientras dura, así que nunca se programa: la
+              dispara un admin desde el Panel, confirmándolo explícitamente
+- logs:       db.compact_logs (retención y archivo mensual)
+- outbox:     notify.purge_outbox (vence pendientes viejas, borra entregadas/muertas)
+- vectors:    vectors.reweight (pesos tf-idf de los vectores con el df actual)
+- backup:     db.backup_db(reason="scheduled")
+- rematch:    rematch.run_full_rematch (apagado por defecto)
+
+Cada corrida tiene un presupuesto de tiempo: las sentencias SQLite se cortan
+con un progress handler al vencer (status "timeout", SQLite deshace lo que no
+terminó) y las tareas en Python lo revisan entre lotes o lo informan como
+"overrun". El historial queda en `job_runs`.
+
+Mientras corre una tarea, un heartbeat renueva el lease cada LEASE_SECONDS/3,
+así otro proceso no lo toma aunque la tarea dure más que el lease; antes de
+cada tarea se vuelve a confirmar el lease. "Ejecutar ahora" (Panel) no corre
+la tarea en el proceso que atiende el click: la encola en `job_runs` (status
+"requested") y la corre el líder en su próxima vuelta.
+
+Configuración (segundos; intervalo 0 = tarea apagada):
+- CPF_MAINT=0 desactiva el scheduler
+- CPF_MAINT_SCHEDULE="backup=43200,rematch=86400"  (intervalos)
+- CPF_MAINT_BUDGET="vacuum=600"                      (presupuestos)
+- CPF_MAINT_POLL (default 30), CPF_MAINT_VACUUM_FREE_RATIO (default 0.1)
+"""
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import storage
+from db import log, now_iso
+
+ENABLED = os.environ.get("CPF_MAINT", "1") != "0"
+POLL_SECONDS = float(os.environ.get("CPF_MAINT_POLL", "30"))
+LEASE_SECONDS = 3 * POLL_SECONDS
+LEASE_NAME = "maintenance"
+# Fracción de páginas libres a partir de la cual vale la pena devolver espacio
+VACUUM_FREE_RATIO = float(os.environ.get("CPF_MAINT_VACUUM_FREE_RATIO", "0.1"))
+VACUUM_STEP_PAGES = 2000
+HISTORY_PER_JOB = 200
+
+# Identidad de este proceso como candidato a líder
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def _iso(dt: datetime) -> str:
+    return dt.replace(microsecond=0).isoformat() + "Z"
+
+
+def _parse_seconds(spec: str) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for part in (spec or "").split(","):
+        if "=" in part:
+            k, v = part.split("=", 1)
+            try:
+                out[k.strip().lower()] = float(v)
+            except ValueError:
+                pass
+    return out
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+@contextmanager
+def _sqlite_budget(deadline: float) -> Iterator[sqlite3.Connection]:
+    """Conexión SQLite que interrumpe cualquier sentencia pasada la hora límite."""
+    from db import conn
+
+    c = conn()
+    c.set_progress_handler(lambda: 1 if time.monotonic() > deadline else 0, 10000)
+    try:
+        yield c
+    except sqlite3.OperationalError as e:
+        if "interrupted" in str(e):
+            raise BudgetExceeded(str(e)) from e
+        raise
+    finally:
+        c.set_progress_handler(None, 0)
+        c.close()
+
+
+# -------------------- Tareas --------------------
+def _optimize(deadline: float) -> Dict[str, Any]:
+    with _sqlite_budget(deadline) as c:
+        # analysis_limit acota el costo de los ANALYZE que dispare optimize
+        c.execute("PRAGMA analysis_limit=1000")
+        c.execute("PRAGMA optimize")
+    return {}
+
+
+def _analyze(deadline: float) -> Dict[str, Any]:
+    if not storage.is_sqlite():
+        c = storage.connect()
+        try:
+            c.execute("ANALYZE")
+            c.commit()
+        finally:
+            c.close()
+        return {}
+    done: List[str] = []
+    with _sqlite_budget(deadline) as c:
+        tables = [
+            r["name"]
+            for r in c.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+            ).fetchall()
+        ]
+        for t in tables:
+            if time.monotonic() > deadline:
+                raise BudgetExceeded(f"{len(done)}/{len(tables)} tablas")
+            c.execute(f'ANALYZE "{t}"')
+            c.commit()
+            done.append(t)
+    return {"tables": len(done)}
+
+
+def _vacuum(deadline: float) -> Dict[str, Any]:
+    with _sqlite_budget(deadline) as c:
+        pages = c.execute("PRAGMA page_count").fetchone()[0]
+        free = c.execute("PRAGMA freelist_count").fetchone()[0]
+        out: Dict[str, Any] = {"pages": pages, "free_before": free}
+        if not pages or free / pages < VACUUM_FREE_RATIO:
+            return out
+        if c.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            # Sin auto_vacuum=INCREMENTAL sólo lo recupera un VACUUM completo (vacuum_full, manual)
+            out["mode"] = "skipped"
+            out["hint"] = "ejecutar vacuum_full desde el Panel"
+            return out
+        while free and time.monotonic() < deadline:
+            c.execute(f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})").fetchall()
+            free = c.execute("PRAGMA freelist_count").fetchone()[0]
+        out["mode"] = "incremental"
+        out["free_after"] = c.execute("PRAGMA freelist_count").fetchone()[0]
+    return out
+
+
+def _vacuum_full(deadline: float) -> Dict[str, Any]:
+    with _sqlite_budget(deadline) as c:
+        out: Dict[str, Any] = {
+            "pages_before": c.execute("PRAGMA page_count").fetchone()[0],
+            "auto_vacuum_before": c.execute("PRAGMA auto_vacuum").fetchone()[0],
+        }
+        # El VACUUM completo aplica el nuevo auto_vacuum; de ahí en más alcanza con "vacuum"
+        c.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        c.execute("VACUUM")
+        out["pages_after"] = c.execute("PRAGMA page_count").fetchone()[0]
+    return out
+
+
+def _logs(deadline: float) -> Dict[str, Any]:
+    from db import compact_logs
+
+    return compact_logs(deadline=deadline)
+
+
+def _outbox(deadline: float) -> Dict[str, Any]:
+    import notify
+
+    return notify.purge_outbox(deadline=deadline)
+
+
+def _vectors(deadline: float) -> Dict[str, Any]:
+    import vectors
+
+    c = storage.connect()
+    try:
+        return vectors.reweight(c, deadline=deadline)
+    finally:
+        c.close()
+
+
+def _backup(deadline: float) -> Dict[str, Any]:
+    from db import backup_db
+
+    return {"path": backup_db(reason="scheduled")}
+
+
+def _rematch(deadline: float) -> Dict[str, Any]:
+    import rematch
+
+    try:
+        return rematch.run_full_rematch(deadline=deadline)
+    except TimeoutError as e:
+        raise BudgetExceeded(str(e)) from e
+
+
+class Job:
+    def __init__(self, name: str, label: str, fn: Callable[[float], Dict[str, Any]],
+                 every: float, budget: float, sqlite_only: bool = True, confirm: bool = False):
+        self.name = name
+        self.label = label
+        self.fn = fn
+        self.every = every
+        self.budget = budget
+        self.sqlite_only = sqlite_only
+        self.confirm = confirm  # corrida manual sólo con confirmación explícita
+
+    @property
+    def available(self) -> bool:
+        """Aplica al backend actual (las tareas sqlite_only no corren en PostgreSQL)."""
+        return storage.is_sqlite() or not self.sqlite_only
+
+    @property
+    def enabled(self) -> bool:
+        return self.every > 0 and self.available
+
+
+_SCHEDULE = _parse_seconds(os.environ.get("CPF_MAINT_SCHEDULE", ""))
+_BUDGET = _parse_seconds(os.environ.get("CPF_MAINT_BUDGET", ""))
+
+# Tareas que bloquean la base: request_run exige confirmed=True
+CONFIRM_JOBS = ("vacuum_full",)
+
+# (nombre, descripción, función, intervalo, presupuesto, sólo SQLite). En orden de ejecución.
+JOBS: Dict[str, Job] = {
+    name: Job(name, label, fn, _SCHEDULE.get(name, every), _BUDGET.get(name, budget), sqlite_only,
+              confirm=name in CONFIRM_JOBS)
+    for name, label, fn, every, budget, sqlite_only in (
+        ("optimize", "PRAGMA optimize", _optimize, 3600, 30, True),
+        ("logs", "Retención de logs", _logs, 3600, 120, False),
+        ("outbox", "Retención de notificaciones", _outbox, 86400, 120, False),
+        ("analyze", "ANALYZE", _analyze, 86400, 300, False),
+        ("vacuum", "Vacuum incremental", _vacuum, 86400, 600, True),
+        ("vacuum_full", "VACUUM completo (bloquea la base)", _vacuum_full, 0, 3600, True),
+        ("vectors", "Pesos IDF de los vectores", _vectors, 86400, 900, False),
+        ("backup", "Backup programado", _backup, 86400, 900, True),
+        ("rematch", "Recalcular contrapartes", _rematch, 0, 1800, False),
+    )
+}
+
+
+# -------------------- Historial --------------------
+def _start_run(job: str, owner: str) -> int:
+    c = storage.connect()
+    row = c.execute(
+        "INSERT INTO job_runs(job, owner, started_at, status) VALUES(?,?,?,'running') RETURNING id",
+        (job, owner, now_iso()),
+    ).fetchone()
+    c.commit()
+    c.close()
+    return int(row["id"])
+
+
+def _finish_run(run_id: int, job: str, status: str, duration_ms: float, detail: Dict[str, Any]) -> None:
+    c = storage.connect()
+    c.execute(
+        "UPDATE job_runs SET finished_at=?, duration_ms=?, status=?, detail=? WHERE id=?",
+        (now_iso(), round(duration_ms, 1), status, json.dumps(detail, default=str), int(run_id)),
+    )
+    c.execute(
+        """DELETE FROM job_runs WHERE job=? AND id NOT IN (
+               SELECT id FROM job_runs WHERE job=? ORDER BY id DESC LIMIT ?
+           )""",
+        (job, job, HISTORY_PER_JOB),
+    )
+    c.commit()
+    c.close()
+
+
+def _claim_request(run_id: int) -> bool:
+    """Pasa una corrida pedida desde el Panel a 'running' (una sola vez)."""
+    c = storage.connect()
+    n = c.execute(
+        "UPDATE job_runs SET status='running', started_at=? WHERE id=? AND status='requested'",
+        (now_iso(), int(run_id)),
+    ).rowcount
+    c.commit()
+    c.close()
+    return n == 1
+
+
+def _requested() -> List[Dict[str, Any]]:
+    return storage.fetch("SELECT id, job, owner FROM job_runs WHERE status='requested' ORDER BY id")
+
+
+def run_job(name: str, owner: str = OWNER, run_id: Optional[int] = None) -> Dict[str, Any]:
+    """Corre una tarea ahora con su presupuesto y la registra. Devuelve la corrida.
+
+    Sólo la llama el líder (run_due): renueva el lease mientras la tarea corre.
+    """
+    job = JOBS[name]
+    if run_id is None:
+        run_id = _start_run(name, owner)
+    t0 = time.monotonic()
+    deadline = t0 + job.budget
+    status, detail = "ok", {}
+    with _heartbeat() as lost:
+        try:
+            detail = job.fn(deadline) or {}
+            if time.monotonic() > deadline:
+                status = "overrun"
+        except BudgetExceeded as e:
+            status, detail = "timeout", {"error": str(e)}
+        except Exception as e:
+            status, detail = "error", {"error": f"{type(e).__name__}: {e}"}
+            log("maintenance", name, "failed", str(e), level="ERROR")
+    if lost.is_set():
+        detail["lease_lost"] = True
+        log("maintenance", name, "lease_lost", level="WARNING")
+    ms = (time.monotonic() - t0) * 1000
+    _finish_run(run_id, name, status, ms, detail)
+    if status in ("timeout", "overrun"):
+        log("maintenance", name, status, f"budget={job.budget}s", f"ms={ms:.0f}", level="WARNING")
+    return {"id": run_id, "job": name, "status": status, "duration_ms": round(ms, 1), "detail": detail}
+
+
+def _last_runs() -> Dict[str, Dict[str, Any]]:
+    rows = storage.fetch(
+        """SELECT j.job, j.owner, j.started_at, j.finished_at, j.duration_ms, j.status, j.detail
+           FROM job_runs j
+           JOIN (SELECT job, MAX(id) AS id FROM job_runs WHERE status<>'requested' GROUP BY job) m
+             ON m.id = j.id"""
+    )
+    return {r["job"]: r for r in rows}
+
+
+def _next_run(job: Job, last: Optional[Dict[str, Any]]) -> Optional[str]:
+    if not job.enabled:
+        return None
+    if not last:
+        return now_iso()
+    started = datetime.strptime(last["started_at"], "%Y-%m-%dT%H:%M:%SZ")
+    return _iso(started + timedelta(seconds=job.every))
+
+
+def status() -> List[Dict[str, Any]]:
+    """Una fila por tarea: configuración, última corrida y próxima (para el Panel)."""
+    last = _last_runs()
+    out = []
+    for job in JOBS.values():
+        r = last.get(job.name) or {}
+        out.append({
+            "job": job.name,
+            "label": job.label,
+            "every_s": job.every,
+            "budget_s": job.budget,
+            "enabled": job.enabled,
+            "available": job.available,
+            "last_started_at": r.get("started_at"),
+            "last_status": r.get("status"),
+            "last_duration_ms": r.get("duration_ms"),
+            "last_detail": r.get("detail"),
+            "next_run_at": _next_run(job, r or None),
+        })
+    return out
+
+
+def history(job: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+    sql = "SELECT id, job, owner, started_at, finished_at, duration_ms, status, detail FROM job_runs"
+    params: List[Any] = []
+    if job:
+        sql += " WHERE job=?"
+        params.append(job)
+    sql += " ORDER BY id DESC LIMIT ?"
+    params.append(int(limit))
+    return storage.fetch(sql, params)
+
+
+# -------------------- Líder --------------------
+def _acquire_lease(hold_seconds: float = LEASE_SECONDS) -> bool:
+    """Toma o renueva el lease si está libre, vencido o ya es nuestro."""
+    now = datetime.utcnow()
+    c = storage.connect()
+    row = c.execute(
+        """INSERT INTO scheduler_lease(name, owner, acquired_at, expires_at) VALUES(?,?,?,?)
+           ON CONFLICT(name) DO UPDATE SET
+               owner = excluded.owner,
+               expires_at = excluded.expires_at,
+               acquired_at = CASE WHEN scheduler_lease.owner = excluded.owner
+                                  THEN scheduler_lease.acquired_at ELSE excluded.acquired_at END
+           WHERE scheduler_lease.owner = excluded.owner OR scheduler_lease.expires_at < ?
+           RETURNING owner""",
+        (LEASE_NAME, OWNER, _iso(now), _iso(now + timedelta(seconds=hold_seconds)), _iso(now)),
+    ).fetchone()
+    c.commit()
+    c.close()
+    return row is not None
+
+
+@contextmanager
+def _heartbeat() -> Iterator[threading.Event]:
+    """Renueva el lease en un hilo mientras dura el bloque; el evento se activa si se perdió."""
+    lost = threading.Event()
+    done = threading.Event()
+
+    def beat() -> None:
+        while not done.wait(LEASE_SECONDS / 3):
+            try:
+                if not _acquire_lease():
+                    lost.set()
+            except Exception as e:  # base ocupada: se reintenta en el próximo latido
+                log("maintenance", "heartbeat_error", str(e), level="WARNING")
+
+    t = threading.Thread(target=beat, name="cpf-maintenance-lease", daemon=True)
+    t.start()
+    try:
+        yield lost
+    finally:
+        done.set()
+        t.join()
+
+
+def _release_lease() -> None:
+    c = storage.connect()
+    c.execute("DELETE FROM scheduler_lease WHERE name=? AND owner=?", (LEASE_NAME, OWNER))
+    c.commit()
+    c.close()
+
+
+def leader() -> Optional[Dict[str, Any]]:
+    rows = storage.fetch(
+        "SELECT owner, acquired_at, expires_at FROM scheduler_lease WHERE name=?", (LEASE_NAME,)
+    )
+    if not rows:
+        return None
+    return dict(rows[0], is_me=rows[0]["owner"] == OWNER, expired=rows[0]["expires_at"] < now_iso())
+
+
+def run_due(stop_evt: Optional[threading.Event] = None, scheduled: bool = True) -> int:
+    """Corre (como líder) las corridas pedidas y, si `scheduled`, las tareas vencidas.
+
+    Devuelve cuántas corrió. Antes de cada tarea se confirma el lease: si otro
+    proceso lo tomó, se deja de correr.
+    """
+    ran = 0
+    for r in _requested():
+        if (stop_evt is not None and stop_evt.is_set()) or not _acquire_lease():
+            return ran
+        if r["job"] not in JOBS:
+            _finish_run(r["id"], r["job"], "error", 0, {"error": "tarea desconocida"})
+        elif not JOBS[r["job"]].available:
+            # Encolada con otro backend (o a mano): no correr PRAGMAs SQLite en PostgreSQL
+            _finish_run(r["id"], r["job"], "error", 0, {"error": f"no disponible en {storage.get_backend().name}"})
+        elif _claim_request(r["id"]):
+            run_job(r["job"], owner=r["owner"], run_id=r["id"])
+            ran += 1
+    if not scheduled:
+        return ran
+    last = _last_runs()
+    for job in JOBS.values():
+        if stop_evt is not None and stop_evt.is_set():
+            break
+        nxt = _next_run(job, last.get(job.name))
+        if nxt is None or nxt > now_iso():
+            continue
+        if not _acquire_lease():
+            break
+        run_job(job.name)
+        ran += 1
+    return ran
+
+
+def request_run(name: str, requested_by: str, confirmed: bool = False) -> Dict[str, Any]:
+    """Pide una corrida manual (Panel). Devuelve {"id", "queued"} o, sin scheduler, la corrida.
+
+    Con el scheduler activo la corre el líder en su próxima vuelta (este
+    proceso lo despierta si es el líder). Con CPF_MAINT=0 se corre acá, pero
+    igual sólo si este proceso consigue el lease. ValueError si la tarea no
+    existe, no aplica al backend actual o pide confirmación y no la tiene.
+    """
+    if name not in JOBS:
+        raise ValueError(f"tarea desconocida: {name}")
+    job = JOBS[name]
+    if not job.available:
+        raise ValueError(f"{job.label}: no disponible en {storage.get_backend().name}")
+    if job.confirm and not confirmed:
+        raise ValueError(f"{job.label}: requiere confirmación explícita")
+    c = storage.connect()
+    row = c.execute(
+        "INSERT INTO job_runs(job, owner, started_at, status) VALUES(?,?,?,'requested') RETURNING id",
+        (name, requested_by, now_iso()),
+    ).fetchone()
+    c.commit()
+    c.close()
+    run_id = int(row["id"])
+    if ENABLED:
+        if _scheduler is not None:
+            _scheduler.wake()
+        return {"id": run_id, "queued": True}
+    if not _acquire_lease():
+        return {"id": run_id, "queued": True}
+    try:
+        run_due(scheduled=False)
+    finally:
+        _release_lease()
+    runs = storage.fetch("SELECT id, job, status, duration_ms, detail FROM job_runs WHERE id=?", (run_id,))
+    return dict(runs[0], queued=False) if runs else {"id": run_id, "queued": True}
+
+
+# -------------------- Scheduler (hilo de fondo) --------------------
+class Scheduler(threading.Thread):
+    def __init__(self, poll_seconds: float = POLL_SECONDS):
+        super().__init__(name="cpf-maintenance", daemon=True)
+        self.poll_seconds = poll_seconds
+        self._stop_evt = threading.Event()
+        self._wake_evt = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_evt.is_set():
+            self._wake_evt.clear()
+            try:
+                if _acquire_lease():
+                    run_due(self._stop_evt)
+            except Exception as e:
+                log("maintenance", "scheduler_error", str(e), level="ERROR")
+            self._wake_evt.wait(self.poll_seconds)
+
+    def wake(self) -> None:
+        """Adelanta la próxima vuelta (p. ej. una corrida pedida desde el Panel)."""
+        self._wake_evt.set()
+
+    def stop(self) -> None:
+        self._stop_evt.set()
+        self._wake_evt.set()
+
+
+_scheduler: Optional[Scheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def ensure_scheduler() -> Optional[Scheduler]:
+    """Arranca (una vez por proceso) el scheduler de mantenimiento, salvo CPF_MAINT=0."""
+    global _scheduler
+    if not ENABLED:
+        return None
+    with _scheduler_lock:
+        if _scheduler is None or not _scheduler.is_alive():
+            _scheduler = Scheduler()
+            _scheduler.start()
+        return _scheduler
+
+
+def stop_scheduler() -> None:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is not None:
+            _scheduler.stop()
+            _scheduler.join(timeout=5)
+            _scheduler = None
+            try:
+                _release_lease()
+            except Exception:
+                pass
@@ -1,8 +1,14 @@
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import numpy as np
+import metrics
+
+_CORPUS_FIELDS = ("title", "description", "tags", "category", "location")
+
 
 def build_corpus(rows):
+    """(ids, texts). `rows` is a list of rows or a columnar dict {"id": [...], "title": [...], ...}."""
+    if isinstance(rows, dict):
+        cols = [rows[f] for f in _CORPUS_FIELDS]
+        texts = [" ".join(v or "" for v in vals).strip() for vals in zip(*cols)]
+        return list(rows["id"]), texts
     texts = []
     ids = []
     for r in rows:
@@ -17,7 +23,13 @@ def build_corpus(rows):
         ids.append(r["id"])
     return ids, texts
 
+@metrics.timed("top_matches")
 def top_matches(target_row, candidate_rows, top_k=5):
+    # sklearn sólo acá: build_corpus se usa en el camino de escritura (simhash) y no debe cargarlo
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.metrics.pairwise import cosine_similarity
+    import numpy as np
+
     if not candidate_rows:
         return []
     all_rows = [target_row] + list(candidate_rows)
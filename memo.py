@@ -0,0 +1,129 @@
+"""Memoización con alcance de una ejecución (rerun) del script de Streamlit.
+
+Streamlit vuelve a correr `app.main()` completo en cada interacción, y varias
+secciones piden lo mismo (cámaras, super admin, contadores). Dentro de
+`with memo.scope():` las funciones decoradas con `@memo.cached` se ejecutan
+una sola vez por combinación de argumentos; fuera de un scope (API, hilos de
+fondo) se comportan como una llamada normal.
+
+Las funciones que escriben se decoran con `@memo.invalidates`: vacían el cache
+del scope para que lo que se lea después refleje el cambio.
+
+El scope también lleva la cuenta de llamadas a la base (conexiones abiertas,
+llamadas ejecutadas vs. servidas desde el cache y su duración).
+"""
+import contextvars
+import functools
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+import metrics
+
+_HIT = metrics.CACHE_REQUESTS.labels("memo", "hit")
+_MISS = metrics.CACHE_REQUESTS.labels("memo", "miss")
+
+
+class RerunStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.cache: Dict[Any, Any] = {}
+        self.calls: Dict[str, Dict[str, float]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.db_connections = 0
+        self.db_ms = 0.0
+
+    def _fn(self, name: str) -> Dict[str, float]:
+        return self.calls.setdefault(name, {"calls": 0, "hits": 0, "ms": 0.0})
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "elapsed_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "db_connections": self.db_connections,
+            "db_ms": round(self.db_ms, 1),
+            "hits": self.hits,
+            "misses": self.misses,
+            "by_function": {k: dict(v, ms=round(v["ms"], 1)) for k, v in sorted(self.calls.items())},
+        }
+
+
+_current: contextvars.ContextVar[Optional[RerunStats]] = contextvars.ContextVar("cpf_rerun", default=None)
+
+
+@contextmanager
+def scope() -> Iterator[RerunStats]:
+    """Abre un scope de memoización (uno por rerun)."""
+    stats = RerunStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def current() -> Optional[RerunStats]:
+    return _current.get()
+
+
+def record_connection() -> None:
+    """Lo llama storage al abrir una conexión (sólo cuenta si hay scope activo)."""
+    s = _current.get()
+    if s is not None:
+        s.db_connections += 1
+
+
+def clear() -> None:
+    s = _current.get()
+    if s is not None:
+        s.cache.clear()
+
+
+def _key(name: str, args: tuple, kwargs: Dict[str, Any]) -> Any:
+    try:
+        key = (name, args, tuple(sorted(kwargs.items())))
+        hash(key)
+        return key
+    except TypeError:
+        return None
+
+
+def cached(fn: Callable) -> Callable:
+    name = f"{fn.__module__}.{fn.__name__}"
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        s = _current.get()
+        if s is None:
+            return fn(*args, **kwargs)
+        key = _key(name, args, kwargs)
+        st = s._fn(name)
+        if key is not None and key in s.cache:
+            s.hits += 1
+            st["hits"] += 1
+            _HIT.inc()
+            return s.cache[key]
+        _MISS.inc()
+        t0 = time.perf_counter()
+        out = fn(*args, **kwargs)
+        ms = (time.perf_counter() - t0) * 1000
+        s.misses += 1
+        s.db_ms += ms
+        st["calls"] += 1
+        st["ms"] += ms
+        if key is not None:
+            s.cache[key] = out
+        return out
+
+    return wrapper
+
+
+def invalidates(fn: Callable) -> Callable:
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            clear()
+
+    return wrapper
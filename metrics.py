@@ -0,0 +1,438 @@
+"""Métricas del proceso (latencias, caches, salud de la base) en formato Prometheus.
+
+Registro mínimo sin dependencias: contadores e histogramas con etiquetas y
+gauges que se calculan al momento de exportar (tamaño del archivo y del WAL,
+conexiones abiertas). El camino caliente no toma locks: cada hilo escribe en
+su propia lista de contadores (_Shards) y el export suma las de todos, así que
+registrar una muestra es leer un threading.local, un bisect y dos sumas sobre
+una lista, sin llamadas Python intermedias (ver benchmark(): unos cientos de ns
+contando las dos lecturas del reloj).
+
+Instrumentado:
+- cpf_service_latency_seconds{fn}: search_requirements, authenticate,
+  top_matches, assistant_answer (decorador `timed`)
+- cpf_cache_requests_total{cache,result}: memo (por rerun), auth de la API,
+  snapshot de lectura
+- cpf_db_connections_opened_total{kind}, cpf_db_connections_open,
+  cpf_db_pool_connections{state} (PostgreSQL)
+- cpf_db_lock_errors_total{op}: "database is locked"/"busy" de SQLite
+- cpf_db_commit_seconds: en modo rollback-journal el lock de escritura se
+  espera al hacer commit, así que es la mejor aproximación a la espera por lock
+- cpf_db_file_bytes, cpf_db_wal_bytes
+
+Export: app.py levanta un servidor HTTP local (CPF_METRICS_HOST:CPF_METRICS_PORT,
+default 127.0.0.1:9464, GET /metrics); api.py usa CPF_API_METRICS_PORT. Puerto 0
+lo desactiva. `python metrics.py` mide el costo por muestra en este equipo.
+"""
+import functools
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+HOST = os.environ.get("CPF_METRICS_HOST", "127.0.0.1")
+PORT = int(os.environ.get("CPF_METRICS_PORT", "9464"))
+
+# Segundos; cubre desde lecturas cacheadas hasta llamadas al LLM
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Hilos con contadores propios antes de juntar los de hilos terminados (Streamlit usa un hilo por rerun)
+_MAX_SHARDS = 64
+
+
+class _Shards:
+    """Un vector de contadores por hilo: cada hilo escribe sólo el suyo, sin lock."""
+
+    __slots__ = ("_size", "tls", "_lock", "_shards", "_base")
+
+    def __init__(self, size: int):
+        self._size = size
+        # Los llamadores leen `tls.slot` directamente y sólo llaman new_slot() la primera vez
+        self.tls = threading.local()
+        self._lock = threading.Lock()
+        self._shards: List[Tuple[threading.Thread, List[float]]] = []
+        self._base = [0] * size  # lo acumulado por hilos que ya terminaron
+
+    def new_slot(self) -> List[float]:
+        slot = [0] * self._size
+        with self._lock:
+            if len(self._shards) >= _MAX_SHARDS:
+                alive = []
+                for t, s in self._shards:
+                    if t.is_alive():
+                        alive.append((t, s))
+                    else:
+                        self._base = [a + b for a, b in zip(self._base, s)]
+                self._shards = alive
+            self._shards.append((threading.current_thread(), slot))
+        self.tls.slot = slot
+        return slot
+
+    def totals(self) -> List[float]:
+        with self._lock:
+            out = list(self._base)
+            for _, s in self._shards:
+                out = [a + b for a, b in zip(out, s)]
+        return out
+
+
+class Counter:
+    def __init__(self):
+        self._s = _Shards(1)
+        self._tls = self._s.tls
+
+    def inc(self, amount: float = 1) -> None:
+        try:
+            s = self._tls.slot
+        except AttributeError:
+            s = self._s.new_slot()
+        s[0] += amount
+
+    def value(self) -> float:
+        return self._s.totals()[0]
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.bounds = tuple(buckets)
+        # [un contador por bucket, +Inf, suma]
+        self._s = _Shards(len(self.bounds) + 2)
+        self._tls = self._s.tls
+
+    def observe(self, value: float) -> None:
+        try:
+            s = self._tls.slot
+        except AttributeError:
+            s = self._s.new_slot()
+        s[bisect_left(self.bounds, value)] += 1
+        s[-1] += value
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        """(cuenta por bucket —no acumulada—, suma)."""
+        t = self._s.totals()
+        return [int(x) for x in t[:-1]], t[-1]
+
+    def quantile(self, q: float, counts: Optional[List[int]] = None) -> Optional[float]:
+        """Estimación por interpolación lineal dentro del bucket (como histogram_quantile)."""
+        counts = counts if counts is not None else self.snapshot()[0]
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        for i, n in enumerate(counts):
+            if seen + n >= rank and n:
+                lo = self.bounds[i - 1] if i > 0 else 0.0
+                if i >= len(self.bounds):
+                    return self.bounds[-1]
+                return lo + (self.bounds[i] - lo) * (rank - seen) / n
+            seen += n
+        return self.bounds[-1]
+
+
+class Family:
+    """Métrica con etiquetas: `.labels(*valores)` devuelve (y recuerda) el hijo."""
+
+    def __init__(self, name: str, help_: str, kind: str, labelnames: Sequence[str] = (), factory: Callable = Counter):
+        self.name = name
+        self.help = help_
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self._factory = factory
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: str):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._factory())
+        return child
+
+    def children(self) -> List[Tuple[Tuple[str, ...], Any]]:
+        with self._lock:
+            return sorted(self._children.items())
+
+
+_REGISTRY: Dict[str, Family] = {}
+# name -> (help, función que devuelve {etiquetas: valor} o un valor)
+_GAUGES: Dict[str, Tuple[str, Sequence[str], Callable[[], Any]]] = {}
+
+
+def counter(name: str, help_: str, labelnames: Sequence[str] = ()) -> Family:
+    return _REGISTRY.setdefault(name, Family(name, help_, "counter", labelnames, Counter))
+
+
+def histogram(name: str, help_: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Family:
+    return _REGISTRY.setdefault(name, Family(name, help_, "histogram", labelnames, lambda: Histogram(buckets)))
+
+
+def gauge(name: str, help_: str, fn: Callable[[], Any], labelnames: Sequence[str] = ()) -> None:
+    """Gauge calculado al exportar: fn() -> valor, o {tupla de etiquetas: valor}."""
+    _GAUGES[name] = (help_, tuple(labelnames), fn)
+
+
+# -------------------- Instrumentos --------------------
+SERVICE_LATENCY = histogram("cpf_service_latency_seconds", "Latencia de funciones de servicio", ("fn",))
+CACHE_REQUESTS = counter("cpf_cache_requests_total", "Consultas a caches por resultado", ("cache", "result"))
+DB_CONNECTIONS = counter("cpf_db_connections_opened_total", "Conexiones a la base abiertas", ("kind",))
+DB_LOCK_ERRORS = counter("cpf_db_lock_errors_total", "Errores 'database is locked/busy' de SQLite", ("op",))
+DB_COMMIT = histogram("cpf_db_commit_seconds", "Duración de commits (incluye la espera por el lock de escritura)")
+
+# Conexiones SQLite abiertas ahora (db._TrackedConnection suma al abrir y resta al cerrar)
+_open_connections = [0]
+_open_lock = threading.Lock()
+
+
+def connection_opened() -> None:
+    with _open_lock:
+        _open_connections[0] += 1
+
+
+def connection_closed() -> None:
+    with _open_lock:
+        _open_connections[0] -= 1
+
+
+def timed(fn_name: str) -> Callable:
+    """Decorador: registra la duración de cada llamada en cpf_service_latency_seconds{fn=fn_name}."""
+    hist = SERVICE_LATENCY.labels(fn_name)
+    # Histogram.observe en línea: el wrapper no hace otras llamadas Python que fn
+    tls, new_slot, bounds = hist._tls, hist._s.new_slot, hist.bounds
+    clock, bisect = time.perf_counter, bisect_left
+
+    def deco(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            t0 = clock()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                dt = clock() - t0
+                try:
+                    s = tls.slot
+                except AttributeError:
+                    s = new_slot()
+                s[bisect(bounds, dt)] += 1
+                s[-1] += dt
+
+        return wrapper
+
+    return deco
+
+
+def _file_size(path) -> float:
+    try:
+        return float(os.stat(path).st_size)
+    except OSError:
+        return 0.0
+
+
+def _db_file_bytes() -> float:
+    import storage
+
+    if not storage.is_sqlite():
+        return float("nan")
+    from db import DB_PATH
+
+    return _file_size(DB_PATH)
+
+
+def _db_wal_bytes() -> float:
+    import storage
+
+    if not storage.is_sqlite():
+        return float("nan")
+    from db import DB_PATH
+
+    return _file_size(DB_PATH.with_name(DB_PATH.name + "-wal"))
+
+
+def _pool_connections() -> Dict[Tuple[str, ...], float]:
+    import storage
+
+    return {(state,): float(n) for state, n in storage.get_backend().pool_stats().items()}
+
+
+gauge("cpf_db_file_bytes", "Tamaño del archivo SQLite", _db_file_bytes)
+gauge("cpf_db_wal_bytes", "Tamaño del WAL de SQLite (0 si no está en modo WAL)", _db_wal_bytes)
+gauge("cpf_db_connections_open", "Conexiones SQLite abiertas en este proceso", lambda: float(_open_connections[0]))
+gauge("cpf_db_pool_connections", "Conexiones del pool de PostgreSQL", _pool_connections, ("state",))
+
+
+# -------------------- Export --------------------
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [n + '="' + str(v).replace("\\", "\\\\").replace('"', '\\"') + '"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _fmt_value(v: float) -> str:
+    if v != v:
+        return "NaN"
+    return repr(float(v)) if not float(v).is_integer() else str(int(v))
+
+
+def render() -> str:
+    """Todas las métricas en el formato de texto de Prometheus (0.0.4)."""
+    lines: List[str] = []
+    for fam in list(_REGISTRY.values()):
+        lines.append(f"# HELP {fam.name} {fam.help}")
+        lines.append(f"# TYPE {fam.name} {fam.kind}")
+        for values, child in fam.children():
+            if fam.kind == "counter":
+                lines.append(f"{fam.name}{_fmt_labels(fam.labelnames, values)} {_fmt_value(child.value())}")
+                continue
+            counts, total = child.snapshot()
+            acc = 0
+            for bound, n in zip(child.bounds + (float("inf"),), counts):
+                acc += n
+                le = 'le="' + ("+Inf" if bound == float("inf") else repr(bound)) + '"'
+                lines.append(f"{fam.name}_bucket{_fmt_labels(fam.labelnames, values, le)} {acc}")
+            lines.append(f"{fam.name}_sum{_fmt_labels(fam.labelnames, values)} {_fmt_value(total)}")
+            lines.append(f"{fam.name}_count{_fmt_labels(fam.labelnames, values)} {acc}")
+    for name, (help_, labelnames, fn) in list(_GAUGES.items()):
+        try:
+            val = fn()
+        except Exception:
+            continue
+        lines.append(f"# HELP {name} {help_}")
+        lines.append(f"# TYPE {name} gauge")
+        items = val.items() if isinstance(val, dict) else [((), val)]
+        for values, v in items:
+            lines.append(f"{name}{_fmt_labels(labelnames, values)} {_fmt_value(v)}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot() -> Dict[str, Any]:
+    """Resumen legible para el Panel: latencias (ms), caches, base."""
+    latency = []
+    for (fn,), h in SERVICE_LATENCY.children():
+        counts, total = h.snapshot()
+        n = sum(counts)
+        q = {p: h.quantile(p / 100, counts) for p in (50, 95, 99)}
+        latency.append({
+            "fn": fn,
+            "count": n,
+            "mean_ms": round(total / n * 1000, 2) if n else None,
+            **{f"p{p}_ms": round(v * 1000, 2) if v is not None else None for p, v in q.items()},
+        })
+    caches: Dict[str, Dict[str, Any]] = {}
+    for (cache, result), c in CACHE_REQUESTS.children():
+        caches.setdefault(cache, {"cache": cache, "hit": 0, "miss": 0})[result] = int(c.value())
+    for row in caches.values():
+        seen = row["hit"] + row["miss"]
+        row["hit_ratio"] = round(row["hit"] / seen, 3) if seen else None
+    commit_counts, _ = DB_COMMIT.labels().snapshot()
+    db: Dict[str, Any] = {
+        "file_bytes": _safe(_db_file_bytes),  # None con PostgreSQL
+        "wal_bytes": _safe(_db_wal_bytes),
+        "connections_open": _open_connections[0],
+        "connections_opened": {k: int(c.value()) for (k,), c in DB_CONNECTIONS.children()},
+        "pool": {k[0]: v for k, v in (_safe(_pool_connections) or {}).items()},
+        "lock_errors": {k: int(c.value()) for (k,), c in DB_LOCK_ERRORS.children()},
+        "commit_p95_ms": _ms(DB_COMMIT.labels().quantile(0.95, commit_counts)),
+    }
+    return {"latency": latency, "caches": list(caches.values()), "db": db}
+
+
+def _safe(fn: Callable[[], Any]) -> Any:
+    try:
+        v = fn()
+    except Exception:
+        return None
+    return None if isinstance(v, float) and v != v else v
+
+
+def _ms(v: Optional[float]) -> Optional[float]:
+    return round(v * 1000, 2) if v is not None else None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self) -> None:  # noqa: N802
+        if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args: Any) -> None:
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+
+def ensure_exporter(host: str = HOST, port: int = PORT) -> Optional[ThreadingHTTPServer]:
+    """Levanta (una vez por proceso) el endpoint /metrics. None si está desactivado o el puerto está ocupado."""
+    global _server
+    if not port:
+        return None
+    with _server_lock:
+        if _server is not None:
+            return _server
+        try:
+            srv = ThreadingHTTPServer((host, port), _Handler)
+        except OSError as e:
+            from db import log
+
+            log("metrics", "exporter_unavailable", f"{host}:{port}", str(e), level="WARNING")
+            return None
+        srv.daemon_threads = True
+        threading.Thread(target=srv.serve_forever, name="cpf-metrics", daemon=True).start()
+        _server = srv
+        return srv
+
+
+def stop_exporter() -> None:
+    global _server
+    with _server_lock:
+        if _server is not None:
+            _server.shutdown()
+            _server.server_close()
+            _server = None
+
+
+def benchmark(n: int = 1_000_000) -> Dict[str, float]:
+    """Costo por muestra (µs) de los caminos calientes, en este equipo."""
+    h = Histogram()
+    c = Counter()
+
+    @timed("_benchmark")
+    def noop() -> None:
+        pass
+
+    def bare() -> None:
+        pass
+
+    out = {}
+    t0 = time.perf_counter()
+    for _ in range(n):
+        h.observe(0.003)
+    out["histogram.observe"] = (time.perf_counter() - t0) / n * 1e6
+    t0 = time.perf_counter()
+    for _ in range(n):
+        c.inc()
+    out["counter.inc"] = (time.perf_counter() - t0) / n * 1e6
+    t0 = time.perf_counter()
+    for _ in range(n):
+        bare()
+    base = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    for _ in range(n):
+        noop()
+    out["timed (overhead)"] = (time.perf_counter() - t0 - base) / n * 1e6
+    SERVICE_LATENCY._children.pop(("_benchmark",), None)
+    return {k: round(v, 3) for k, v in out.items()}
+
+
+if __name__ == "__main__":
+    print(benchmark())
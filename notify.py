@@ -0,0 +1,405 @@
+"""Entrega de notificaciones desde la tabla `outbox` (fuera del request path).
+
+services.py escribe un evento en `outbox` en la misma transacción que el cambio
+de la solicitud de contacto. Un hilo por proceso (Dispatcher) toma lotes de
+eventos pendientes, los enriquece con nombres/correos y los entrega a los
+sinks configurados, con reintentos y backoff exponencial.
+
+La entrega se registra por (evento, sink): `delivered_sinks` guarda qué sinks
+ya aceptaron cada evento, así un reintento sólo vuelve a enviar a los que
+fallaron. Si el envío en lote de un sink falla, se reintenta evento por evento
+para que un evento problemático no arrastre al resto.
+
+Retención (tarea "outbox" de maintenance.py, purge_outbox): un evento que sigue
+pendiente pasados CPF_NOTIFY_MAX_AGE_DAYS se da por muerto (ya no sirve avisar;
+también cubre el caso sin sinks configurados, donde nadie los consume), y los
+entregados o muertos se borran pasados CPF_NOTIFY_RETENTION_DAYS.
+
+Configuración (variables de entorno):
+- CPF_NOTIFY_FILE=/var/data/notifications.jsonl    -> FileSink
+- CPF_NOTIFY_WEBHOOK_URL=https://...                -> WebhookSink
+- CPF_SMTP_HOST / CPF_SMTP_PORT / CPF_SMTP_FROM / CPF_SMTP_USER / CPF_SMTP_PASSWORD / CPF_SMTP_STARTTLS -> SmtpSink
+"""
+import json
+import os
+import random
+import smtplib
+import threading
+import time
+import urllib.request
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from typing import Any, Dict, List, Optional
+
+import storage
+from db import log, now_iso
+
+BATCH_SIZE = int(os.environ.get("CPF_NOTIFY_BATCH", "20"))
+POLL_SECONDS = float(os.environ.get("CPF_NOTIFY_POLL", "2"))
+MAX_ATTEMPTS = int(os.environ.get("CPF_NOTIFY_MAX_ATTEMPTS", "8"))
+RETENTION_DAYS = int(os.environ.get("CPF_NOTIFY_RETENTION_DAYS", "30"))
+MAX_AGE_DAYS = int(os.environ.get("CPF_NOTIFY_MAX_AGE_DAYS", "7"))
+LEASE_SECONDS = 60
+_BACKOFF_BASE = 5.0
+_BACKOFF_MAX = 3600.0
+
+_SUBJECTS = {
+    "contact_requested": "CPF: nueva solicitud de contacto",
+    "contact_accepted": "CPF: tu solicitud de contacto fue aceptada",
+    "contact_declined": "CPF: tu solicitud de contacto fue rechazada",
+}
+
+
+def _iso(dt: datetime) -> str:
+    return dt.replace(microsecond=0).isoformat() + "Z"
+
+
+# -------------------- Sinks --------------------
+class Sink:
+    """Destino de notificaciones. `send` recibe un lote y levanta excepción si falla."""
+
+    name = "sink"
+
+    def send(self, events: List[Dict[str, Any]]) -> None:
+        raise NotImplementedError
+
+
+class FileSink(Sink):
+    name = "file"
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def send(self, events: List[Dict[str, Any]]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            for ev in events:
+                f.write(json.dumps(ev, ensure_ascii=False) + "\n")
+
+
+class WebhookSink(Sink):
+    name = "webhook"
+
+    def __init__(self, url: str, timeout: float = 5.0):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, events: List[Dict[str, Any]]) -> None:
+        body = json.dumps({"events": events}, ensure_ascii=False).encode("utf-8")
+        req = urllib.request.Request(
+            self.url, data=body, method="POST", headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            if resp.status >= 300:
+                raise RuntimeError(f"webhook HTTP {resp.status}")
+
+
+class SmtpSink(Sink):
+    name = "smtp"
+
+    def __init__(
+        self,
+        host: str,
+        port: int = 25,
+        sender: str = "cpf@localhost",
+        user: Optional[str] = None,
+        password: Optional[str] = None,
+        starttls: bool = False,
+        timeout: float = 10.0,
+    ):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.user = user
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+
+    def send(self, events: List[Dict[str, Any]]) -> None:
+        msgs = [m for m in (self._message(ev) for ev in events) if m is not None]
+        if not msgs:
+            return
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as s:
+            if self.starttls:
+                s.starttls()
+            if self.user:
+                s.login(self.user, self.password or "")
+            for m in msgs:
+                s.send_message(m)
+
+    def _message(self, ev: Dict[str, Any]) -> Optional[EmailMessage]:
+        d = ev.get("data") or {}
+        if ev["event"] == "contact_requested":
+            to, body = d.get("to_email"), (
+                f"{d.get('from_name')} ({d.get('from_company') or '-'}) quiere contactarte por "
+                f"#{d.get('requirement_id')} · {d.get('title')}.\nRevisá tu Bandeja en CPF."
+            )
+        else:
+            estado = "aceptó" if ev["event"] == "contact_accepted" else "rechazó"
+            to, body = d.get("from_email"), (
+                f"{d.get('to_name')} {estado} tu solicitud por #{d.get('requirement_id')} · {d.get('title')}."
+            )
+        if not to:
+            return None
+        m = EmailMessage()
+        m["From"] = self.sender
+        m["To"] = to
+        m["Subject"] = _SUBJECTS.get(ev["event"], "CPF: notificación")
+        m["X-CPF-Event-Id"] = str(ev["id"])
+        m.set_content(body)
+        return m
+
+
+def configured_sinks() -> List[Sink]:
+    sinks: List[Sink] = []
+    if os.environ.get("CPF_NOTIFY_FILE"):
+        sinks.append(FileSink(os.environ["CPF_NOTIFY_FILE"]))
+    if os.environ.get("CPF_NOTIFY_WEBHOOK_URL"):
+        sinks.append(WebhookSink(os.environ["CPF_NOTIFY_WEBHOOK_URL"]))
+    if os.environ.get("CPF_SMTP_HOST"):
+        sinks.append(
+            SmtpSink(
+                os.environ["CPF_SMTP_HOST"],
+                int(os.environ.get("CPF_SMTP_PORT", "25")),
+                sender=os.environ.get("CPF_SMTP_FROM", "cpf@localhost"),
+                user=os.environ.get("CPF_SMTP_USER") or None,
+                password=os.environ.get("CPF_SMTP_PASSWORD") or None,
+                starttls=os.environ.get("CPF_SMTP_STARTTLS", "0") == "1",
+            )
+        )
+    return sinks
+
+
+# -------------------- Outbox --------------------
+def _claim_batch(limit: int) -> List[Dict[str, Any]]:
+    """Toma hasta `limit` eventos vencidos con un lease (otros workers los saltean mientras tanto)."""
+    now = datetime.utcnow()
+    c = storage.connect()
+    rows = c.execute(
+        f"""UPDATE outbox SET next_attempt_at=?
+           WHERE id IN (
+               SELECT id FROM outbox WHERE status='pending' AND next_attempt_at<=?
+               ORDER BY id LIMIT ?{storage.get_backend().skip_locked}
+           )
+           RETURNING id, event, payload, attempts, created_at, delivered_sinks""",
+        (_iso(now + timedelta(seconds=LEASE_SECONDS)), _iso(now), int(limit)),
+    ).fetchall()
+    c.commit()
+    c.close()
+    return sorted((dict(r) for r in rows), key=lambda r: r["id"])
+
+
+def _enrich(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Agrega nombres/correos/título de la solicitud (se hace acá, no en el click del usuario)."""
+    c = storage.connect()
+    out = []
+    for ev in events:
+        payload = json.loads(ev["payload"] or "{}")
+        data: Dict[str, Any] = dict(payload)
+        row = c.execute(
+            """SELECT cr.id AS request_id, cr.status, cr.requirement_id, r.title,
+                      fu.name AS from_name, fu.email AS from_email, fu.company AS from_company,
+                      tu.name AS to_name, tu.email AS to_email
+               FROM contact_requests cr
+               JOIN requirements r ON r.id = cr.requirement_id
+               JOIN users fu ON fu.id = cr.from_user_id
+               JOIN users tu ON tu.id = cr.to_user_id
+               WHERE cr.id=?""",
+            (int(payload.get("request_id") or 0),),
+        ).fetchone()
+        if row:
+            data.update(dict(row))
+        out.append({"id": ev["id"], "event": ev["event"], "created_at": ev["created_at"], "data": data})
+    c.close()
+    return out
+
+
+def _sink_set(value: Optional[str]) -> set:
+    return {s for s in (value or "").split(",") if s}
+
+
+def _send(sink: Sink, events: List[Dict[str, Any]], errors: Dict[int, str]) -> List[Dict[str, Any]]:
+    """Envía `events` a un sink; devuelve los aceptados y anota en `errors` los que fallaron.
+
+    Primero en lote; si el lote falla, evento por evento. Si el primer envío
+    individual también falla se asume el sink caído y no se insiste con el
+    resto (evita un timeout por evento).
+    """
+    try:
+        sink.send(events)
+        return events
+    except Exception as e:
+        if len(events) == 1:
+            errors.setdefault(events[0]["id"], f"{sink.name}: {type(e).__name__}: {e}")
+            return []
+    accepted: List[Dict[str, Any]] = []
+    for i, ev in enumerate(events):
+        try:
+            sink.send([ev])
+            accepted.append(ev)
+        except Exception as e:
+            msg = f"{sink.name}: {type(e).__name__}: {e}"
+            if i == 0:
+                for rest in events:
+                    errors.setdefault(rest["id"], msg)
+                return []
+            errors.setdefault(ev["id"], msg)
+    return accepted
+
+
+def _record(claimed: List[Dict[str, Any]], done: Dict[int, set], names: set, errors: Dict[int, str]) -> int:
+    """Guarda el resultado de cada evento; devuelve cuántos quedaron entregados."""
+    now = datetime.utcnow()
+    delivered = 0
+    c = storage.connect()
+    for ev in claimed:
+        sinks_ok = ",".join(sorted(done[ev["id"]]))
+        if names <= done[ev["id"]]:
+            delivered += 1
+            c.execute(
+                "UPDATE outbox SET status='delivered', delivered_at=?, delivered_sinks=?, last_error=NULL WHERE id=?",
+                (now_iso(), sinks_ok, int(ev["id"])),
+            )
+            continue
+        attempts = int(ev["attempts"]) + 1
+        delay = min(_BACKOFF_MAX, _BACKOFF_BASE * (2 ** (attempts - 1))) * random.uniform(0.8, 1.2)
+        c.execute(
+            """UPDATE outbox SET attempts=?, last_error=?, next_attempt_at=?, delivered_sinks=?,
+                   status=CASE WHEN ? >= ? THEN 'dead' ELSE 'pending' END
+               WHERE id=?""",
+            (attempts, errors.get(ev["id"], "")[:500], _iso(now + timedelta(seconds=delay)), sinks_ok,
+             attempts, MAX_ATTEMPTS, int(ev["id"])),
+        )
+    c.commit()
+    c.close()
+    return delivered
+
+
+def drain_once(sinks: Optional[List[Sink]] = None, batch_size: int = BATCH_SIZE) -> int:
+    """Entrega un lote. Devuelve cuántos eventos quedaron entregados."""
+    sinks = configured_sinks() if sinks is None else sinks
+    if not sinks:
+        return 0
+    claimed = _claim_batch(batch_size)
+    if not claimed:
+        return 0
+    events = _enrich(claimed)
+    # Un evento se da por entregado cuando todos los sinks lo aceptaron (en este
+    # intento o en uno anterior); a cada sink sólo le llega lo que le falta.
+    done = {ev["id"]: _sink_set(ev.get("delivered_sinks")) for ev in claimed}
+    errors: Dict[int, str] = {}
+    for sink in sinks:
+        todo = [ev for ev in events if sink.name not in done[ev["id"]]]
+        if todo:
+            for ev in _send(sink, todo, errors):
+                done[ev["id"]].add(sink.name)
+    delivered = _record(claimed, done, {s.name for s in sinks}, errors)
+    if errors:
+        log("notify", "delivery_failed", f"n={len(errors)}", next(iter(errors.values())), level="WARNING")
+    return delivered
+
+
+def purge_outbox(
+    days: int = RETENTION_DAYS,
+    max_age_days: int = MAX_AGE_DAYS,
+    batch: int = 5000,
+    deadline: Optional[float] = None,
+) -> Dict[str, int]:
+    """Vence pendientes de más de `max_age_days` y borra entregados/muertos de más de `days`.
+
+    En lotes cortos; `deadline` (time.monotonic()) corta entre lotes y el resto
+    sale en la próxima corrida.
+    """
+    now = datetime.utcnow()
+    stale = _iso(now - timedelta(days=max_age_days))
+    cutoff = _iso(now - timedelta(days=days))
+    out = {"expired": 0, "deleted": 0}
+    c = storage.connect()
+    try:
+        for sql, params, counter in (
+            (
+                """UPDATE outbox SET status='dead', last_error='expired' WHERE id IN (
+                       SELECT id FROM outbox WHERE status='pending' AND created_at<? LIMIT ?
+                   )""",
+                (stale,),
+                "expired",
+            ),
+            (
+                """DELETE FROM outbox WHERE id IN (
+                       SELECT id FROM outbox WHERE status='delivered' AND delivered_at<? LIMIT ?
+                   )""",
+                (cutoff,),
+                "deleted",
+            ),
+            (
+                """DELETE FROM outbox WHERE id IN (
+                       SELECT id FROM outbox WHERE status='dead' AND created_at<? LIMIT ?
+                   )""",
+                (cutoff,),
+                "deleted",
+            ),
+        ):
+            while deadline is None or time.monotonic() < deadline:
+                n = max(c.execute(sql, (*params, int(batch))).rowcount, 0)
+                c.commit()
+                out[counter] += n
+                if n < batch:
+                    break
+    finally:
+        c.close()
+    return out
+
+
+def outbox_stats() -> Dict[str, int]:
+    c = storage.connect()
+    rows = c.execute("SELECT status, COUNT(*) AS n FROM outbox GROUP BY status").fetchall()
+    c.close()
+    return {r["status"]: int(r["n"]) for r in rows}
+
+
+# -------------------- Dispatcher (hilo de fondo) --------------------
+class Dispatcher(threading.Thread):
+    def __init__(self, sinks: List[Sink], poll_seconds: float = POLL_SECONDS):
+        super().__init__(name="cpf-outbox-dispatcher", daemon=True)
+        self.sinks = sinks
+        self.poll_seconds = poll_seconds
+        self._stop_evt = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_evt.is_set():
+            try:
+                # Si el lote vino lleno seguimos sin esperar
+                if drain_once(self.sinks) >= BATCH_SIZE:
+                    continue
+            except Exception as e:
+                log("notify", "dispatcher_error", str(e), level="ERROR")
+            self._stop_evt.wait(self.poll_seconds)
+
+    def stop(self) -> None:
+        self._stop_evt.set()
+
+
+_dispatcher: Optional[Dispatcher] = None
+_dispatcher_lock = threading.Lock()
+
+
+def ensure_dispatcher() -> Optional[Dispatcher]:
+    """Arranca (una vez por proceso) el dispatcher si hay sinks configurados."""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is not None and _dispatcher.is_alive():
+            return _dispatcher
+        sinks = configured_sinks()
+        if not sinks:
+            return None
+        _dispatcher = Dispatcher(sinks)
+        _dispatcher.start()
+        return _dispatcher
+
+
+def stop_dispatcher() -> None:
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is not None:
+            _dispatcher.stop()
+            _dispatcher.join(timeout=5)
+            _dispatcher = None
@@ -0,0 +1,367 @@
+"""Rematch completo en paralelo: todas las necesidades abiertas contra todas las ofertas abiertas.
+
+Complementa a suggestions.py (incremental, al publicar): recalcula desde cero
+`match_suggestions` con los vectores guardados en requirement_vectors.
+
+- Las dos matrices dispersas (CSR: indptr/indices/data + ids y user_ids) se
+  copian una vez a bloques de `multiprocessing.shared_memory`; los procesos
+  del pool se enganchan por nombre, sin recibir el corpus serializado.
+- Las ofertas se parten en shards, uno por tarea. Cada worker multiplica
+  bloques de necesidades por su shard (producto punto = coseno; el resultado
+  es disperso y el top-k se toma sobre los no-ceros) y escribe en memoria
+  compartida el top-k de cada necesidad dentro del shard y el top-k completo
+  de cada oferta del shard (cada oferta vive en un solo shard).
+- El proceso principal junta los top-k de cada necesidad entre shards con un
+  merge de heaps (heapq.merge sobre listas ya ordenadas).
+- El reemplazo de `match_suggestions` re-encola en `match_queue` los
+  requerimientos creados o editados desde que empezó la carga: el resultado
+  refleja la foto inicial y suggestions.Worker pone al día lo posterior.
+
+Uso:  python rematch.py [--workers N] [--top-k K]
+      python rematch.py --bench 50000 [--workers 1,2,4,8]   (datos sintéticos, sin base)
+"""
+import argparse
+import heapq
+import itertools
+import os
+import time
+from contextlib import ExitStack
+from multiprocessing import get_context, shared_memory
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+
+import vectors
+
+TOP_K = int(os.environ.get("CPF_SUGGEST_TOP_K", "10"))
+WORKERS = int(os.environ.get("CPF_REMATCH_WORKERS", "0")) or (os.cpu_count() or 1)
+# Celdas (necesidades x ofertas) por bloque del producto dentro de un worker
+BLOCK_CELLS = 16_000_000
+
+
+# -------------------- Memoria compartida --------------------
+def _share(stack: ExitStack, arr: np.ndarray) -> Tuple[str, str, Tuple[int, ...]]:
+    """Copia `arr` a un bloque compartido (liberado al cerrar `stack`); devuelve su descriptor."""
+    shm = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+    stack.callback(shm.unlink)
+    stack.callback(shm.close)
+    np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+    return shm.name, arr.dtype.str, arr.shape
+
+
+def _attach(stack: ExitStack, spec: Tuple[str, str, Tuple[int, ...]]) -> np.ndarray:
+    name, dtype, shape = spec
+    shm = shared_memory.SharedMemory(name=name)
+    stack.callback(shm.close)
+    return np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+class Corpus:
+    """Vectores de un lado (necesidades u ofertas) en CSR."""
+
+    def __init__(self, ids: np.ndarray, users: np.ndarray, indptr: np.ndarray, indices: np.ndarray, data: np.ndarray):
+        self.ids, self.users = ids, users
+        self.indptr, self.indices, self.data = indptr, indices, data
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[int, int, Any, Any]]) -> "Corpus":
+        """Filas (id, user_id, idx, val) con los BLOBs de requirement_vectors (se recorren una vez)."""
+        ids: List[int] = []
+        users: List[int] = []
+        idx: List[np.ndarray] = []
+        val: List[np.ndarray] = []
+        for rid, uid, i, v in rows:
+            ids.append(rid)
+            users.append(uid)
+            idx.append(np.frombuffer(bytes(i), dtype=np.uint32))
+            val.append(np.frombuffer(bytes(v), dtype=np.float32))
+        indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+        np.cumsum([len(a) for a in idx], out=indptr[1:])
+        return cls(
+            np.array(ids, dtype=np.int64),
+            np.array(users, dtype=np.int64),
+            indptr,
+            np.concatenate(idx).astype(np.int32) if idx else np.zeros(0, dtype=np.int32),
+            np.concatenate(val) if val else np.zeros(0, dtype=np.float32),
+        )
+
+    def share(self, stack: ExitStack) -> Dict[str, Any]:
+        return {k: _share(stack, getattr(self, k)) for k in ("ids", "users", "indptr", "indices", "data")}
+
+    @classmethod
+    def attach(cls, stack: ExitStack, spec: Dict[str, Any]) -> "Corpus":
+        return cls(**{k: _attach(stack, v) for k, v in spec.items()})
+
+    def matrix(self, lo: int = 0, hi: Optional[int] = None, dim: int = 0) -> sp.csr_matrix:
+        hi = len(self) if hi is None else hi
+        a, b = self.indptr[lo], self.indptr[hi]
+        return sp.csr_matrix(
+            (self.data[a:b], self.indices[a:b], self.indptr[lo : hi + 1] - a), shape=(hi - lo, dim)
+        )
+
+
+# -------------------- Worker --------------------
+def _top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k por fila de una matriz densa, ordenado de mayor a menor: (columnas, puntajes)."""
+    k = min(k, scores.shape[1])
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    vals = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-vals, axis=1, kind="stable")
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(vals, order, axis=1)
+
+
+def _top_k_sparse(m: sp.csr_matrix, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Top-k por fila de una CSR mirando sólo los no-ceros; faltantes = (-1, 0)."""
+    counts = np.diff(m.indptr)
+    rows = np.repeat(np.arange(m.shape[0]), counts)
+    # Una sola clave: fila ascendente y, dentro de la fila, puntaje descendente (0 < puntaje <= 1)
+    order = np.argsort(rows + (1.0 - m.data.astype(np.float64)))
+    rank = np.arange(len(order)) - np.repeat(m.indptr[:-1], counts)
+    keep = rank < k
+    sel = order[keep]
+    idx = np.full((m.shape[0], k), -1, dtype=np.int32)
+    val = np.zeros((m.shape[0], k), dtype=np.float32)
+    idx[rows[sel], rank[keep]] = m.indices[sel]
+    val[rows[sel], rank[keep]] = m.data[sel]
+    return idx, val
+
+
+def _score_shard(task: Dict[str, Any]) -> Tuple[int, float]:
+    """Necesidades x ofertas[lo:hi]; escribe sus top-k en la salida compartida."""
+    t0 = time.perf_counter()
+    shard, lo, hi, k, dim = task["shard"], task["lo"], task["hi"], task["k"], task["dim"]
+    with ExitStack() as stack:
+        needs = Corpus.attach(stack, task["needs"])
+        offers = Corpus.attach(stack, task["offers"])
+        need_best_idx = _attach(stack, task["need_best_idx"])[shard]
+        need_best_val = _attach(stack, task["need_best_val"])[shard]
+        offer_best_idx = _attach(stack, task["offer_best_idx"])
+        offer_best_val = _attach(stack, task["offer_best_val"])
+
+        offers_t = offers.matrix(lo, hi, dim).T.tocsc()
+        width = hi - lo
+        # Mejores necesidades de cada oferta del shard, acumuladas bloque a bloque
+        col_idx = np.full((width, k), -1, dtype=np.int32)
+        col_val = np.zeros((width, k), dtype=np.float32)
+        step = max(64, BLOCK_CELLS // max(1, width))
+        offer_users = offers.users[lo:hi]
+        for b0 in range(0, len(needs), step):
+            b1 = min(len(needs), b0 + step)
+            scores = (needs.matrix(b0, b1, dim) @ offers_t).tocsr()
+            # Nunca con uno mismo: se anulan los pares del mismo usuario
+            rows = np.repeat(np.arange(b0, b1), np.diff(scores.indptr))
+            scores.data[needs.users[rows] == offer_users[scores.indices]] = 0.0
+            scores.eliminate_zeros()
+            r_idx, r_val = _top_k_sparse(scores, k)
+            need_best_idx[b0:b1] = np.where(r_idx >= 0, r_idx + lo, -1)
+            need_best_val[b0:b1] = r_val
+            c_idx, c_val = _top_k_sparse(scores.T.tocsr(), k)
+            col_idx, col_val = _top_k_merge(col_idx, col_val, np.where(c_idx >= 0, c_idx + b0, -1), c_val, k)
+        offer_best_idx[lo:hi] = col_idx
+        offer_best_val[lo:hi] = col_val
+    return shard, time.perf_counter() - t0
+
+
+def _top_k_merge(a_idx, a_val, b_idx, b_val, k):
+    idx = np.concatenate([a_idx, b_idx], axis=1)
+    val = np.concatenate([a_val, b_val], axis=1)
+    sel, top = _top_k(val, k)
+    return np.take_along_axis(idx, sel, axis=1), top
+
+
+# -------------------- Orquestación --------------------
+def match_all(
+    needs: Corpus, offers: Corpus, top_k: int = TOP_K, workers: int = WORKERS, dim: Optional[int] = None
+) -> Dict[str, Any]:
+    """Top-k de cada necesidad y de cada oferta. Devuelve {"pairs": [(req, counterpart, score)], "stats": {...}}."""
+    dim = dim or vectors.DIM
+    t0 = time.perf_counter()
+    if not len(needs) or not len(offers):
+        return {"pairs": [], "stats": {"needs": len(needs), "offers": len(offers), "seconds": 0.0}}
+    n_shards = max(1, min(workers, len(offers)))
+    bounds = np.linspace(0, len(offers), n_shards + 1).astype(int)
+    with ExitStack() as stack:
+        out = {
+            "need_best_idx": np.full((n_shards, len(needs), top_k), -1, dtype=np.int32),
+            "need_best_val": np.zeros((n_shards, len(needs), top_k), dtype=np.float32),
+            "offer_best_idx": np.full((len(offers), top_k), -1, dtype=np.int32),
+            "offer_best_val": np.zeros((len(offers), top_k), dtype=np.float32),
+        }
+        specs = {k: _share(stack, v) for k, v in out.items()}
+        base = dict(needs=needs.share(stack), offers=offers.share(stack), k=top_k, dim=dim, **specs)
+        tasks = [dict(base, shard=s, lo=int(bounds[s]), hi=int(bounds[s + 1])) for s in range(n_shards)]
+        t_shared = time.perf_counter()
+        if workers > 1:
+            # spawn: los workers no heredan conexiones ni hilos del proceso principal
+            with get_context("spawn").Pool(min(workers, n_shards)) as pool:
+                shard_secs = dict(pool.imap_unordered(_score_shard, tasks))
+        else:
+            shard_secs = dict(_score_shard(t) for t in tasks)
+        t_scored = time.perf_counter()
+        res = {k: _attach(stack, v).copy() for k, v in specs.items()}
+
+    pairs: List[Tuple[int, int, float]] = []
+    # Necesidades: merge de las listas ordenadas de cada shard (ids ya traducidos)
+    offer_ids = np.append(offers.ids, -1)  # idx -1 (sin candidato) -> id -1
+    neg_vals = (-res["need_best_val"].astype(np.float64).round(4)).tolist()
+    cand_ids = offer_ids[res["need_best_idx"]].tolist()
+    for i, need_id in enumerate(needs.ids.tolist()):
+        lists = [zip(neg_vals[s][i], cand_ids[s][i]) for s in range(n_shards)]
+        for neg, oid in itertools.islice(heapq.merge(*lists), top_k):
+            if oid < 0 or neg >= 0:
+                break
+            pairs.append((need_id, oid, -neg))
+    # Ofertas: su top-k ya está completo (cada oferta vive en un solo shard)
+    ok = (res["offer_best_idx"] >= 0) & (res["offer_best_val"] > 0)
+    rows, cols = np.nonzero(ok)
+    pairs.extend(
+        zip(
+            offers.ids[rows].tolist(),
+            needs.ids[res["offer_best_idx"][rows, cols]].tolist(),
+            res["offer_best_val"][rows, cols].astype(np.float64).round(4).tolist(),
+        )
+    )
+    t_done = time.perf_counter()
+    return {
+        "pairs": pairs,
+        "stats": {
+            "needs": len(needs),
+            "offers": len(offers),
+            "shards": n_shards,
+            "workers": workers,
+            "share_s": round(t_shared - t0, 2),
+            "score_s": round(t_scored - t_shared, 2),
+            "merge_s": round(t_done - t_scored, 2),
+            "seconds": round(t_done - t0, 2),
+            "max_shard_s": round(max(shard_secs.values()), 2),
+            "pairs_per_s": int(len(needs) * len(offers) / max(1e-9, t_scored - t_shared)),
+        },
+    }
+
+
+def _load(c, type_: str) -> Corpus:
+    import storage
+
+    rows = storage.stream(
+        """SELECT r.id, r.user_id, v.idx, v.val
+           FROM requirements r
+           JOIN requirement_vectors v ON v.requirement_id = r.id
+           WHERE r.status='open' AND r.type=?
+           ORDER BY r.id""",
+        (type_,),
+        c=c,
+    )
+    return Corpus.from_rows((r["id"], r["user_id"], r["idx"], r["val"]) for r in rows)
+
+
+def run_full_rematch(top_k: int = TOP_K, workers: int = WORKERS, deadline: Optional[float] = None) -> Dict[str, Any]:
+    """Recalcula todo `match_suggestions` desde los vectores guardados. Devuelve estadísticas.
+
+    `deadline` (time.monotonic()) se revisa entre etapas: pasado el límite se
+    levanta TimeoutError sin tocar `match_suggestions`. El cálculo en el pool
+    no se interrumpe a mitad de camino.
+    """
+    # Imports diferidos: los workers (spawn) importan este módulo y no necesitan la base
+    import storage
+    import suggestions
+    from db import log, now_iso
+
+    def check(stage: str) -> None:
+        if deadline is not None and time.monotonic() > deadline:
+            raise TimeoutError(f"rematch: sin tiempo después de {stage}")
+
+    # Marca de agua (resolución de segundos; >= re-encola también lo del mismo segundo)
+    since = now_iso()
+    c = storage.connect()
+    try:
+        needs, offers = _load(c, "need"), _load(c, "offer")
+    finally:
+        c.close()
+    check("la carga")
+    result = match_all(needs, offers, top_k=top_k, workers=workers)
+    check("el cálculo")
+    ts = now_iso()
+    c = storage.connect()
+    try:
+        cur = c.cursor()
+        cur.execute("DELETE FROM match_suggestions")
+        cur.executemany(
+            "INSERT INTO match_suggestions(requirement_id, counterpart_id, score, created_at) VALUES(?,?,?,?)",
+            [(a, b, s, ts) for a, b, s in result["pairs"]],
+        )
+        # Lo que cambió durante la corrida no está en el resultado: al worker incremental
+        changed = [
+            int(r["id"])
+            for r in cur.execute(
+                "SELECT id FROM requirements WHERE COALESCE(updated_at, created_at) >= ?", (since,)
+            ).fetchall()
+        ]
+        for rid in changed:
+            suggestions.enqueue(cur, rid)
+        c.commit()
+    except Exception:
+        c.rollback()
+        raise
+    finally:
+        c.close()
+    stats = dict(result["stats"], suggestions=len(result["pairs"]), requeued=len(changed))
+    log("rematch", "full_rematch", str(stats))
+    return stats
+
+
+# -------------------- Benchmark --------------------
+def synthetic(n: int, seed: int, vocab: int = 30_000, nnz: int = 60, users: int = 5_000) -> Corpus:
+    """Vectores con frecuencias tipo Zipf (como texto real), normalizados, sin base de datos."""
+    rng = np.random.default_rng(seed)
+    ranks = np.arange(1, vocab + 1)
+    p = 1.0 / ranks
+    p /= p.sum()
+    feats = rng.integers(0, vectors.DIM, size=vocab)
+    rows = []
+    for _ in range(n):
+        f = np.unique(feats[rng.choice(vocab, size=nnz, p=p)])
+        w = rng.random(len(f)).astype(np.float32) + 0.5
+        w /= np.linalg.norm(w)
+        order = np.argsort(f)
+        rows.append((len(rows) + 1, int(rng.integers(users)), f[order].astype(np.uint32).tobytes(), w[order].tobytes()))
+    return Corpus.from_rows(rows)
+
+
+def benchmark(n: int, workers: Sequence[int], top_k: int = TOP_K) -> List[Dict[str, Any]]:
+    needs, offers = synthetic(n, seed=1), synthetic(n, seed=2)
+    out = []
+    for w in workers:
+        stats = match_all(needs, offers, top_k=top_k, workers=w)["stats"]
+        out.append(stats)
+        print(
+            f"workers={w:<3} shards={stats['shards']:<3} score={stats['score_s']:>8.2f}s "
+            f"(shard más lento {stats['max_shard_s']:.2f}s) "
+            f"merge={stats['merge_s']:>6.2f}s total={stats['seconds']:>8.2f}s "
+            f"{stats['pairs_per_s'] / 1e6:>8.1f} M pares/s"
+        )
+    for s in out[1:]:
+        print(f"speedup x{s['workers']}: {out[0]['score_s'] / s['score_s']:.2f} (ideal {s['workers'] / out[0]['workers']:.0f})")
+    return out
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Rematch completo necesidades x ofertas")
+    ap.add_argument("--workers", default=str(WORKERS), help="procesos (en --bench, lista: 1,2,4)")
+    ap.add_argument("--top-k", type=int, default=TOP_K)
+    ap.add_argument("--bench", type=int, default=0, help="benchmark sintético de N x N (sin base)")
+    args = ap.parse_args()
+    if args.bench:
+        benchmark(args.bench, [int(w) for w in args.workers.split(",")], top_k=args.top_k)
+        return
+    from db import init_db
+
+    init_db()
+    print(run_full_rematch(top_k=args.top_k, workers=int(args.workers)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""Recuperación local (sin LLM) sobre requerimientos abiertos y textos de ayuda.
+
+Índice invertido BM25 en memoria, reconstruido sólo cuando cambia la tabla de
+requerimientos (ver services.requirements_version). Lo usa ai.py tanto en modo
+local (respuesta con tabla) como para armar un contexto compacto para OpenAI.
+"""
+import math
+import threading
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import services as svc
+from matching import build_corpus
+from textnorm import tokenize, words
+
+# Textos de ayuda indexados junto con los requerimientos.
+HELP_DOCS: List[Dict[str, str]] = [
+    {
+        "title": "Publicar una oferta o necesidad",
+        "text": (
+            "Para publicar entrá en la pestaña Publicar, elegí el tipo (Oferta / Necesidad), completá título y "
+            "descripción, agregá tags (palabras clave) y, si querés, cámara, ubicación y adjuntos. Después tocá Publicar."
+        ),
+    },
+    {
+        "title": "Buscar y navegar requerimientos",
+        "text": (
+            "En la pestaña Navegar podés buscar por producto, palabra clave, empresa o tags, y filtrar por cámara, "
+            "tipo (necesidad u oferta) y estado (abierto o cerrado). Abrí un resultado para ver detalle y adjuntos."
+        ),
+    },
+    {
+        "title": "Solicitar contacto",
+        "text": (
+            "Desde un resultado en Navegar tocá Solicitar contacto. El dueño del requerimiento recibe la solicitud en "
+            "su Bandeja y, si la acepta, se habilita el contacto. Los precios se negocian fuera del sistema."
+        ),
+    },
+    {
+        "title": "Bandeja de solicitudes",
+        "text": (
+            "La Bandeja muestra las solicitudes de contacto recibidas pendientes (aceptar o rechazar) y tus "
+            "publicaciones, donde podés editar, cambiar la urgencia o cerrar un requerimiento."
+        ),
+    },
+    {
+        "title": "Panel y métricas",
+        "text": (
+            "El Panel muestra métricas: usuarios, requerimientos, abiertos, contactos pendientes y aceptados, y la "
+            "distribución de requerimientos por cámara. Los administradores además gestionan cámaras."
+        ),
+    },
+    {
+        "title": "Backups y restauración",
+        "text": (
+            "El Super Admin puede crear un backup (resguardo), descargar el último y restaurar uno anterior desde la "
+            "barra lateral. Al cerrar sesión se genera un backup automático."
+        ),
+    },
+    {
+        "title": "Usuarios, registro y roles",
+        "text": (
+            "Cualquiera puede registrarse con correo y contraseña. Roles: Admin (cámaras y tablero global), Cámara "
+            "(usuarios y tablero de su cámara) y Usuario (publica, navega, solicita y acepta contactos)."
+        ),
+    },
+]
+
+# Palabras de intención: filtran por tipo y no se usan como término de búsqueda.
+_OFFER_WORDS = {"ofrece", "ofrecen", "oferta", "ofertas", "vende", "venden", "provee", "proveen",
+                "proveedor", "proveedores", "fabrica", "fabrican", "offer", "offers", "sell", "sells"}
+_NEED_WORDS = {"necesita", "necesitan", "necesidad", "necesidades", "busca", "buscan", "compra", "compran",
+               "requiere", "requieren", "need", "needs", "buy", "buys"}
+
+_K1 = 1.2
+_B = 0.75
+
+
+class _Index:
+    def __init__(self, docs: List[Tuple[str, Dict[str, Any], str]]):
+        # docs: (kind, payload, text); kind = 'req' | 'help'
+        self.docs = docs
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self.lengths: List[int] = []
+        for i, (_, _, text) in enumerate(docs):
+            toks = tokenize(text)
+            self.lengths.append(len(toks))
+            for tok, tf in Counter(toks).items():
+                self.postings[tok].append((i, tf))
+        self.avgdl = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+
+    def search(self, terms: List[str], k: int, type_: Optional[str] = None) -> List[Tuple[float, int]]:
+        n = len(self.docs)
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(terms):
+            plist = self.postings.get(term)
+            if not plist:
+                continue
+            idf = math.log(1 + (n - len(plist) + 0.5) / (len(plist) + 0.5))
+            for i, tf in plist:
+                if type_ and self.docs[i][0] == "req" and self.docs[i][1].get("type") != type_:
+                    continue
+                dl = self.lengths[i] or 1
+                scores[i] += idf * tf * (_K1 + 1) / (tf + _K1 * (1 - _B + _B * dl / (self.avgdl or 1)))
+        return sorted(((s, i) for i, s in scores.items()), reverse=True)[:k]
+
+
+_LOCK = threading.Lock()
+_CACHE: Dict[str, Any] = {"version": None, "index": None}
+
+
+def _get_index() -> _Index:
+    version = svc.requirements_version()
+    with _LOCK:
+        if _CACHE["index"] is not None and _CACHE["version"] == version:
+            return _CACHE["index"]
+        # Filas con __slots__: el índice vive en memoria mientras no cambien los datos
+        rows = svc.list_open_requirements_for_index(shape="rows")
+        _, texts = build_corpus(rows)
+        docs: List[Tuple[str, Dict[str, Any], str]] = []
+        for r, t in zip(rows, texts):
+            docs.append(("req", r, " ".join([t, r.get("company") or "", r.get("chamber_name") or ""])))
+        for h in HELP_DOCS:
+            docs.append(("help", h, f"{h['title']} {h['text']}"))
+        idx = _Index(docs)
+        _CACHE["version"] = version
+        _CACHE["index"] = idx
+        return idx
+
+
+def detect_type(q: str) -> Optional[str]:
+    """'offer' / 'need' si la consulta pregunta por quién ofrece o quién necesita algo."""
+    ws = set(words(q))
+    if ws & _OFFER_WORDS:
+        return "offer"
+    if ws & _NEED_WORDS:
+        return "need"
+    return None
+
+
+def retrieve(q: str, k: int = 5) -> List[Dict[str, Any]]:
+    """Top-k pasajes para la consulta: [{'kind','score','doc'}], mezclando requerimientos y ayuda."""
+    type_ = detect_type(q)
+    terms = tokenize(" ".join(w for w in words(q) if w not in _OFFER_WORDS and w not in _NEED_WORDS))
+    if not terms:
+        return []
+    idx = _get_index()
+    out = []
+    for score, i in idx.search(terms, k, type_=type_):
+        kind, doc, _ = idx.docs[i]
+        out.append({"kind": kind, "score": round(score, 3), "doc": doc})
+    return out
+
+
+def hits_table(hits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Filas para st.dataframe con los requerimientos recuperados."""
+    rows = []
+    for h in hits:
+        if h["kind"] != "req":
+            continue
+        r = h["doc"]
+        rows.append(
+            {
+                "ID": r["id"],
+                "Tipo": "Oferta" if r.get("type") == "offer" else "Necesidad",
+                "Título": r.get("title"),
+                "Empresa": r.get("company"),
+                "Ubicación": r.get("location") or "",
+                "Cámara": r.get("chamber_name") or "",
+                "Relevancia": h["score"],
+            }
+        )
+    return rows
+
+
+def compact_context(hits: List[Dict[str, Any]], max_chars: int = 1500) -> str:
+    """Contexto corto (una línea por pasaje) para enviar al LLM."""
+    lines = []
+    used = 0
+    for h in hits:
+        d = h["doc"]
+        if h["kind"] == "req":
+            tipo = "Oferta" if d.get("type") == "offer" else "Necesidad"
+            desc = " ".join((d.get("description") or "").split())[:160]
+            line = f"- #{d['id']} [{tipo}] {d.get('title')} — {d.get('company') or '?'}"
+            if d.get("location"):
+                line += f", {d['location']}"
+            line += f": {desc}"
+        else:
+            line = f"- Ayuda ({d['title']}): {d['text']}"
+        if used + len(line) > max_chars:
+            break
+        lines.append(line)
+        used += len(line) + 1
+    return "\n".join(lines)
@@ -1,8 +1,20 @@
+import csv
+import io
+import json
 import re
 import uuid
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
-from db import UPLOAD_DIR, conn, now_iso
+import fuzzy
+import gazetteer
+import memo
+import metrics
+import simhash
+import storage
+import suggestions
+import tagging
+import vectors
+from db import UPLOAD_DIR, bump_data_version, db_generation, now_iso
 
 
 def _safe_filename(name: str) -> str:
@@ -12,15 +24,15 @@ def _safe_filename(name: str) -> str:
 
 
 # -------------------- Cámaras --------------------
-def list_chambers() -> List[dict]:
-    c = conn()
-    rows = c.execute(
-        "SELECT id, name, province, city FROM chambers ORDER BY name"
-    ).fetchall()
-    c.close()
-    return [dict(r) for r in rows]
+@memo.cached
+def list_chambers(shape: str = "dicts"):
+    """Chambers by name. `shape`: see storage.SHAPES ("frame" for the Panel table)."""
+    return storage.fetch(
+        "SELECT id, name, province, city, province_code, city_code FROM chambers ORDER BY name", shape=shape, read=True
+    )
 
 
+@memo.invalidates
 def create_chamber(name: str, location: Optional[str] = None) -> bool:
     name = (name or "").strip()
     if not name:
@@ -34,22 +46,25 @@ def create_chamber(name: str, location: Optional[str] = None) -> bool:
         else:
             city = location.strip()
 
-    c = conn()
+    c = storage.connect()
     cur = c.cursor()
     exists = cur.execute("SELECT 1 FROM chambers WHERE LOWER(name)=LOWER(?)", (name,)).fetchone()
     if exists:
         c.close()
         return False
+    province_code, city_code = gazetteer.resolve(city, province)
     cur.execute(
-        "INSERT INTO chambers(name, province, city, created_at) VALUES(?,?,?,?)",
-        (name, province, city, now_iso()),
+        "INSERT INTO chambers(name, province, city, province_code, city_code, created_at) VALUES(?,?,?,?,?,?)",
+        (name, province, city, province_code, city_code, now_iso()),
     )
     c.commit()
     c.close()
+    storage.get_backend().after_write()
     return True
 
 
 # -------------------- Requerimientos --------------------
+@memo.invalidates
 def create_requirement(
     type_: str,
     title: str,
@@ -62,12 +77,25 @@ def create_requirement(
     urgency: str = "Media",
     tags: str = "",
 ) -> int:
-    c = conn()
+    indexed = {"title": title, "description": description, "tags": tags, "category": category,
+               "company": company, "location": location}
+    sh = simhash.columns(indexed)
+    c = storage.connect()
     cur = c.cursor()
-    cur.execute(
-        """INSERT INTO requirements(type, title, description, category, urgency, tags, status,
-                                     company, location, chamber_id, user_id, created_at)
-           VALUES(?,?,?,?,?,?,?,?,?,?,?,?)""",
+    # Región normalizada al escribir; sin ubicación reconocible, la de la cámara
+    province_code, city_code = gazetteer.resolve(location)
+    if province_code is None and chamber_id:
+        ch = cur.execute(
+            "SELECT province_code, city_code FROM chambers WHERE id=?", (int(chamber_id),)
+        ).fetchone()
+        if ch:
+            province_code, city_code = ch["province_code"], ch["city_code"]
+    row = cur.execute(
+        f"""INSERT INTO requirements(type, title, description, category, urgency, tags, status,
+                                      company, location, province_code, city_code, chamber_id, user_id, created_at,
+                                      {', '.join(sh)})
+            VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?,?,{','.join('?' * len(sh))})
+            RETURNING id""",
         (
             type_,
             title.strip(),
@@ -78,17 +106,28 @@ def create_requirement(
             "open",
             company.strip(),
             location,
+            province_code,
+            city_code,
             chamber_id,
             int(user_id),
             now_iso(),
+            *sh.values(),
         ),
-    )
-    req_id = int(cur.lastrowid)
+    ).fetchone()
+    req_id = int(row["id"])
+    fuzzy.index_requirement(cur, req_id, indexed)
+    vectors.index_requirement(cur, req_id, indexed)
+    tagging.index_requirement(cur, req_id, tags)
+    # Sugerencias para las dos puntas: en segundo plano (suggestions.Worker)
+    suggestions.enqueue(cur, req_id)
+    bump_data_version(cur)
     c.commit()
     c.close()
+    storage.get_backend().after_write()
     return req_id
 
 
+@memo.invalidates
 def update_requirement(
     req_id: int,
     *,
@@ -122,14 +161,35 @@ def update_requirement(
     sets = ", ".join([f"{k}=?" for k in keys])
     vals = [fields[k] for k in keys] + [int(req_id)]
 
-    c = conn()
-    c.execute(f"UPDATE requirements SET {sets} WHERE id=?", vals)
+    c = storage.connect()
+    cur = c.cursor()
+    cur.execute(f"UPDATE requirements SET {sets} WHERE id=?", vals)
+    if any(k in fuzzy.INDEXED_FIELDS for k in keys):
+        row = cur.execute(
+            f"SELECT {', '.join(fuzzy.INDEXED_FIELDS)} FROM requirements WHERE id=?", (int(req_id),)
+        ).fetchone()
+        if row:
+            fuzzy.index_requirement(cur, int(req_id), dict(row))
+            if any(k in vectors.VECTOR_FIELDS for k in keys):
+                vectors.index_requirement(cur, int(req_id), dict(row))
+                sh = simhash.columns(dict(row))
+                cur.execute(
+                    f"UPDATE requirements SET {', '.join(f'{k}=?' for k in sh)} WHERE id=?",
+                    list(sh.values()) + [int(req_id)],
+                )
+    if "tags" in fields:
+        tagging.index_requirement(cur, int(req_id), fields["tags"])
+    if "status" in fields or any(k in vectors.VECTOR_FIELDS for k in keys):
+        suggestions.enqueue(cur, int(req_id))
+    bump_data_version(cur)
     c.commit()
     c.close()
+    storage.get_backend().after_write()
 
 
+@memo.cached
 def get_requirement(req_id: int) -> Optional[dict]:
-    c = conn()
+    c = storage.read_connect()
     row = c.execute(
         """SELECT r.*, u.name AS user_name, u.email AS user_email, u.phone AS user_phone,
                   ch.name AS chamber_name
@@ -143,17 +203,63 @@ def get_requirement(req_id: int) -> Optional[dict]:
     return dict(row) if row else None
 
 
+def _text_filter(q: str) -> Tuple[str, List[Any]]:
+    q = (q or "").strip()
+    if not q:
+        return "", []
+    like = f"%{q.lower()}%"
+    sql = """ AND (
+                LOWER(r.title) LIKE ? OR
+                LOWER(r.description) LIKE ? OR
+                LOWER(r.company) LIKE ? OR
+                LOWER(COALESCE(r.tags,'')) LIKE ?
+            )"""
+    return sql, [like, like, like, like]
+
+
+def _region_filter(region: Optional[str]) -> Tuple[str, List[Any]]:
+    """`region` is a province code ("AR-S") or a city code ("AR-S:rosario"), see gazetteer.py."""
+    if not region:
+        return "", []
+    col = "r.city_code" if gazetteer.is_city(region) else "r.province_code"
+    return f" AND {col}=?", [region]
+
+
+def _tag_filter(tag: Optional[str]) -> Tuple[str, List[Any]]:
+    name = tagging.normalize_tag(tag or "")
+    if not name:
+        return "", []
+    sql = """ AND r.id IN (
+                SELECT rt.requirement_id FROM requirement_tags rt
+                JOIN tags t ON t.id = rt.tag_id
+                WHERE t.name=?
+            )"""
+    return sql, [name]
+
+
+@memo.cached
+@metrics.timed("search_requirements")
 def search_requirements(
     q: str = "",
     type_: str = "(Todos)",
     status: str = "open",
     chamber_id: Optional[int] = None,
     limit: int = 200,
-) -> List[dict]:
-    q = (q or "").strip()
+    before: Optional[Tuple[str, int]] = None,
+    shape: str = "dicts",
+    category: Optional[str] = None,
+    urgency: Optional[str] = None,
+    tag: Optional[str] = None,
+    region: Optional[str] = None,
+):
+    """Requirements newest first. `before` = (created_at, id) of the last row of the previous page.
+
+    `tag` filters by exact (normalized) tag through requirement_tags; `region`
+    by province or city code (see _region_filter).
+    """
     sql = """SELECT r.id, r.type, r.title, r.description, r.category, r.urgency, r.tags,
-                    r.status, r.company, r.location, r.chamber_id, r.user_id, r.created_at,
-                    ch.name AS chamber_name
+                    r.status, r.company, r.location, r.province_code, r.city_code,
+                    r.chamber_id, r.user_id, r.created_at, ch.name AS chamber_name
              FROM requirements r
              LEFT JOIN chambers ch ON ch.id = r.chamber_id
              WHERE 1=1"""
@@ -171,40 +277,316 @@ def search_requirements(
         sql += " AND r.chamber_id=?"
         params.append(int(chamber_id))
 
-    if q:
-        like = f"%{q.lower()}%"
-        sql += """ AND (
-                    LOWER(r.title) LIKE ? OR
-                    LOWER(r.description) LIKE ? OR
-                    LOWER(r.company) LIKE ? OR
-                    LOWER(COALESCE(r.tags,'')) LIKE ?
-                )"""
-        params.extend([like, like, like, like])
-
-    sql += " ORDER BY r.created_at DESC LIMIT ?"
+    if category:
+        sql += " AND r.category=?"
+        params.append(category)
+
+    if urgency:
+        sql += " AND r.urgency=?"
+        params.append(urgency)
+
+    region_sql, region_params = _region_filter(region)
+    sql += region_sql
+    params.extend(region_params)
+
+    tag_sql, tag_params = _tag_filter(tag)
+    sql += tag_sql
+    params.extend(tag_params)
+
+    text_sql, text_params = _text_filter(q)
+    sql += text_sql
+    params.extend(text_params)
+
+    if before:
+        sql += " AND (r.created_at < ? OR (r.created_at = ? AND r.id < ?))"
+        params.extend([before[0], before[0], int(before[1])])
+
+    sql += " ORDER BY r.created_at DESC, r.id DESC LIMIT ?"
+    params.append(int(limit))
+
+    return storage.fetch(sql, params, shape=shape, read=True)
+
+
+@memo.cached
+def fuzzy_search_requirements(
+    q: str,
+    type_: str = "(Todos)",
+    status: str = "open",
+    chamber_id: Optional[int] = None,
+    category: Optional[str] = None,
+    urgency: Optional[str] = None,
+    limit: int = 20,
+    shape: str = "dicts",
+    tag: Optional[str] = None,
+    region: Optional[str] = None,
+):
+    """Typo/accent tolerant search (trigram similarity, see fuzzy.py), best match first.
+
+    Meant as a fallback when search_requirements finds nothing. Rows carry a
+    `similarity` column; there is no cursor (one ranked page).
+    """
+    filters = ""
+    params: List[Any] = []
+    for col, val in (("r.status", status), ("r.type", None if type_ == "(Todos)" else type_),
+                     ("r.chamber_id", int(chamber_id) if chamber_id else None),
+                     ("r.category", category), ("r.urgency", urgency)):
+        if val:
+            filters += f" AND {col}=?"
+            params.append(val)
+    for extra_sql, extra_params in (_region_filter(region), _tag_filter(tag)):
+        filters += extra_sql
+        params.extend(extra_params)
+    c = storage.connect()  # the term/trigram index is not part of the read snapshot
+    try:
+        ranked = fuzzy.search(c, q, filters, params, limit=limit)
+    finally:
+        c.close()
+    if not ranked:
+        return storage.shape_result([], [], shape)
+    scores = dict(ranked)
+    marks = ",".join("?" * len(scores))
+    rows = storage.fetch(
+        f"""SELECT r.id, r.type, r.title, r.description, r.category, r.urgency, r.tags,
+                   r.status, r.company, r.location, r.province_code, r.city_code,
+                   r.chamber_id, r.user_id, r.created_at, ch.name AS chamber_name
+            FROM requirements r
+            LEFT JOIN chambers ch ON ch.id = r.chamber_id
+            WHERE r.id IN ({marks})""",
+        list(scores),
+        shape="dicts",
+        read=True,
+    )
+    rows.sort(key=lambda r: (-scores[r["id"]], -r["id"]))
+    cols = list(rows[0].keys()) + ["similarity"] if rows else []
+    return storage.shape_result(cols, [tuple(r.values()) + (scores[r["id"]],) for r in rows], shape)
+
+
+FACETS = ("chamber", "type", "category", "urgency", "status", "province")
+
+
+@memo.cached
+def requirement_facets(
+    q: str = "",
+    type_: str = "(Todos)",
+    status: Optional[str] = "open",
+    chamber_id: Optional[int] = None,
+    category: Optional[str] = None,
+    urgency: Optional[str] = None,
+    tag: Optional[str] = None,
+    region: Optional[str] = None,
+) -> Dict[str, List[Dict[str, Any]]]:
+    """Counts per chamber/type/category/urgency/status/province for the text query `q` (and `tag`).
+
+    A single GROUP BY over the facet columns scans the matching rows once
+    and returns at most a few hundred combinations; the per-facet counts are
+    then folded from those groups in Python. Each facet is counted with the
+    *other* active filters applied (disjunctive faceting), so the UI can show
+    how many results switching that filter would give.
+    """
+    text_sql, params = _text_filter(q)
+    tag_sql, tag_params = _tag_filter(tag)
+    text_sql += tag_sql
+    params += tag_params
+    # Una ciudad es un filtro fijo (no es faceta); una provincia sí se cuenta como faceta
+    province = None
+    if region and gazetteer.is_city(region):
+        city_sql, city_params = _region_filter(region)
+        text_sql += city_sql
+        params += city_params
+    elif region:
+        province = region
+    groups = storage.fetch(
+        """SELECT r.chamber_id, MAX(ch.name) AS chamber_name, r.type, r.category, r.urgency, r.status,
+                  r.province_code, COUNT(*) AS n
+           FROM requirements r
+           LEFT JOIN chambers ch ON ch.id = r.chamber_id
+           WHERE 1=1""" + text_sql + """
+           GROUP BY r.chamber_id, r.type, r.category, r.urgency, r.status, r.province_code""",
+        params,
+        shape="rows",
+        read=True,
+    )
+    active = {
+        "chamber": int(chamber_id) if chamber_id else None,
+        "type": type_ if type_ and type_ != "(Todos)" else None,
+        "category": category or None,
+        "urgency": urgency or None,
+        "status": status or None,
+        "province": province,
+    }
+    counts: Dict[str, Dict[Any, int]] = {f: {} for f in FACETS}
+    names: Dict[Any, str] = {}
+    for g in groups:
+        values = {"chamber": g["chamber_id"], "type": g["type"], "category": g["category"],
+                  "urgency": g["urgency"], "status": g["status"], "province": g["province_code"]}
+        misses = [f for f in FACETS if active[f] is not None and values[f] != active[f]]
+        if len(misses) > 1:
+            continue
+        # Sin fallos: cuenta para todas las facetas; con uno: sólo para esa faceta
+        for f in misses or FACETS:
+            bucket = counts[f]
+            bucket[values[f]] = bucket.get(values[f], 0) + int(g["n"])
+        if g["chamber_id"] is not None:
+            names[g["chamber_id"]] = g["chamber_name"]
+    out: Dict[str, List[Dict[str, Any]]] = {}
+    for f in FACETS:
+        items = [{"value": v, "count": n} for v, n in counts[f].items()]
+        if f == "chamber":
+            for it in items:
+                it["label"] = names.get(it["value"]) or "(Sin cámara)"
+        elif f == "province":
+            for it in items:
+                it["label"] = gazetteer.region_label(it["value"])
+        items.sort(key=lambda it: (-it["count"], str(it.get("label", it["value"]))))
+        out[f] = items
+    return out
+
+
+def faceted_search(
+    q: str = "",
+    type_: str = "(Todos)",
+    status: str = "open",
+    chamber_id: Optional[int] = None,
+    category: Optional[str] = None,
+    urgency: Optional[str] = None,
+    limit: int = 20,
+    before: Optional[Tuple[str, int]] = None,
+    shape: str = "dicts",
+    tag: Optional[str] = None,
+    region: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Result page plus facet counts for the same query: {"items": [...], "facets": {...}}."""
+    items = search_requirements(
+        q=q, type_=type_, status=status, chamber_id=chamber_id, limit=limit, before=before,
+        shape=shape, category=category, urgency=urgency, tag=tag, region=region,
+    )
+    facets = requirement_facets(
+        q=q, type_=type_, status=status, chamber_id=chamber_id, category=category, urgency=urgency, tag=tag,
+        region=region,
+    )
+    return {"items": items, "facets": facets}
+
+
+# -------------------- Tags --------------------
+@memo.cached
+def popular_tags(limit: int = 20, status: Optional[str] = "open", shape: str = "dicts"):
+    """Most used tags (by number of requirements, optionally only with `status`)."""
+    sql = """SELECT t.name, t.label, COUNT(*) AS n
+             FROM requirement_tags rt
+             JOIN tags t ON t.id = rt.tag_id"""
+    params: List[Any] = []
+    if status:
+        sql += " JOIN requirements r ON r.id = rt.requirement_id WHERE r.status=?"
+        params.append(status)
+    sql += " GROUP BY t.id, t.name, t.label ORDER BY n DESC, t.name LIMIT ?"
     params.append(int(limit))
+    return storage.fetch(sql, params, shape=shape, read=True)
+
+
+def suggest_tags(prefix: str, limit: int = 10) -> List[Dict[str, Any]]:
+    """Prefix autocomplete from an in-memory sorted list (reloaded when requirements change)."""
+
+    def load():
+        return storage.fetch(
+            """SELECT t.name, t.label, COUNT(rt.requirement_id) AS n
+               FROM tags t
+               LEFT JOIN requirement_tags rt ON rt.tag_id = t.id
+               GROUP BY t.id, t.name, t.label
+               HAVING COUNT(rt.requirement_id) > 0""",
+            shape="rows",
+        )
+
+    return tagging.get_index(requirements_version(), load).suggest(prefix, limit)
 
-    c = conn()
-    rows = c.execute(sql, params).fetchall()
+
+@memo.cached
+def requirements_version() -> str:
+    """Requirements change counter, read through the same path as the browse queries.
+
+    It is bumped in every requirement write transaction and read from the read
+    snapshot when that is enabled, so a caller that reads it before the body never
+    gets a version newer than the data it serves. The DB generation keeps it from
+    repeating after a restore.
+    """
+    c = storage.read_connect()
+    row = c.execute("SELECT version FROM data_versions WHERE name='requirements'").fetchone()
     c.close()
-    return [dict(r) for r in rows]
+    return f"{db_generation()}:{row['version'] if row else 0}"
 
 
-def list_user_requirements(user_id: int, limit: int = 200) -> List[dict]:
-    c = conn()
-    rows = c.execute(
-        """SELECT id, type, title, description, category, urgency, tags, status, created_at, updated_at
-           FROM requirements
-           WHERE user_id=?
-           ORDER BY created_at DESC
-           LIMIT ?""",
-        (int(user_id), int(limit)),
-    ).fetchall()
+def contacts_version(user_id: Optional[int] = None) -> str:
+    """Cheap fingerprint of contact_requests (optionally only those received by user_id)."""
+    sql = "SELECT COUNT(*) AS n, MAX(id) AS max_id, MAX(responded_at) AS ts FROM contact_requests"
+    params: List[Any] = []
+    if user_id is not None:
+        sql += " WHERE to_user_id=?"
+        params.append(int(user_id))
+    c = storage.connect()
+    row = c.execute(sql, params).fetchone()
     c.close()
-    return [dict(r) for r in rows]
+    return f"{row['n']}:{row['max_id']}:{row['ts']}"
+
+
+def list_open_requirements_for_index(shape: str = "dicts"):
+    """Open requirements with the fields used by matching.build_corpus (for local retrieval)."""
+    return storage.fetch(
+        """SELECT r.id, r.type, r.title, r.description, r.category, r.tags, r.location,
+                  r.company, r.user_id, ch.name AS chamber_name
+           FROM requirements r
+           LEFT JOIN chambers ch ON ch.id = r.chamber_id
+           WHERE r.status='open'""",
+        shape=shape,
+    )
+
+
+EXPORT_COLUMNS = (
+    "id", "type", "title", "description", "category", "urgency", "tags", "status",
+    "company", "location", "chamber_name", "created_at", "updated_at",
+)
+
+
+def export_requirements_csv(status: Optional[str] = None) -> bytes:
+    """CSV (UTF-8) of all requirements, optionally by status.
+
+    Rows are streamed from the cursor (server-side on Postgres) straight into the
+    CSV writer; only the encoded file is held in memory.
+    """
+    sql = """SELECT r.id, r.type, r.title, r.description, r.category, r.urgency, r.tags, r.status,
+                    r.company, r.location, ch.name AS chamber_name, r.created_at, r.updated_at
+             FROM requirements r
+             LEFT JOIN chambers ch ON ch.id = r.chamber_id"""
+    params: List[Any] = []
+    if status:
+        sql += " WHERE r.status=?"
+        params.append(status)
+    sql += " ORDER BY r.id"
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(EXPORT_COLUMNS)
+    for r in storage.stream(sql, params):
+        w.writerow([r[k] for k in EXPORT_COLUMNS])
+    return buf.getvalue().encode("utf-8")
+
+
+@memo.cached
+def list_user_requirements(
+    user_id: int, limit: int = 200, before: Optional[Tuple[str, int]] = None, shape: str = "dicts"
+):
+    sql = """SELECT id, type, title, description, category, urgency, tags, status, province_code,
+                    created_at, updated_at
+             FROM requirements
+             WHERE user_id=?"""
+    params: List[Any] = [int(user_id)]
+    if before:
+        sql += " AND (created_at < ? OR (created_at = ? AND id < ?))"
+        params.extend([before[0], before[0], int(before[1])])
+    sql += " ORDER BY created_at DESC, id DESC LIMIT ?"
+    params.append(int(limit))
+    return storage.fetch(sql, params, shape=shape)
 
 
 # -------------------- Adjuntos --------------------
+@memo.invalidates
 def save_attachment(
     requirement_id: int,
     uploaded_by_user_id: int,
@@ -221,11 +603,12 @@ def save_attachment(
     with open(stored_path, "wb") as f:
         f.write(content)
 
-    c = conn()
+    c = storage.connect()
     cur = c.cursor()
-    cur.execute(
+    row = cur.execute(
         """INSERT INTO attachments(requirement_id, uploaded_by_user_id, filename, stored_path, mime, size, created_at)
-           VALUES(?,?,?,?,?,?,?)""",
+           VALUES(?,?,?,?,?,?,?)
+           RETURNING id""",
         (
             int(requirement_id),
             int(uploaded_by_user_id),
@@ -235,15 +618,17 @@ def save_attachment(
             len(content) if content is not None else None,
             now_iso(),
         ),
-    )
-    att_id = int(cur.lastrowid)
+    ).fetchone()
+    att_id = int(row["id"])
     c.commit()
     c.close()
+    storage.get_backend().after_write()
     return att_id
 
 
+@memo.cached
 def list_attachments(requirement_id: int) -> List[dict]:
-    c = conn()
+    c = storage.read_connect()
     rows = c.execute(
         """SELECT id, filename, stored_path, mime, size, created_at, uploaded_by_user_id
            FROM attachments
@@ -256,63 +641,356 @@ def list_attachments(requirement_id: int) -> List[dict]:
 
 
 # -------------------- Solicitudes de contacto --------------------
-def create_contact_request(from_user_id: int, to_user_id: int, requirement_id: int) -> int:
-    c = conn()
-    cur = c.cursor()
+_INSERT_PENDING_CONTACT = """INSERT INTO contact_requests(from_user_id, to_user_id, requirement_id, status, created_at)
+           VALUES(?,?,?,'pending',?)
+           ON CONFLICT(from_user_id, to_user_id, requirement_id) WHERE status='pending' DO NOTHING
+           RETURNING id"""
 
-    existing = cur.execute(
+
+def _insert_contact_request(cur, from_user_id: int, to_user_id: int, requirement_id: int) -> int:
+    """Single-statement, race-free insert (ux_contact_pending); returns the pending request id."""
+    inserted = cur.execute(
+        _INSERT_PENDING_CONTACT, (int(from_user_id), int(to_user_id), int(requirement_id), now_iso())
+    ).fetchone()
+    if inserted:
+        rid = int(inserted["id"])
+        _bump_pending(cur, from_user_id, to_user_id, +1)
+        _enqueue_event(cur, "contact_requested", {"request_id": rid})
+        return rid
+    # Ya existía una pendiente: devolvemos esa
+    row = cur.execute(
         """SELECT id FROM contact_requests
            WHERE from_user_id=? AND to_user_id=? AND requirement_id=? AND status='pending'""",
         (int(from_user_id), int(to_user_id), int(requirement_id)),
     ).fetchone()
-    if existing:
-        c.close()
-        return int(existing["id"])
+    return int(row["id"])
 
-    cur.execute(
-        """INSERT INTO contact_requests(from_user_id, to_user_id, requirement_id, status, created_at)
-           VALUES(?,?,?,?,?)""",
-        (int(from_user_id), int(to_user_id), int(requirement_id), "pending", now_iso()),
-    )
-    rid = int(cur.lastrowid)
+
+@memo.invalidates
+def create_contact_request(from_user_id: int, to_user_id: int, requirement_id: int) -> int:
+    c = storage.connect()
+    cur = c.cursor()
+    rid = _insert_contact_request(cur, from_user_id, to_user_id, requirement_id)
     c.commit()
     c.close()
     return rid
 
 
-def list_inbox(user_id: int, status: str = "pending", limit: int = 200) -> List[dict]:
-    c = conn()
-    rows = c.execute(
-        """SELECT cr.id, cr.status, cr.created_at, cr.responded_at,
-                  r.id AS requirement_id, r.title, r.type, r.company,
-                  u.id AS from_user_id, u.name AS from_name, u.email AS from_email, u.phone AS from_phone
-           FROM contact_requests cr
-           JOIN requirements r ON r.id = cr.requirement_id
-           JOIN users u ON u.id = cr.from_user_id
-           WHERE cr.to_user_id=? AND cr.status=?
-           ORDER BY cr.created_at DESC
+@memo.invalidates
+def create_contact_requests(from_user_id: int, targets: List[Tuple[int, int]]) -> List[int]:
+    """Batch version: targets = [(to_user_id, requirement_id), ...], all in one transaction."""
+    if not targets:
+        return []
+    c = storage.connect()
+    cur = c.cursor()
+    try:
+        ids = [_insert_contact_request(cur, from_user_id, to_uid, rid) for to_uid, rid in targets]
+        c.commit()
+    except Exception:
+        c.rollback()
+        raise
+    finally:
+        c.close()
+    return ids
+
+
+# -------------------- Casi duplicados --------------------
+def find_near_duplicates(
+    type_: str,
+    title: str,
+    description: str,
+    tags: str = "",
+    category: Optional[str] = None,
+    location: Optional[str] = None,
+    exclude_id: Optional[int] = None,
+    status: Optional[str] = "open",
+    limit: int = 5,
+) -> List[Dict[str, Any]]:
+    """Requirements of the same type whose SimHash is within simhash.MAX_DISTANCE bits, closest first.
+
+    Indexed band probes (see simhash.py); meant to warn before publishing.
+    """
+    h = simhash.fingerprint(
+        {"title": title, "description": description, "tags": tags, "category": category, "location": location}
+    )
+    cand, params = simhash.candidates_sql(h)
+    sql = f"""SELECT r.id, r.type, r.title, r.company, r.user_id, r.status, r.created_at, r.simhash
+              {cand} AND r.type=?"""
+    params.append(type_)
+    if status:
+        sql += " AND r.status=?"
+        params.append(status)
+    if exclude_id:
+        sql += " AND r.id<>?"
+        params.append(int(exclude_id))
+    rows = storage.fetch(sql, params, read=True)
+    out = simhash.near(h, rows)[:limit]
+    for r in out:
+        r.pop("simhash", None)
+    return out
+
+
+def duplicate_clusters(status: Optional[str] = "open", limit: int = 50) -> List[Dict[str, Any]]:
+    """Groups of near-duplicate requirements across the table (admin report), biggest first."""
+    c = storage.read_connect()
+    try:
+        groups = simhash.clusters(c, status=status)[:limit]
+    finally:
+        c.close()
+    if not groups:
+        return []
+    ids = [i for g in groups for i in g]
+    marks = ",".join("?" * len(ids))
+    info = {
+        r["id"]: r
+        for r in storage.fetch(
+            f"""SELECT r.id, r.type, r.title, r.company, r.user_id, r.status, r.created_at
+                FROM requirements r WHERE r.id IN ({marks})""",
+            ids,
+            read=True,
+        )
+    }
+    return [
+        {"size": len(g), "companies": len({info[i]["company"] for i in g if i in info}),
+         "items": [info[i] for i in g if i in info]}
+        for g in groups
+    ]
+
+
+# -------------------- Contrapartes --------------------
+COUNTERPART_CANDIDATE_CAP = 5000
+
+
+@memo.cached
+def suggest_counterparts(
+    requirement_id: int,
+    limit: int = 10,
+    same_category: bool = False,
+    same_chamber: bool = False,
+    region: Optional[str] = None,
+    cap: int = COUNTERPART_CANDIDATE_CAP,
+) -> List[Dict[str, Any]]:
+    """Open requirements of the opposite type most similar to `requirement_id`, best first.
+
+    Candidates are generated in SQL (opposite type, open, another user, optional
+    category/chamber/region, newest `cap`) and only their ids and precomputed
+    vectors (vectors.py) are loaded; display fields are read for the winners only.
+    Rows carry a `score` column (cosine similarity).
+    """
+    c = storage.connect()  # requirement_vectors is not part of the read snapshot
+    try:
+        target = c.execute(
+            """SELECT r.id, r.type, r.user_id, r.category, r.chamber_id, v.idx, v.val
+               FROM requirements r
+               LEFT JOIN requirement_vectors v ON v.requirement_id = r.id
+               WHERE r.id=?""",
+            (int(requirement_id),),
+        ).fetchone()
+        if not target or target["idx"] is None:
+            return []
+        idx, val = vectors.unpack(target["idx"], target["val"])
+        tvec = dict(zip(idx, val))
+        sql = """SELECT v.requirement_id, v.idx, v.val
+                 FROM requirements r
+                 JOIN requirement_vectors v ON v.requirement_id = r.id
+                 WHERE r.status='open' AND r.type=? AND r.user_id<>?"""
+        params: List[Any] = ["offer" if target["type"] == "need" else "need", int(target["user_id"])]
+        if same_category and target["category"]:
+            sql += " AND r.category=?"
+            params.append(target["category"])
+        if same_chamber and target["chamber_id"]:
+            sql += " AND r.chamber_id=?"
+            params.append(int(target["chamber_id"]))
+        region_sql, region_params = _region_filter(region)
+        sql += region_sql + " ORDER BY r.created_at DESC LIMIT ?"
+        params += region_params + [int(cap)]
+        ranked = vectors.rank(tvec, c.execute(sql, params).fetchall(), top_k=limit)
+    finally:
+        c.close()
+    if not ranked:
+        return []
+    scores = dict(ranked)
+    marks = ",".join("?" * len(scores))
+    rows = storage.fetch(
+        f"""SELECT r.id, r.type, r.title, r.company, r.category, r.urgency, r.location, r.province_code,
+                   r.city_code, r.chamber_id, r.user_id, r.created_at, ch.name AS chamber_name
+            FROM requirements r
+            LEFT JOIN chambers ch ON ch.id = r.chamber_id
+            WHERE r.id IN ({marks})""",
+        list(scores),
+        read=True,
+    )
+    for r in rows:
+        r["score"] = round(scores[r["id"]], 4)
+    rows.sort(key=lambda r: (-r["score"], -r["id"]))
+    return rows
+
+
+@memo.cached
+def list_match_suggestions(user_id: int, limit: int = 50, shape: str = "dicts"):
+    """Stored suggestions (see suggestions.py) for the user's open requirements, newest first."""
+    return storage.fetch(
+        """SELECT ms.requirement_id, mine.title AS my_title, ms.counterpart_id, r.type, r.title, r.company,
+                  r.province_code, r.city_code, r.user_id, ms.score, ms.created_at
+           FROM requirements mine
+           JOIN match_suggestions ms ON ms.requirement_id = mine.id
+           JOIN requirements r ON r.id = ms.counterpart_id
+           WHERE mine.user_id=? AND mine.status='open' AND r.status='open'
+           ORDER BY ms.created_at DESC, ms.score DESC
            LIMIT ?""",
-        (int(user_id), status, int(limit)),
-    ).fetchall()
+        (int(user_id), int(limit)),
+        shape=shape,
+    )
+
+
+@memo.invalidates
+def contact_all_matches(
+    requirement_id: int,
+    from_user_id: int,
+    top_k: int = 5,
+    region: Optional[str] = None,
+    same_category: bool = False,
+) -> List[int]:
+    """Send contact requests to the owners of the top counterparts of one of the user's requirements.
+
+    `region` (province or city code) restricts the candidates in SQL before scoring.
+    """
+    matches = [
+        r for r in suggest_counterparts(requirement_id, limit=top_k, same_category=same_category, region=region)
+        if int(r["user_id"]) != int(from_user_id)
+    ]
+    return create_contact_requests(from_user_id, [(int(r["user_id"]), int(r["id"])) for r in matches])
+
+
+def _enqueue_event(cur, event: str, payload: Dict[str, Any]) -> None:
+    """Transactional outbox: one INSERT in the caller's transaction; notify.py delivers it."""
+    ts = now_iso()
+    cur.execute(
+        "INSERT INTO outbox(event, payload, next_attempt_at, created_at) VALUES(?,?,?,?)",
+        (event, json.dumps(payload), ts, ts),
+    )
+
+
+def _bump_pending(cur, from_user_id: int, to_user_id: int, delta: int) -> None:
+    """Keep user_counters in sync (same transaction as the contact_requests write)."""
+    g = storage.get_backend().greatest
+    cur.execute(
+        f"""INSERT INTO user_counters(user_id, inbox_pending, sent_pending) VALUES(?, {g}(?,0), 0)
+            ON CONFLICT(user_id) DO UPDATE SET inbox_pending = {g}(user_counters.inbox_pending + ?, 0)""",
+        (int(to_user_id), delta, delta),
+    )
+    cur.execute(
+        f"""INSERT INTO user_counters(user_id, inbox_pending, sent_pending) VALUES(?, 0, {g}(?,0))
+            ON CONFLICT(user_id) DO UPDATE SET sent_pending = {g}(user_counters.sent_pending + ?, 0)""",
+        (int(from_user_id), delta, delta),
+    )
+
+
+@memo.cached
+def pending_counts(user_id: int) -> Dict[str, int]:
+    """Pending received/sent contact requests for a user (badge; no list query)."""
+    c = storage.connect()
+    row = c.execute(
+        "SELECT inbox_pending, sent_pending FROM user_counters WHERE user_id=?",
+        (int(user_id),),
+    ).fetchone()
     c.close()
-    return [dict(r) for r in rows]
+    if not row:
+        return {"inbox_pending": 0, "sent_pending": 0}
+    return {"inbox_pending": int(row["inbox_pending"]), "sent_pending": int(row["sent_pending"])}
+
+
+@memo.cached
+def list_inbox(
+    user_id: int,
+    status: str = "pending",
+    limit: int = 200,
+    before: Optional[Tuple[str, int]] = None,
+    shape: str = "dicts",
+):
+    """Contact requests received by user_id (served by ix_contact_to_status_created).
+
+    `before` = (created_at, id) of the last row of the previous page.
+    """
+    sql = """SELECT cr.id, cr.status, cr.created_at, cr.responded_at,
+                    r.id AS requirement_id, r.title, r.type, r.company,
+                    u.id AS from_user_id, u.name AS from_name, u.email AS from_email, u.phone AS from_phone
+             FROM contact_requests cr
+             JOIN requirements r ON r.id = cr.requirement_id
+             JOIN users u ON u.id = cr.from_user_id
+             WHERE cr.to_user_id=? AND cr.status=?"""
+    params: List[Any] = [int(user_id), status]
+    if before:
+        sql += " AND (cr.created_at < ? OR (cr.created_at = ? AND cr.id < ?))"
+        params.extend([before[0], before[0], int(before[1])])
+    sql += " ORDER BY cr.created_at DESC, cr.id DESC LIMIT ?"
+    params.append(int(limit))
 
+    return storage.fetch(sql, params, shape=shape)
 
+
+@memo.cached
+def list_sent(
+    user_id: int,
+    status: Optional[str] = "pending",
+    limit: int = 20,
+    before: Optional[Tuple[str, int]] = None,
+    shape: str = "dicts",
+):
+    """Contact requests sent by user_id, newest first.
+
+    Keyset pagination: pass the (created_at, id) of the last row of the previous
+    page as `before`. Served by ix_contact_from_status_created.
+    """
+    sql = """SELECT cr.id, cr.status, cr.created_at, cr.responded_at,
+                    r.id AS requirement_id, r.title, r.type, r.company,
+                    u.id AS to_user_id, u.name AS to_name
+             FROM contact_requests cr
+             JOIN requirements r ON r.id = cr.requirement_id
+             JOIN users u ON u.id = cr.to_user_id
+             WHERE cr.from_user_id=?"""
+    params: List[Any] = [int(user_id)]
+    if status:
+        sql += " AND cr.status=?"
+        params.append(status)
+    if before:
+        sql += " AND (cr.created_at < ? OR (cr.created_at = ? AND cr.id < ?))"
+        params.extend([before[0], before[0], int(before[1])])
+    sql += " ORDER BY cr.created_at DESC, cr.id DESC LIMIT ?"
+    params.append(int(limit))
+
+    return storage.fetch(sql, params, shape=shape)
+
+
+@memo.invalidates
 def respond_contact_request(request_id: int, status: str) -> None:
     if status not in ("accepted", "declined"):
         raise ValueError("status inválido")
-    c = conn()
-    c.execute(
-        "UPDATE contact_requests SET status=?, responded_at=? WHERE id=?",
+    c = storage.connect()
+    cur = c.cursor()
+    row = cur.execute(
+        """UPDATE contact_requests SET status=?, responded_at=?
+           WHERE id=? AND status='pending'
+           RETURNING from_user_id, to_user_id""",
         (status, now_iso(), int(request_id)),
-    )
+    ).fetchone()
+    if row:
+        _bump_pending(cur, row["from_user_id"], row["to_user_id"], -1)
+        _enqueue_event(cur, f"contact_{status}", {"request_id": int(request_id)})
+    else:
+        # Ya respondida: se permite cambiar la respuesta (no afecta contadores)
+        cur.execute(
+            "UPDATE contact_requests SET status=?, responded_at=? WHERE id=?",
+            (status, now_iso(), int(request_id)),
+        )
     c.commit()
     c.close()
 
 
 # -------------------- Métricas --------------------
+@memo.cached
 def admin_metrics() -> Dict[str, Any]:
-    c = conn()
+    c = storage.connect()
     cur = c.cursor()
 
     users = cur.execute("SELECT COUNT(*) AS n FROM users").fetchone()["n"]
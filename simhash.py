@@ -0,0 +1,165 @@
+"""Detección de casi-duplicados con SimHash (64 bits) sobre el texto de matching.build_corpus.
+
+Cada requerimiento guarda su huella en `requirements.simhash` y la parte en 4
+bandas de 16 bits (`sh_b0..sh_b3`, cada una con su índice). Dos huellas a
+distancia de Hamming <= 7 tienen por fuerza una banda que difiere en 0 o 1 bit,
+así que buscar casi-duplicados son 4 x 17 lecturas de índice (cada banda y sus
+16 variantes de un bit) y la distancia exacta se calcula sólo sobre esos pocos
+candidatos.
+
+Las publicaciones son textos cortos: una edición menor mueve 3-8 bits, dos
+publicaciones distintas del mismo rubro quedan a ~30.
+
+services.create_requirement / update_requirement guardan la huella en la misma
+transacción; `backfill` la calcula para las filas existentes.
+"""
+import hashlib
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import storage
+from matching import build_corpus
+from textnorm import tokenize
+
+BITS = 64
+BANDS = 4
+BAND_BITS = BITS // BANDS
+# Distancia máxima (bits distintos de 64) para considerar dos publicaciones casi iguales.
+# Con 4 bandas, a distancia <= 7 alguna banda difiere en <= 1 bit (ver probes()).
+MAX_DISTANCE = 2 * BANDS - 1
+BAND_COLUMNS = tuple(f"sh_b{i}" for i in range(BANDS))
+# Buckets más grandes que esto en el reporte se saltean (textos vacíos o genéricos)
+MAX_BUCKET = 200
+
+
+# Suma por bit empaquetada en un solo entero: cada bit del hash ocupa un carril de
+# _LANE bits, así sumar un feature son 8 búsquedas en tabla en vez de 64 sumas.
+_LANE = 32
+_SPREAD = [sum(1 << (_LANE * i) for i in range(8) if v >> i & 1) for v in range(256)]
+
+
+def _h64(feature: str) -> int:
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def _spread(h: int) -> int:
+    return sum(_SPREAD[b] << (8 * _LANE * i) for i, b in enumerate(h.to_bytes(8, "little")))
+
+
+def fingerprint(row: Dict[str, Any]) -> int:
+    """SimHash sin signo de una fila con los campos de build_corpus (palabras con stemming, peso = tf)."""
+    _, texts = build_corpus([dict(row, id=None)])
+    feats: Dict[str, int] = {}
+    for f in tokenize(texts[0]):
+        feats[f] = feats.get(f, 0) + 1
+    ones = sum(w * _spread(_h64(f)) for f, w in feats.items())
+    total = sum(feats.values())
+    mask = (1 << _LANE) - 1
+    return sum(1 << bit for bit in range(BITS) if 2 * ((ones >> (_LANE * bit)) & mask) > total)
+
+
+def to_signed(h: int) -> int:
+    """SQLite / Postgres guardan enteros de 64 bits con signo."""
+    return h - (1 << BITS) if h >= 1 << (BITS - 1) else h
+
+
+def bands(h: int) -> Tuple[int, ...]:
+    mask = (1 << BAND_BITS) - 1
+    return tuple((h >> (i * BAND_BITS)) & mask for i in range(BANDS))
+
+
+def distance(a: int, b: int) -> int:
+    return bin((a ^ b) & ((1 << BITS) - 1)).count("1")
+
+
+def columns(row: Dict[str, Any]) -> Dict[str, int]:
+    """{simhash, sh_b0..sh_b3} listos para el INSERT/UPDATE de requirements."""
+    h = fingerprint(row)
+    return dict(zip(("simhash",) + BAND_COLUMNS, (to_signed(h),) + bands(h)))
+
+
+# -------------------- Consultas --------------------
+def probes(h: int) -> List[Tuple[int, ...]]:
+    """Por banda: su valor y las BAND_BITS variantes que difieren en un bit."""
+    return [(b,) + tuple(b ^ (1 << i) for i in range(BAND_BITS)) for b in bands(h)]
+
+
+def candidates_sql(h: int) -> Tuple[str, List[int]]:
+    """(`FROM ... WHERE` con alias `r`, params) de los candidatos a distancia <= MAX_DISTANCE de `h`.
+
+    El CROSS JOIN fija el orden en SQLite: primero las lecturas de bandas, después
+    `requirements` por id (si no, el planner prefiere recorrer ix_req_status_type_created).
+    """
+    marks = ",".join("?" * (BAND_BITS + 1))
+    union = " UNION ".join(f"SELECT id FROM requirements WHERE {col} IN ({marks})" for col in BAND_COLUMNS)
+    return f"FROM ({union}) sh CROSS JOIN requirements r WHERE r.id = sh.id", [v for p in probes(h) for v in p]
+
+
+def near(h: int, rows: Iterable[Dict[str, Any]], max_distance: int = MAX_DISTANCE) -> List[Dict[str, Any]]:
+    """Filas (con `simhash`) a distancia <= max_distance de `h`, más cercanas primero; agrega `distance`."""
+    out = []
+    for r in rows:
+        d = distance(h, int(r["simhash"]))
+        if d <= max_distance:
+            out.append(dict(r, distance=d))
+    out.sort(key=lambda r: (r["distance"], -int(r["id"])))
+    return out
+
+
+def clusters(c, status: Optional[str] = "open", max_distance: int = MAX_DISTANCE) -> List[List[int]]:
+    """Grupos de ids casi duplicados en toda la tabla (union-find sobre los candidatos de cada fila)."""
+    parent: Dict[int, int] = {}
+
+    def find(x: int) -> int:
+        while parent.setdefault(x, x) != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    where = "WHERE r.simhash IS NOT NULL" + (" AND r.status=?" if status else "")
+    params: Sequence[Any] = (status,) if status else ()
+    hashes = {
+        int(r["id"]): int(r["simhash"])
+        for r in c.execute(f"SELECT r.id, r.simhash FROM requirements r {where}", params).fetchall()
+    }
+    flips = [1 << i for i in range(BAND_BITS)]
+    for col in range(BANDS):
+        buckets: Dict[int, List[int]] = {}
+        for rid, h in hashes.items():
+            buckets.setdefault(bands(h)[col], []).append(rid)
+        for v, ids in buckets.items():
+            if len(ids) > MAX_BUCKET:
+                continue
+            # Pares dentro del bucket y con los buckets vecinos (un bit de diferencia, cada par una vez)
+            pairs = [(a, b) for i, a in enumerate(ids) for b in ids[i + 1 :]]
+            for m in flips:
+                other = buckets.get(v ^ m)
+                if other and v ^ m > v and len(other) <= MAX_BUCKET:
+                    pairs.extend((a, b) for a in ids for b in other)
+            for a, b in pairs:
+                if find(a) != find(b) and distance(hashes[a], hashes[b]) <= max_distance:
+                    parent[find(a)] = find(b)
+    groups: Dict[int, List[int]] = {}
+    for x in parent:
+        groups.setdefault(find(x), []).append(x)
+    return sorted((sorted(g) for g in groups.values() if len(g) > 1), key=lambda g: (-len(g), g[0]))
+
+
+# -------------------- Backfill --------------------
+# Filas por executemany mientras se recorre requirements con storage.stream
+_BACKFILL_BATCH = 1000
+
+
+def backfill(c) -> int:
+    """Calcula simhash y bandas de todas las filas. Devuelve cuántas actualizó."""
+    cur = c.cursor()
+    sets = ", ".join(f"{k}=?" for k in ("simhash",) + BAND_COLUMNS)
+    done = 0
+    updates: List[Tuple] = []
+    for r in storage.stream("SELECT id, title, description, tags, category, location FROM requirements", c=c):
+        updates.append(tuple(columns(r).values()) + (int(r["id"]),))
+        if len(updates) >= _BACKFILL_BATCH:
+            cur.executemany(f"UPDATE requirements SET {sets} WHERE id=?", updates)
+            done += len(updates)
+            updates = []
+    cur.executemany(f"UPDATE requirements SET {sets} WHERE id=?", updates)
+    return done + len(updates)
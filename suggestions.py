@@ -0,0 +1,260 @@
+"""Sugerencias de contraparte incrementales, calculadas fuera del request path.
+
+services.create_requirement / update_requirement (cuando cambia el texto o el
+estado) encolan el requerimiento en `match_queue` en la misma transacción. Un
+hilo por proceso (Worker) toma lotes de la cola y, para cada requerimiento:
+- si ya no está abierto, borra las sugerencias en las que aparece;
+- si está abierto, lo puntúa sólo a él contra los vectores guardados
+  (vectors.py) de los abiertos del tipo opuesto de otros usuarios —O(n)
+  productos punto dispersos— y guarda los mejores en `match_suggestions`
+  para los dos lados, recortando la lista de cada contraparte a TOP_K; en las
+  listas de otras contrapartes donde ya figuraba se actualiza su puntaje (o se
+  quita si dejó de ser candidato), sin achicarlas.
+
+La cola se deduplica por requerimiento: varias ediciones seguidas se calculan
+una sola vez. `version` evita perder una edición que llega mientras el worker
+procesa la anterior.
+
+Configuración: CPF_SUGGEST_TOP_K, CPF_SUGGEST_BATCH, CPF_SUGGEST_POLL.
+"""
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+import storage
+import vectors
+from db import log, now_iso
+
+TOP_K = int(os.environ.get("CPF_SUGGEST_TOP_K", "10"))
+BATCH_SIZE = int(os.environ.get("CPF_SUGGEST_BATCH", "10"))
+POLL_SECONDS = float(os.environ.get("CPF_SUGGEST_POLL", "2"))
+MAX_ATTEMPTS = 5
+LEASE_SECONDS = 120
+_BACKOFF_BASE = 10.0
+
+
+def _iso(dt: datetime) -> str:
+    return dt.replace(microsecond=0).isoformat() + "Z"
+
+
+# -------------------- Cola --------------------
+def enqueue(cur, requirement_id: int) -> None:
+    """Encola (o re-encola) un requerimiento dentro de la transacción del llamador."""
+    ts = now_iso()
+    cur.execute(
+        """INSERT INTO match_queue(requirement_id, version, attempts, next_attempt_at, enqueued_at)
+           VALUES(?, 1, 0, ?, ?)
+           ON CONFLICT(requirement_id) DO UPDATE SET
+               version = match_queue.version + 1, attempts = 0, last_error = NULL,
+               next_attempt_at = excluded.next_attempt_at, enqueued_at = excluded.enqueued_at""",
+        (int(requirement_id), ts, ts),
+    )
+
+
+def _claim_batch(limit: int) -> List[Dict[str, Any]]:
+    """Toma hasta `limit` tareas vencidas con un lease (otros workers las saltean mientras tanto)."""
+    now = datetime.utcnow()
+    c = storage.connect()
+    rows = c.execute(
+        f"""UPDATE match_queue SET next_attempt_at=?
+           WHERE requirement_id IN (
+               SELECT requirement_id FROM match_queue
+               WHERE attempts < ? AND next_attempt_at <= ?
+               ORDER BY enqueued_at LIMIT ?{storage.get_backend().skip_locked}
+           )
+           RETURNING requirement_id, version, attempts""",
+        (_iso(now + timedelta(seconds=LEASE_SECONDS)), MAX_ATTEMPTS, _iso(now), int(limit)),
+    ).fetchall()
+    c.commit()
+    c.close()
+    return [dict(r) for r in rows]
+
+
+def _done(task: Dict[str, Any]) -> None:
+    c = storage.connect()
+    c.execute(
+        "DELETE FROM match_queue WHERE requirement_id=? AND version=?",
+        (int(task["requirement_id"]), int(task["version"])),
+    )
+    c.commit()
+    c.close()
+
+
+def _failed(task: Dict[str, Any], error: str) -> None:
+    attempts = int(task["attempts"]) + 1
+    delay = _BACKOFF_BASE * (2 ** (attempts - 1))
+    c = storage.connect()
+    c.execute(
+        """UPDATE match_queue SET attempts=?, last_error=?, next_attempt_at=?
+           WHERE requirement_id=? AND version=?""",
+        (attempts, error[:500], _iso(datetime.utcnow() + timedelta(seconds=delay)),
+         int(task["requirement_id"]), int(task["version"])),
+    )
+    c.commit()
+    c.close()
+
+
+# -------------------- Puntaje --------------------
+def score_requirement(requirement_id: int, top_k: int = TOP_K) -> int:
+    """Recalcula las sugerencias de un requerimiento (y su lugar en las de sus contrapartes).
+
+    Devuelve cuántas sugerencias quedaron para el requerimiento.
+    """
+    rid = int(requirement_id)
+    c = storage.connect()
+    cur = c.cursor()
+    try:
+        # Lectura y ranking primero, sin transacción de escritura abierta: en
+        # SQLite el primer DELETE toma el lock de escritura y lo retiene hasta
+        # el commit. (La cola trae `version`: una edición que llegue mientras
+        # tanto vuelve a encolar el requerimiento.)
+        target = cur.execute(
+            """SELECT r.type, r.status, r.user_id, v.idx, v.val
+               FROM requirements r
+               LEFT JOIN requirement_vectors v ON v.requirement_id = r.id
+               WHERE r.id=?""",
+            (rid,),
+        ).fetchone()
+        is_open = bool(target and target["status"] == "open" and target["idx"] is not None)
+        hits: List[Any] = []
+        # Contrapartes que ya tienen a rid en su lista: se re-puntúan, no se vacían
+        listed: Dict[int, float] = {}
+        if is_open:
+            listed = {
+                int(r["requirement_id"]): 0.0
+                for r in cur.execute(
+                    "SELECT requirement_id FROM match_suggestions WHERE counterpart_id=?", (rid,)
+                ).fetchall()
+            }
+            idx, val = vectors.unpack(target["idx"], target["val"])
+            vec = dict(zip(idx, val))
+            candidates = [
+                (int(r["requirement_id"]), r["idx"], r["val"])
+                for r in cur.execute(
+                    """SELECT v.requirement_id, v.idx, v.val
+                       FROM requirements r
+                       JOIN requirement_vectors v ON v.requirement_id = r.id
+                       WHERE r.status='open' AND r.type=? AND r.user_id<>?""",
+                    ("offer" if target["type"] == "need" else "need", int(target["user_id"])),
+                ).fetchall()
+            ]
+            hits = vectors.rank(vec, candidates, top_k=top_k)
+            for cid, cidx, cval in candidates:
+                if cid in listed:
+                    listed[cid] = vectors.dot(vec, *vectors.unpack(cidx, cval))
+            del candidates
+        c.commit()  # cierra la transacción de lectura (Postgres)
+
+        # Escritura corta: reemplazar la lista propia, re-puntuar y recortar
+        ts = now_iso()
+        if not is_open:
+            # Cerrado (o sin vector): sale de todas las listas
+            cur.execute("DELETE FROM match_suggestions WHERE requirement_id=? OR counterpart_id=?", (rid, rid))
+            c.commit()
+            return 0
+        cur.execute("DELETE FROM match_suggestions WHERE requirement_id=?", (rid,))
+        # El texto pudo cambiar: rid sigue en las listas que lo tenían, con el puntaje nuevo
+        gone = [(cid, rid) for cid, s in listed.items() if s <= 0]
+        if gone:
+            cur.executemany("DELETE FROM match_suggestions WHERE requirement_id=? AND counterpart_id=?", gone)
+        kept = [(round(s, 4), ts, cid, rid) for cid, s in listed.items() if s > 0]
+        if kept:
+            cur.executemany(
+                "UPDATE match_suggestions SET score=?, created_at=? WHERE requirement_id=? AND counterpart_id=?",
+                kept,
+            )
+        rows = [(rid, cid, round(s, 4), ts) for cid, s in hits] + [(cid, rid, round(s, 4), ts) for cid, s in hits]
+        if rows:
+            cur.executemany(
+                """INSERT INTO match_suggestions(requirement_id, counterpart_id, score, created_at) VALUES(?,?,?,?)
+                   ON CONFLICT(requirement_id, counterpart_id) DO UPDATE SET
+                       score=excluded.score, created_at=excluded.created_at""",
+                rows,
+            )
+        # Cada contraparte conserva sólo sus TOP_K mejores
+        for cid, _ in hits:
+            cur.execute(
+                """DELETE FROM match_suggestions
+                   WHERE requirement_id=? AND counterpart_id NOT IN (
+                       SELECT counterpart_id FROM match_suggestions WHERE requirement_id=?
+                       ORDER BY score DESC, counterpart_id DESC LIMIT ?
+                   )""",
+                (int(cid), int(cid), int(top_k)),
+            )
+        c.commit()
+        return len(hits)
+    except Exception:
+        c.rollback()
+        raise
+    finally:
+        c.close()
+
+
+def drain_once(batch_size: int = BATCH_SIZE) -> int:
+    """Procesa un lote de la cola. Devuelve cuántas tareas completó."""
+    done = 0
+    for task in _claim_batch(batch_size):
+        try:
+            score_requirement(task["requirement_id"])
+        except Exception as e:
+            _failed(task, f"{type(e).__name__}: {e}")
+            log("suggestions", "score_failed", f"req={task['requirement_id']}", str(e), level="WARNING")
+            continue
+        _done(task)
+        done += 1
+    return done
+
+
+def queue_stats() -> Dict[str, int]:
+    c = storage.connect()
+    row = c.execute(
+        "SELECT COUNT(*) AS n, SUM(CASE WHEN attempts >= ? THEN 1 ELSE 0 END) AS dead FROM match_queue",
+        (MAX_ATTEMPTS,),
+    ).fetchone()
+    c.close()
+    return {"pending": int(row["n"] or 0) - int(row["dead"] or 0), "dead": int(row["dead"] or 0)}
+
+
+# -------------------- Worker (hilo de fondo) --------------------
+class Worker(threading.Thread):
+    def __init__(self, poll_seconds: float = POLL_SECONDS):
+        super().__init__(name="cpf-match-suggestions", daemon=True)
+        self.poll_seconds = poll_seconds
+        self._stop_evt = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_evt.is_set():
+            try:
+                # Si el lote vino lleno seguimos sin esperar
+                if drain_once() >= BATCH_SIZE:
+                    continue
+            except Exception as e:
+                log("suggestions", "worker_error", str(e), level="ERROR")
+            self._stop_evt.wait(self.poll_seconds)
+
+    def stop(self) -> None:
+        self._stop_evt.set()
+
+
+_worker: Optional[Worker] = None
+_worker_lock = threading.Lock()
+
+
+def ensure_worker() -> Worker:
+    """Arranca (una vez por proceso) el worker de sugerencias."""
+    global _worker
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = Worker()
+            _worker.start()
+        return _worker
+
+
+def stop_worker() -> None:
+    global _worker
+    with _worker_lock:
+        if _worker is not None:
+            _worker.stop()
+            _worker.join(timeout=5)
+            _worker = None
@@ -0,0 +1,126 @@
+"""Tags normalizados: tabla `tags` + `requirement_tags` a partir de `requirements.tags`.
+
+`requirements.tags` sigue guardando el texto tal como lo escribió el usuario
+("Acero, inoxidable; Caños"). Acá se separa en tags, se normalizan (sin tildes,
+minúsculas, espacios simples) y se mantienen en dos tablas indexadas:
+- tags(id, name, label): name normalizado (único), label = primera forma vista
+- requirement_tags(tag_id, requirement_id)
+
+services.create_requirement / update_requirement los mantienen en la misma
+transacción; `rebuild` los rearma (backfill al crear las tablas).
+
+El autocompletado por prefijo se sirve de una lista ordenada en memoria
+(bisect), que se recarga cuando cambia la versión de los requerimientos.
+"""
+import bisect
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import storage
+from textnorm import norm_text
+
+_SPLIT_RE = re.compile(r"[,;\n]+")
+_SPACE_RE = re.compile(r"\s+")
+MAX_TAG_LEN = 40
+
+
+def parse_tags(raw: Optional[str]) -> List[Tuple[str, str]]:
+    """[(name, label)] sin repetidos, en el orden en que aparecen."""
+    out: List[Tuple[str, str]] = []
+    seen = set()
+    for part in _SPLIT_RE.split(raw or ""):
+        label = _SPACE_RE.sub(" ", part).strip().strip("#").strip()[:MAX_TAG_LEN]
+        name = norm_text(label)
+        if not name or name in seen:
+            continue
+        seen.add(name)
+        out.append((name, label))
+    return out
+
+
+def normalize_tag(tag: str) -> str:
+    return norm_text(_SPACE_RE.sub(" ", tag or "").strip().strip("#").strip()[:MAX_TAG_LEN])
+
+
+# -------------------- Mantenimiento --------------------
+def _tag_ids(cur, parsed: List[Tuple[str, str]]) -> List[int]:
+    for name, label in parsed:
+        cur.execute("INSERT INTO tags(name, label) VALUES(?,?) ON CONFLICT(name) DO NOTHING", (name, label))
+    if not parsed:
+        return []
+    names = [n for n, _ in parsed]
+    marks = ",".join("?" * len(names))
+    return [int(r["id"]) for r in cur.execute(f"SELECT id FROM tags WHERE name IN ({marks})", names).fetchall()]
+
+
+def index_requirement(cur, requirement_id: int, raw_tags: Optional[str]) -> None:
+    """(Re)asigna los tags de un requerimiento dentro de la transacción del llamador."""
+    global _GENERATION
+    _GENERATION += 1
+    cur.execute("DELETE FROM requirement_tags WHERE requirement_id=?", (int(requirement_id),))
+    ids = _tag_ids(cur, parse_tags(raw_tags))
+    if ids:
+        cur.executemany(
+            "INSERT INTO requirement_tags(tag_id, requirement_id) VALUES(?,?) ON CONFLICT DO NOTHING",
+            [(tid, int(requirement_id)) for tid in ids],
+        )
+
+
+def rebuild(c) -> int:
+    """Rearma tags/requirement_tags desde requirements.tags. Devuelve cuántas asignaciones creó."""
+    cur = c.cursor()
+    cur.execute("DELETE FROM requirement_tags")
+    parsed = [
+        (int(r["id"]), parse_tags(r["tags"]))
+        for r in storage.stream("SELECT id, tags FROM requirements WHERE COALESCE(tags,'') <> ''", c=c)
+    ]
+    labels: Dict[str, str] = {}
+    for _, tags in parsed:
+        for name, label in tags:
+            labels.setdefault(name, label)
+    cur.executemany(
+        "INSERT INTO tags(name, label) VALUES(?,?) ON CONFLICT(name) DO NOTHING", list(labels.items())
+    )
+    ids = {r["name"]: int(r["id"]) for r in storage.stream("SELECT id, name FROM tags", c=c)}
+    # parse_tags ya deduplica por nombre: cada par es único
+    return storage.bulk_insert(
+        "requirement_tags", ("tag_id", "requirement_id"),
+        ((ids[name], rid) for rid, tags in parsed for name, _ in tags), c=c,
+    )
+
+
+# -------------------- Autocompletado (en memoria) --------------------
+class TagIndex:
+    """Lista ordenada por nombre normalizado para búsquedas por prefijo con bisect."""
+
+    def __init__(self, rows: Iterable[Dict[str, Any]]):
+        items = sorted((r["name"], r["label"], int(r["n"])) for r in rows)
+        self.names = [n for n, _, _ in items]
+        self.items = items
+
+    def suggest(self, prefix: str, limit: int = 10) -> List[Dict[str, Any]]:
+        p = normalize_tag(prefix)
+        if not p:
+            top = sorted(self.items, key=lambda it: (-it[2], it[0]))[:limit]
+        else:
+            lo = bisect.bisect_left(self.names, p)
+            hi = bisect.bisect_left(self.names, p + "\uffff")
+            top = sorted(self.items[lo:hi], key=lambda it: (-it[2], it[0]))[:limit]
+        return [{"name": n, "label": lbl, "count": cnt} for n, lbl, cnt in top]
+
+
+_LOCK = threading.Lock()
+_CACHE: Dict[str, Any] = {"version": None, "index": None}
+# Cambios hechos por este proceso (la versión de la base tiene resolución de 1 s)
+_GENERATION = 0
+
+
+def get_index(version: str, load) -> TagIndex:
+    """TagIndex del proceso; `load()` devuelve filas {name, label, n} y se llama sólo si cambió `version`."""
+    version = f"{version}:{_GENERATION}"
+    with _LOCK:
+        if _CACHE["index"] is None or _CACHE["version"] != version:
+            _CACHE["index"] = TagIndex(load())
+            _CACHE["version"] = version
+        return _CACHE["index"]
@@ -0,0 +1,40 @@
+"""Fixtures comunes: cada test corre contra una base SQLite nueva en un directorio temporal."""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# db lee las rutas al importarse: se fijan antes de cualquier import del proyecto
+_TMP = Path(tempfile.mkdtemp(prefix="cpf-tests-"))
+os.environ["CPF_DB_BACKEND"] = "sqlite"
+os.environ["CPF_DB_PATH"] = str(_TMP / "cpf.db")
+os.environ["CPF_BACKUP_DIR"] = str(_TMP / "backups")
+os.environ["CPF_UPLOAD_DIR"] = str(_TMP / "uploads")
+os.environ["CPF_LOG_ARCHIVE_DIR"] = str(_TMP / "log_archive")
+os.environ["CPF_MAINT"] = "0"
+os.environ["CPF_READ_SNAPSHOT"] = "0"
+
+
+@pytest.fixture(autouse=True)
+def fresh_db(tmp_path, monkeypatch):
+    """Base vacía por test (esquema recién aplicado)."""
+    import db
+
+    monkeypatch.setattr(db, "DB_PATH", tmp_path / "cpf.db")
+    monkeypatch.setattr(db, "_SCHEMA_READY", False)
+    db.init_db()
+    yield db.DB_PATH
+
+
+@pytest.fixture
+def users():
+    """(necesita, ofrece): dos usuarios distintos, para que se sugieran entre sí."""
+    import auth
+
+    a = auth.create_user("necesita@example.com", "pw", "Ana", "Metalúrgica Sur", None, None)
+    b = auth.create_user("ofrece@example.com", "pw", "Beto", "Válvulas SA", None, None)
+    return a, b
@@ -0,0 +1,80 @@
+"""Reintentos de ai._chat_completion contra un servidor HTTP local que imita la API de OpenAI."""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("openai")
+
+import ai  # noqa: E402
+
+_COMPLETION = {
+    "id": "chatcmpl-test",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "test",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "hola"}, "finish_reason": "stop"}],
+}
+
+
+class _Stub(BaseHTTPRequestHandler):
+    # Por test: lista de acciones por request ("slow", 500 o "ok"); la última se repite
+    script = ["ok"]
+    calls = []
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        action = self.script[min(len(self.calls), len(self.script) - 1)]
+        self.calls.append(time.monotonic())
+        if action == "slow":
+            time.sleep(3)
+        if action == 500:
+            body, status = b'{"error": {"message": "boom"}}', 500
+        else:
+            body, status = json.dumps(_COMPLETION).encode(), 200
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        except OSError:
+            pass  # el cliente ya cortó por timeout
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _Stub)
+    srv.daemon_threads = True
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    monkeypatch.setenv("CPF_OPENAI_BASE_URL", f"http://127.0.0.1:{srv.server_address[1]}/v1")
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setattr(ai, "_BACKOFF_BASE", 0.05)
+    _Stub.calls = []
+    ai.reset_openai_client()
+    yield _Stub
+    srv.shutdown()
+    srv.server_close()
+    ai.reset_openai_client()
+
+
+def test_retries_server_errors_then_succeeds(stub):
+    stub.script = [500, 500, "ok"]
+    assert ai._chat_completion([{"role": "user", "content": "x"}], "test") == "hola"
+    assert len(stub.calls) == 3
+
+
+def test_slow_server_is_cut_at_the_deadline(stub, monkeypatch):
+    stub.script = ["slow"]
+    monkeypatch.setattr(ai, "OPENAI_DEADLINE", 1.5)
+    monkeypatch.setattr(ai, "OPENAI_READ_TIMEOUT", 10.0)
+    t0 = time.monotonic()
+    assert ai._chat_completion([{"role": "user", "content": "x"}], "test") is None
+    # El intento se recorta a lo que queda del deadline (no espera los 10 s de lectura)
+    assert time.monotonic() - t0 < 2.5
+    assert len(stub.calls) == 1
@@ -0,0 +1,50 @@
+"""ETag / If-None-Match de api.handle (sin levantar el servidor)."""
+import json
+
+import api
+import services as svc
+
+
+def _get(path, etag=None):
+    return api.handle(api.Request("GET", path, {"if-none-match": etag} if etag else {}, b""))
+
+
+def test_not_modified_until_the_requirement_changes(users):
+    _, b = users
+    rid = svc.create_requirement("offer", "Válvulas esféricas", "Acero inoxidable", b, "Válvulas SA")
+    status, headers, body = _get(f"/api/requirements/{rid}")
+    assert status == 200
+    etag = headers["ETag"]
+    assert _get(f"/api/requirements/{rid}", etag) == (304, {"ETag": etag}, b"")
+
+    svc.update_requirement(rid, title="Válvulas de bronce")
+    status, headers, body = _get(f"/api/requirements/{rid}", etag)
+    assert status == 200
+    assert headers["ETag"] != etag
+    assert json.loads(body)["title"] == "Válvulas de bronce"
+    assert _get(f"/api/requirements/{rid}", headers["ETag"])[0] == 304
+
+
+def test_list_etag_moves_with_new_requirements(users):
+    _, b = users
+    svc.create_requirement("offer", "Válvulas", "Acero", b, "Válvulas SA")
+    status, headers, _ = _get("/api/requirements?limit=5")
+    assert status == 200
+    etag = headers["ETag"]
+    assert _get("/api/requirements?limit=5", etag)[0] == 304
+    # Otra consulta, otro ETag aunque la versión de los datos sea la misma
+    assert _get("/api/requirements?limit=6")[1]["ETag"] != etag
+
+    svc.create_requirement("offer", "Bridas", "Acero", b, "Válvulas SA")
+    status, _, body = _get("/api/requirements?limit=5", etag)
+    assert status == 200
+    assert len(json.loads(body)["items"]) == 2
+
+
+def test_version_counter_is_bumped_in_the_write(users):
+    _, b = users
+    v0 = svc.requirements_version()
+    rid = svc.create_requirement("offer", "Válvulas", "Acero", b, "Válvulas SA")
+    v1 = svc.requirements_version()
+    svc.update_requirement(rid, urgency="Alta")
+    assert len({v0, v1, svc.requirements_version()}) == 3
@@ -0,0 +1,74 @@
+"""Outbox: encolado transaccional, entrega a un FileSink, reintentos y retención."""
+import json
+
+import notify
+import services as svc
+import storage
+
+
+class _FlakySink(notify.Sink):
+    name = "flaky"
+
+    def __init__(self):
+        self.fail = True
+
+    def send(self, events):
+        if self.fail:
+            raise OSError("caído")
+
+
+def _contact(users):
+    a, b = users
+    rid = svc.create_requirement("offer", "Válvulas esféricas", "Acero inoxidable", b, "Válvulas SA")
+    return svc.create_contact_request(a, b, rid)
+
+
+def test_enqueue_and_drain_to_file_sink(users, tmp_path):
+    request_id = _contact(users)
+    assert notify.outbox_stats() == {"pending": 1}
+    sink = notify.FileSink(str(tmp_path / "out.jsonl"))
+    assert notify.drain_once([sink]) == 1
+    assert notify.outbox_stats() == {"delivered": 1}
+    (line,) = (tmp_path / "out.jsonl").read_text(encoding="utf-8").splitlines()
+    ev = json.loads(line)
+    assert ev["event"] == "contact_requested"
+    assert ev["data"]["request_id"] == request_id
+    assert ev["data"]["to_email"] == "ofrece@example.com"
+    # Nada más para entregar
+    assert notify.drain_once([sink]) == 0
+
+
+def test_failed_sink_is_retried_without_resending_to_the_others(users, tmp_path):
+    _contact(users)
+    path = tmp_path / "out.jsonl"
+    flaky = _FlakySink()
+    sinks = [notify.FileSink(str(path)), flaky]
+    assert notify.drain_once(sinks) == 0
+    row = storage.fetch("SELECT status, attempts, delivered_sinks, last_error FROM outbox")[0]
+    assert (row["status"], row["attempts"], row["delivered_sinks"]) == ("pending", 1, "file")
+    assert "caído" in row["last_error"]
+
+    # Vence el backoff: el reintento sólo va al sink que falló
+    c = storage.connect()
+    c.execute("UPDATE outbox SET next_attempt_at='2000-01-01T00:00:00Z'")
+    c.commit()
+    c.close()
+    flaky.fail = False
+    assert notify.drain_once(sinks) == 1
+    assert len(path.read_text(encoding="utf-8").splitlines()) == 1
+    assert notify.outbox_stats() == {"delivered": 1}
+
+
+def test_purge_expires_stale_pending_and_deletes_old_rows(users):
+    _contact(users)
+    _contact(users)
+    c = storage.connect()
+    c.execute("UPDATE outbox SET created_at='2000-01-01T00:00:00Z' WHERE id=1")
+    c.execute(
+        "UPDATE outbox SET status='delivered', created_at='2000-01-01T00:00:00Z', "
+        "delivered_at='2000-01-01T00:00:00Z' WHERE id=2"
+    )
+    c.commit()
+    c.close()
+    assert notify.purge_outbox() == {"expired": 1, "deleted": 2}
+    assert notify.outbox_stats() == {}
@@ -0,0 +1,94 @@
+"""Cola de sugerencias (match_queue): encolado, toma con lease, cierre y la carrera de versiones."""
+import services as svc
+import storage
+import suggestions
+
+
+def _queue():
+    return {r["requirement_id"]: r["version"] for r in storage.fetch("SELECT requirement_id, version FROM match_queue")}
+
+
+def _enqueue(rid):
+    c = storage.connect()
+    suggestions.enqueue(c.cursor(), rid)
+    c.commit()
+    c.close()
+
+
+def _pairs():
+    return sorted(
+        (r["requirement_id"], r["counterpart_id"])
+        for r in storage.fetch("SELECT requirement_id, counterpart_id FROM match_suggestions")
+    )
+
+
+def test_publish_enqueues_and_drain_scores_both_sides(users):
+    a, b = users
+    offer = svc.create_requirement("offer", "Válvulas esféricas de acero", "Válvulas inoxidables", b, "Válvulas SA")
+    need = svc.create_requirement("need", "Busco válvulas esféricas", "Válvulas de acero inoxidable", a, "Metalúrgica Sur")
+    assert _queue() == {offer: 1, need: 1}
+    assert suggestions.drain_once() == 2
+    assert _queue() == {}
+    assert _pairs() == sorted([(need, offer), (offer, need)])
+
+    # Cerrar saca al requerimiento de todas las listas
+    svc.update_requirement(offer, status="closed")
+    suggestions.drain_once()
+    assert _pairs() == []
+
+
+def test_repeated_edits_are_deduplicated(users):
+    _, b = users
+    rid = svc.create_requirement("offer", "Válvulas", "Acero", b, "Válvulas SA")
+    svc.update_requirement(rid, title="Válvulas esféricas")
+    svc.update_requirement(rid, description="Acero inoxidable")
+    assert _queue() == {rid: 3}
+
+
+def test_claim_leases_the_task(users):
+    _, b = users
+    rid = svc.create_requirement("offer", "Válvulas", "Acero", b, "Válvulas SA")
+    (task,) = suggestions._claim_batch(10)
+    assert task["requirement_id"] == rid
+    # Mientras dura el lease otro worker no la toma
+    assert suggestions._claim_batch(10) == []
+    suggestions._done(task)
+    assert _queue() == {}
+
+
+def test_edit_during_scoring_is_not_lost(users):
+    _, b = users
+    rid = svc.create_requirement("offer", "Válvulas", "Acero", b, "Válvulas SA")
+    (task,) = suggestions._claim_batch(10)
+    # Llega una edición mientras el worker puntúa la versión anterior
+    _enqueue(rid)
+    suggestions._done(task)
+    assert _queue() == {rid: 2}
+    # La re-encolada se toma de nuevo en cuanto vence (attempts y backoff reiniciados)
+    assert [t["requirement_id"] for t in suggestions._claim_batch(10)] == [rid]
+
+
+def test_failed_task_backs_off(users):
+    _, b = users
+    rid = svc.create_requirement("offer", "Válvulas", "Acero", b, "Válvulas SA")
+    (task,) = suggestions._claim_batch(10)
+    suggestions._failed(task, "boom")
+    row = storage.fetch("SELECT attempts, last_error FROM match_queue WHERE requirement_id=?", (rid,))[0]
+    assert (row["attempts"], row["last_error"]) == (1, "boom")
+    assert suggestions._claim_batch(10) == []
+
+
+def test_rescoring_keeps_the_requirement_in_other_lists(users):
+    a, b = users
+    needs = [
+        svc.create_requirement("need", f"Válvulas de {m}", "Válvulas esféricas", a, "Metalúrgica Sur")
+        for m in ("bronce", "acero", "pvc")
+    ]
+    offer = svc.create_requirement("offer", "Válvulas", "Válvulas esféricas de bronce, acero y pvc", b, "Válvulas SA")
+    while suggestions.drain_once():
+        pass
+    # Con top_k=1 la lista propia se achica, pero la oferta sigue en la de cada necesidad
+    suggestions.score_requirement(offer, top_k=1)
+    pairs = _pairs()
+    assert len([p for p in pairs if p[0] == offer]) == 1
+    assert all((n, offer) in pairs for n in needs)
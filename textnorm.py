@@ -0,0 +1,44 @@
+import re
+import unicodedata
+from typing import List
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+# Palabras vacías (español + algunas en inglés) que no aportan a la búsqueda.
+STOPWORDS = frozenset(
+    """
+    a al algo algun alguna alguno algunos ante como con contra cual cuales cuando de del desde donde
+    e el ella ellos en entre es esa ese eso esta este esto hay la las le les lo los mas me mi mis muy
+    no nos o para pero por que quien quienes se si sin sobre su sus te tiene tienen un una unas uno unos
+    y ya yo cerca hola
+    the of and or for in on at to is are who what where how near
+    """.split()
+)
+
+
+def norm_text(s: str) -> str:
+    """Minúsculas sin tildes (misma normalización que usa la moderación en app.py)."""
+    s = s or ""
+    s = "".join(c for c in unicodedata.normalize("NFKD", s) if not unicodedata.combining(c))
+    return s.casefold()
+
+
+def stem(tok: str) -> str:
+    """Stemming muy liviano: saca plurales y corta a 6 letras (caño/caños, publico/publicar)."""
+    if len(tok) > 4 and tok.endswith("es"):
+        tok = tok[:-2]
+    elif len(tok) > 3 and tok.endswith("s"):
+        tok = tok[:-1]
+    return tok[:6]
+
+
+def words(s: str) -> List[str]:
+    """Palabras normalizadas (sin tildes ni puntuación), sin stemming."""
+    return _WORD_RE.findall(norm_text(s))
+
+
+def tokenize(s: str, drop_stopwords: bool = True) -> List[str]:
+    toks = words(s)
+    if drop_stopwords:
+        toks = [t for t in toks if t not in STOPWORDS]
+    return [stem(t) for t in toks if len(t) > 1]
@@ -0,0 +1,204 @@
+"""Vectores dispersos precalculados por requerimiento (para sugerir contrapartes).
+
+matching.top_matches arma un TF-IDF con todos los candidatos en cada llamada,
+así que el llamador tiene que traer a Python todas las publicaciones abiertas
+con sus descripciones. Acá cada requerimiento guarda su vector al escribirse:
+- features: palabras con stemming (textnorm.tokenize) y bigramas, hasheadas a DIM
+- peso: tf sublineal (1 + log tf) por el peso del campo, por el IDF del
+  feature (ln((1 + N) / (1 + df)) + 1, como el TfidfVectorizer de matching.py),
+  normalizado (L2)
+- requirement_vectors(requirement_id, idx BLOB, val BLOB) con array('I') / array('f')
+- vector_df(feature, df): en cuántos requerimientos aparece cada feature; se
+  actualiza en la misma transacción que el vector
+
+El IDF se aplica al guardar: un vector usa el df del momento en que se
+escribió. reweight (tarea "vectors" de maintenance.py) los recalcula con el df
+actual para que los viejos no queden con pesos desactualizados.
+
+La similitud es el producto punto (coseno, porque están normalizados). Para
+sugerir se generan los candidatos en SQL y sólo se cargan ids y vectores.
+"""
+import heapq
+import math
+import time
+import zlib
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import storage
+from textnorm import tokenize
+
+DIM = 1 << 18
+# Campos que forman el vector y su peso (el título pesa más que la descripción)
+FIELD_WEIGHTS = (("title", 2.0), ("tags", 1.5), ("category", 1.0), ("description", 1.0))
+VECTOR_FIELDS = tuple(f for f, _ in FIELD_WEIGHTS)
+# Parámetros por sentencia en las consultas de df (SQLite viejo admite 999)
+_DF_CHUNK = 500
+
+
+def _feature(tok: str) -> int:
+    return zlib.crc32(tok.encode("utf-8")) % DIM
+
+
+def term_weights(row: Dict[str, Any]) -> Dict[int, float]:
+    """{índice: tf sublineal ponderado por campo} de un requerimiento, sin IDF ni normalizar."""
+    tf: Dict[int, float] = {}
+    for field, weight in FIELD_WEIGHTS:
+        toks = tokenize(row[field] or "")
+        for t in toks + [f"{a} {b}" for a, b in zip(toks, toks[1:])]:
+            i = _feature(t)
+            tf[i] = tf.get(i, 0.0) + weight
+    return {i: 1.0 + math.log(w) if w >= 1.0 else w for i, w in tf.items()}
+
+
+def idf(df: int, n_docs: int) -> float:
+    return math.log((1.0 + n_docs) / (1.0 + df)) + 1.0
+
+
+def vectorize(
+    row: Dict[str, Any], idf_of: Optional[Dict[int, float]] = None, default_idf: float = 1.0
+) -> Dict[int, float]:
+    """{índice: peso} normalizado de un requerimiento (dict o fila con VECTOR_FIELDS).
+
+    `idf_of` da el IDF de cada feature (`default_idf` para los que no están);
+    sin él, sólo tf (todos los features pesan igual).
+    """
+    vec = term_weights(row)
+    if idf_of is not None:
+        vec = {i: w * idf_of.get(i, default_idf) for i, w in vec.items()}
+    norm = math.sqrt(sum(w * w for w in vec.values()))
+    return {i: w / norm for i, w in vec.items()} if norm else {}
+
+
+def pack(vec: Dict[int, float]) -> Tuple[bytes, bytes]:
+    idx = sorted(vec)
+    return array("I", idx).tobytes(), array("f", [vec[i] for i in idx]).tobytes()
+
+
+def unpack(idx: bytes, val: bytes) -> Tuple[array, array]:
+    a, b = array("I"), array("f")
+    a.frombytes(bytes(idx))
+    b.frombytes(bytes(val))
+    return a, b
+
+
+def dot(target: Dict[int, float], idx: array, val: array) -> float:
+    get = target.get
+    return sum(get(i, 0.0) * w for i, w in zip(idx, val))
+
+
+# -------------------- Mantenimiento --------------------
+def _df_of(cur, features: Sequence[int]) -> Dict[int, int]:
+    out: Dict[int, int] = {}
+    for k in range(0, len(features), _DF_CHUNK):
+        chunk = features[k : k + _DF_CHUNK]
+        marks = ",".join("?" * len(chunk))
+        for r in cur.execute(f"SELECT feature, df FROM vector_df WHERE feature IN ({marks})", chunk).fetchall():
+            out[int(r["feature"])] = int(r["df"])
+    return out
+
+
+def _idf_table(cur) -> Tuple[Dict[int, float], int]:
+    """IDF de todo el vocabulario y N, para recalcular muchos vectores de una vez."""
+    n = int(cur.execute("SELECT COUNT(*) AS n FROM requirement_vectors").fetchone()["n"])
+    return {int(r["feature"]): idf(int(r["df"]), n) for r in cur.execute("SELECT feature, df FROM vector_df").fetchall()}, n
+
+
+def index_requirement(cur, requirement_id: int, row: Dict[str, Any]) -> None:
+    """(Re)calcula el vector de un requerimiento y el df de sus features, en la transacción del llamador."""
+    rid = int(requirement_id)
+    tf = term_weights(row)
+    old = cur.execute("SELECT idx FROM requirement_vectors WHERE requirement_id=?", (rid,)).fetchone()
+    old_features = set(unpack(old["idx"], b"")[0]) if old else set()
+    added = [(i,) for i in tf if i not in old_features]
+    removed = [(i,) for i in old_features if i not in tf]
+    if added:
+        cur.executemany(
+            "INSERT INTO vector_df(feature, df) VALUES(?, 1) ON CONFLICT(feature) DO UPDATE SET df = vector_df.df + 1",
+            added,
+        )
+    if removed:
+        cur.executemany("UPDATE vector_df SET df = df - 1 WHERE feature=?", removed)
+    n = int(cur.execute("SELECT COUNT(*) AS n FROM requirement_vectors").fetchone()["n"]) + (0 if old else 1)
+    df = _df_of(cur, list(tf))
+    idx, val = pack(vectorize(row, {i: idf(df.get(i, 1), n) for i in tf}))
+    cur.execute(
+        """INSERT INTO requirement_vectors(requirement_id, idx, val) VALUES(?,?,?)
+           ON CONFLICT(requirement_id) DO UPDATE SET idx=excluded.idx, val=excluded.val""",
+        (rid, idx, val),
+    )
+
+
+def rebuild(c) -> int:
+    """Recalcula vector_df y todos los vectores desde `requirements`. Devuelve cuántos escribió."""
+    cur = c.cursor()
+    cur.execute("DELETE FROM requirement_vectors")
+    cur.execute("DELETE FROM vector_df")
+    # Primera pasada: tf compacto (arrays empaquetados) por fila y df; segunda: pesos con el IDF final
+    packed = [
+        (int(r["id"]), *pack(term_weights(r)))
+        for r in storage.stream(f"SELECT id, {', '.join(VECTOR_FIELDS)} FROM requirements", c=c)
+    ]
+    df: Dict[int, int] = {}
+    for _, idx, _ in packed:
+        for i in unpack(idx, b"")[0]:
+            df[i] = df.get(i, 0) + 1
+    storage.bulk_insert("vector_df", ("feature", "df"), df.items(), c=c)
+    n = len(packed)
+    idf_of = {i: idf(d, n) for i, d in df.items()}
+    storage.bulk_insert(
+        "requirement_vectors", ("requirement_id", "idx", "val"),
+        ((rid, *pack(_reweigh(idx, val, idf_of))) for rid, idx, val in packed), c=c,
+    )
+    return n
+
+
+def _reweigh(idx: bytes, val: bytes, idf_of: Dict[int, float]) -> Dict[int, float]:
+    a, b = unpack(idx, val)
+    vec = {i: w * idf_of.get(i, 1.0) for i, w in zip(a, b)}
+    norm = math.sqrt(sum(w * w for w in vec.values()))
+    return {i: w / norm for i, w in vec.items()} if norm else {}
+
+
+def reweight(c, deadline: Optional[float] = None, batch: int = 1000) -> Dict[str, Any]:
+    """Recalcula los vectores guardados con el df actual, en lotes con commit.
+
+    `deadline` (time.monotonic()) corta entre lotes; la próxima corrida empieza
+    de nuevo (los vectores son válidos en cualquier estado intermedio).
+    """
+    cur = c.cursor()
+    idf_of, n = _idf_table(cur)
+    c.commit()
+    # Features que aparecieron después de leer el df: raros, IDF alto
+    new_idf = idf(1, n)
+    # Si el texto cambió entre la lectura y la escritura, el vector ya lo rehízo index_requirement
+    same_text = " AND ".join(f"COALESCE(r.{f}, '')=?" for f in VECTOR_FIELDS)
+    done, last = 0, 0
+    while deadline is None or time.monotonic() < deadline:
+        rows = cur.execute(
+            f"SELECT id, {', '.join(VECTOR_FIELDS)} FROM requirements WHERE id>? ORDER BY id LIMIT ?",
+            (last, int(batch)),
+        ).fetchall()
+        if not rows:
+            return {"vectors": done, "docs": n, "complete": True}
+        cur.executemany(
+            f"""UPDATE requirement_vectors SET idx=?, val=?
+                WHERE requirement_id=? AND EXISTS (SELECT 1 FROM requirements r WHERE r.id=? AND {same_text})""",
+            [
+                (*pack(vectorize(r, idf_of, new_idf)), int(r["id"]), int(r["id"]), *(r[f] or "" for f in VECTOR_FIELDS))
+                for r in rows
+            ],
+        )
+        c.commit()
+        done += len(rows)
+        last = int(rows[-1]["id"])
+    return {"vectors": done, "docs": n, "complete": False}
+
+
+# -------------------- Consulta --------------------
+def rank(
+    target: Dict[int, float], candidates: Iterable[Tuple[int, Any, Any]], top_k: int = 10
+) -> List[Tuple[int, float]]:
+    """[(id, score)] de los `top_k` candidatos (id, idx, val) más parecidos, score > 0."""
+    scored = ((rid, dot(target, *unpack(idx, val))) for rid, idx, val in candidates)
+    return heapq.nlargest(top_k, ((rid, s) for rid, s in scored if s > 0), key=lambda x: (x[1], x[0]))